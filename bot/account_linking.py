@@ -1,13 +1,25 @@
 """
 Account Linking Manager
 Модуль для связывания веб-аккаунтов с Telegram аккаунтами
+
+Данные читаются из файла один раз и держатся в памяти вместе с индексами
+email -> web_user_id и telegram_id -> web_user_id (коды привязки хранятся
+словарём code -> запись), поэтому поиск при входе в веб-интерфейс не перебирает
+все аккаунты. Файл меняют и бот, и веб-интерфейс (отдельные процессы), поэтому
+при изменении файла извне (по mtime и размеру) данные перечитываются.
+Сроки кодов привязки лежат в куче (expires_at, code): очистка извлекает только
+наступившие сроки, а не разбирает даты всех кодов.
 """
+import copy
+import heapq
 import json
 import os
 import sys
 import secrets
 import string
+import threading
 from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
 
 # Добавляем корневую директорию проекта в sys.path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -18,20 +30,136 @@ from bot.user_manager import get_users_data, save_users_data, register_user
 # Файл для хранения данных привязки аккаунтов
 LINKING_FILE = os.path.join(DATA_DIR, "account_linking.json")
 
-def load_linking_data():
-    """Загрузить данные привязки аккаунтов"""
+# === КЭШ И ИНДЕКСЫ ===
+_linking_lock = threading.RLock()
+_linking_data: Optional[Dict] = None
+_linking_signature: Optional[Tuple[int, int]] = None
+_email_index: Dict[str, str] = {}
+_telegram_index: Dict[str, str] = {}
+# web_user_id -> (email, telegram_id), под которыми аккаунт сейчас в индексах
+_indexed_keys: Dict[str, Tuple[Optional[str], Optional[str]]] = {}
+# code -> expires_at (timestamp) и куча (expires_at, code) для кодов привязки
+_code_expiry: Dict[str, float] = {}
+_code_expiry_heap = []
+
+
+def _file_signature() -> Optional[Tuple[int, int]]:
+    try:
+        stat = os.stat(LINKING_FILE)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _read_linking_file() -> Dict:
+    data = {}
     if os.path.exists(LINKING_FILE):
         try:
             with open(LINKING_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except:
-            return {"web_users": {}, "pending_links": {}, "link_codes": {}}
-    return {"web_users": {}, "pending_links": {}, "link_codes": {}}
+                data = json.load(f)
+        except Exception:
+            data = {}
+    if not isinstance(data, dict):
+        data = {}
+    for key in ("web_users", "pending_links", "link_codes"):
+        if not isinstance(data.get(key), dict):
+            data[key] = {}
+    return data
+
+
+def _reindex_web_user(web_user_id: str) -> None:
+    """Обновить индексы для одного аккаунта после изменения email/telegram_id или удаления"""
+    old_email, old_telegram_id = _indexed_keys.pop(web_user_id, (None, None))
+    if old_email is not None and _email_index.get(old_email) == web_user_id:
+        del _email_index[old_email]
+    if old_telegram_id is not None and _telegram_index.get(old_telegram_id) == web_user_id:
+        del _telegram_index[old_telegram_id]
+
+    user_data = _linking_data["web_users"].get(web_user_id) if _linking_data else None
+    if not isinstance(user_data, dict):
+        return
+    email = user_data.get("email")
+    telegram_id = user_data.get("telegram_id")
+    telegram_id = str(telegram_id) if telegram_id is not None else None
+    # При дубликатах в старых данных побеждает первая запись — как при прежнем переборе
+    if email is not None:
+        _email_index.setdefault(email, web_user_id)
+    if telegram_id is not None:
+        _telegram_index.setdefault(telegram_id, web_user_id)
+    _indexed_keys[web_user_id] = (email, telegram_id)
+
+
+def _parse_expires_at(code_data) -> float:
+    try:
+        return datetime.fromisoformat(code_data["expires_at"]).timestamp()
+    except (KeyError, TypeError, ValueError):
+        return 0.0
+
+
+def _track_code_expiry(code, code_data) -> None:
+    expires_at = _parse_expires_at(code_data)
+    _code_expiry[code] = expires_at
+    heapq.heappush(_code_expiry_heap, (expires_at, code))
+
+
+def _rebuild_indexes() -> None:
+    _email_index.clear()
+    _telegram_index.clear()
+    _indexed_keys.clear()
+    for web_user_id in _linking_data["web_users"]:
+        _reindex_web_user(web_user_id)
+
+    _code_expiry.clear()
+    for code, code_data in _linking_data["link_codes"].items():
+        _code_expiry[code] = _parse_expires_at(code_data)
+    _code_expiry_heap[:] = [(expires_at, code) for code, expires_at in _code_expiry.items()]
+    heapq.heapify(_code_expiry_heap)
+
+
+def _get_linking_data() -> Dict:
+    """Данные привязки из памяти (перечитываются, если файл изменён другим процессом)"""
+    global _linking_data, _linking_signature
+    with _linking_lock:
+        signature = _file_signature()
+        if _linking_data is None or signature != _linking_signature:
+            _linking_data = _read_linking_file()
+            _linking_signature = signature
+            _rebuild_indexes()
+        return _linking_data
+
+
+def load_linking_data():
+    """
+    Загрузить данные привязки аккаунтов (копия: изменения вызывающего кода
+    не затрагивают общий кэш; для записи — save_linking_data)
+    """
+    with _linking_lock:
+        return copy.deepcopy(_get_linking_data())
 
 def save_linking_data(data):
-    """Сохранить данные привязки аккаунтов"""
-    with open(LINKING_FILE, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    """Сохранить данные привязки аккаунтов (атомарно, через временный файл)"""
+    global _linking_data, _linking_signature
+    with _linking_lock:
+        tmp_path = f"{LINKING_FILE}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, LINKING_FILE)
+        if data is not _linking_data:
+            _linking_data = data
+            _rebuild_indexes()
+        _linking_signature = _file_signature()
+
+
+def _find_by_email(email) -> Optional[str]:
+    _get_linking_data()
+    return _email_index.get(email)
+
+
+def _find_by_telegram_id(telegram_id) -> Optional[str]:
+    if telegram_id is None:
+        return None
+    _get_linking_data()
+    return _telegram_index.get(str(telegram_id))
 
 def generate_link_code():
     """Генерировать код для привязки аккаунта (6 символов)"""
@@ -42,36 +170,36 @@ def create_web_user(email, password_hash, first_name, last_name=None):
     Создать веб-пользователя без Telegram привязки
     Возвращает web_user_id
     """
-    linking_data = load_linking_data()
-    
-    # Генерируем уникальный ID для веб-пользователя
-    web_user_id = f"web_{int(datetime.now().timestamp())}"
-    
-    # Проверяем, есть ли уже пользователь с таким email
-    for wid, wuser in linking_data["web_users"].items():
-        if wuser.get("email") == email:
+    with _linking_lock:
+        linking_data = _get_linking_data()
+        
+        # Генерируем уникальный ID для веб-пользователя
+        web_user_id = f"web_{int(datetime.now().timestamp())}"
+        
+        # Проверяем, есть ли уже пользователь с таким email
+        if _find_by_email(email):
             return None  # Email уже занят
-    
-    linking_data["web_users"][web_user_id] = {
-        "email": email,
-        "password_hash": password_hash,
-        "first_name": first_name,
-        "last_name": last_name,
-        "created_at": datetime.now().isoformat(),
-        "telegram_id": None,  # Еще не привязан
-        "role": "initiator"  # По умолчанию
-    }
-    
-    save_linking_data(linking_data)
-    return web_user_id
+        
+        linking_data["web_users"][web_user_id] = {
+            "email": email,
+            "password_hash": password_hash,
+            "first_name": first_name,
+            "last_name": last_name,
+            "created_at": datetime.now().isoformat(),
+            "telegram_id": None,  # Еще не привязан
+            "role": "initiator"  # По умолчанию
+        }
+        _reindex_web_user(web_user_id)
+        
+        save_linking_data(linking_data)
+        return web_user_id
 
 def find_web_user_by_email(email):
     """Найти веб-пользователя по email"""
-    linking_data = load_linking_data()
-    
-    for web_user_id, user_data in linking_data["web_users"].items():
-        if user_data.get("email") == email:
-            return web_user_id, user_data
+    with _linking_lock:
+        web_user_id = _find_by_email(email)
+        if web_user_id:
+            return web_user_id, dict(_linking_data["web_users"][web_user_id])
     
     return None, None
 
@@ -80,7 +208,12 @@ def generate_linking_code_for_web_user(web_user_id):
     Генерировать код привязки для веб-пользователя
     Код действует 24 часа
     """
-    linking_data = load_linking_data()
+    with _linking_lock:
+        return _generate_linking_code(web_user_id)
+
+
+def _generate_linking_code(web_user_id):
+    linking_data = _get_linking_data()
     
     if web_user_id not in linking_data["web_users"]:
         return None
@@ -99,6 +232,7 @@ def generate_linking_code_for_web_user(web_user_id):
         "expires_at": (datetime.now() + timedelta(hours=24)).isoformat(),
         "used": False
     }
+    _track_code_expiry(link_code, linking_data["link_codes"][link_code])
     
     save_linking_data(linking_data)
     return link_code
@@ -107,7 +241,12 @@ def link_telegram_account(link_code, telegram_id, username, first_name, last_nam
     """
     Привязать Telegram аккаунт к веб-пользователю по коду
     """
-    linking_data = load_linking_data()
+    with _linking_lock:
+        return _link_telegram_account(link_code, telegram_id, username, first_name, last_name)
+
+
+def _link_telegram_account(link_code, telegram_id, username, first_name, last_name):
+    linking_data = _get_linking_data()
     
     # Проверяем код
     if link_code not in linking_data["link_codes"]:
@@ -120,8 +259,7 @@ def link_telegram_account(link_code, telegram_id, username, first_name, last_nam
         return {"success": False, "error": "Код уже использован"}
     
     # Проверяем что код не истек
-    expires_at = datetime.fromisoformat(code_data["expires_at"])
-    if datetime.now() > expires_at:
+    if datetime.now().timestamp() > _code_expiry.get(link_code, 0.0):
         return {"success": False, "error": "Код истек"}
     
     web_user_id = code_data["web_user_id"]
@@ -132,14 +270,14 @@ def link_telegram_account(link_code, telegram_id, username, first_name, last_nam
         return {"success": False, "error": "Аккаунт уже привязан к Telegram"}
     
     # Проверяем что этот Telegram ID не привязан к другому веб-аккаунту
-    for wid, wuser in linking_data["web_users"].items():
-        if wuser.get("telegram_id") == telegram_id:
-            return {"success": False, "error": "Этот Telegram аккаунт уже привязан к другому веб-аккаунту"}
+    if _find_by_telegram_id(telegram_id):
+        return {"success": False, "error": "Этот Telegram аккаунт уже привязан к другому веб-аккаунту"}
     
     # Выполняем привязку
     linking_data["web_users"][web_user_id]["telegram_id"] = telegram_id
     linking_data["web_users"][web_user_id]["telegram_username"] = username
     linking_data["web_users"][web_user_id]["linked_at"] = datetime.now().isoformat()
+    _reindex_web_user(web_user_id)
     
     # Отмечаем код как использованный
     linking_data["link_codes"][link_code]["used"] = True
@@ -164,69 +302,73 @@ def link_telegram_account(link_code, telegram_id, username, first_name, last_nam
 
 def get_web_user_by_telegram_id(telegram_id):
     """Получить веб-пользователя по Telegram ID"""
-    linking_data = load_linking_data()
-    telegram_id = str(telegram_id)  # Приводим к строке для корректного сравнения
-    
-    for web_user_id, user_data in linking_data["web_users"].items():
-        if user_data.get("telegram_id") == telegram_id:
-            return web_user_id, user_data
+    with _linking_lock:
+        web_user_id = _find_by_telegram_id(telegram_id)
+        if web_user_id:
+            return web_user_id, dict(_linking_data["web_users"][web_user_id])
     
     return None, None
 
 def get_telegram_id_by_web_user(web_user_id):
     """Получить Telegram ID по веб-пользователю"""
-    linking_data = load_linking_data()
-    
-    web_user = linking_data["web_users"].get(web_user_id)
-    if web_user:
-        return web_user.get("telegram_id")
+    with _linking_lock:
+        linking_data = _get_linking_data()
+        
+        web_user = linking_data["web_users"].get(web_user_id)
+        if web_user:
+            return web_user.get("telegram_id")
     
     return None
 
 def is_account_linked(web_user_id=None, telegram_id=None):
     """Проверить привязан ли аккаунт"""
-    linking_data = load_linking_data()
-    
-    if web_user_id:
-        web_user = linking_data["web_users"].get(web_user_id)
-        return web_user and web_user.get("telegram_id") is not None
-    
-    if telegram_id:
-        for web_user_id, user_data in linking_data["web_users"].items():
-            if user_data.get("telegram_id") == telegram_id:
-                return True
+    with _linking_lock:
+        linking_data = _get_linking_data()
+        
+        if web_user_id:
+            web_user = linking_data["web_users"].get(web_user_id)
+            return web_user and web_user.get("telegram_id") is not None
+        
+        if telegram_id:
+            return _find_by_telegram_id(telegram_id) is not None
     
     return False
 
 def cleanup_expired_codes():
-    """Очистить истекшие коды привязки"""
-    linking_data = load_linking_data()
-    
-    now = datetime.now()
-    expired_codes = []
-    
-    for code, code_data in linking_data["link_codes"].items():
-        expires_at = datetime.fromisoformat(code_data["expires_at"])
-        if now > expires_at:
+    """Очистить истекшие коды привязки (вызывается фоновой задачей invite_manager)"""
+    with _linking_lock:
+        linking_data = _get_linking_data()
+        
+        now = datetime.now().timestamp()
+        expired_codes = []
+        
+        while _code_expiry_heap and _code_expiry_heap[0][0] < now:
+            expires_at, code = heapq.heappop(_code_expiry_heap)
+            if _code_expiry.get(code) != expires_at or code not in linking_data["link_codes"]:
+                continue
             expired_codes.append(code)
-    
-    for code in expired_codes:
-        del linking_data["link_codes"][code]
-    
-    if expired_codes:
-        save_linking_data(linking_data)
-    
-    return len(expired_codes)
+        
+        for code in expired_codes:
+            del linking_data["link_codes"][code]
+            _code_expiry.pop(code, None)
+        
+        if expired_codes:
+            save_linking_data(linking_data)
+        
+        return len(expired_codes)
 
 def get_linking_stats():
     """Получить статистику привязки аккаунтов"""
-    linking_data = load_linking_data()
-    
-    total_web_users = len(linking_data["web_users"])
-    linked_accounts = sum(1 for user in linking_data["web_users"].values() 
-                         if user.get("telegram_id") is not None)
-    pending_codes = sum(1 for code in linking_data["link_codes"].values() 
-                       if not code["used"] and datetime.fromisoformat(code["expires_at"]) > datetime.now())
+    now = datetime.now().timestamp()
+    # Фоновая очистка кодов меняет общий словарь из другого потока — считаем под блокировкой
+    with _linking_lock:
+        linking_data = _get_linking_data()
+        
+        total_web_users = len(linking_data["web_users"])
+        linked_accounts = sum(1 for user in linking_data["web_users"].values() 
+                             if user.get("telegram_id") is not None)
+        pending_codes = sum(1 for code, code_data in linking_data["link_codes"].items()
+                           if not code_data["used"] and _code_expiry.get(code, 0.0) > now)
     
     return {
         "total_web_users": total_web_users,
@@ -246,27 +388,28 @@ def authenticate_web_user(email, password_hash):
 
 def update_web_user_role(web_user_id, new_role):
     """Обновить роль веб-пользователя и связанного Telegram аккаунта"""
-    linking_data = load_linking_data()
-    
-    if web_user_id not in linking_data["web_users"]:
-        return False
-    
-    # Обновляем роль веб-пользователя
-    linking_data["web_users"][web_user_id]["role"] = new_role
+    with _linking_lock:
+        linking_data = _get_linking_data()
+        
+        if web_user_id not in linking_data["web_users"]:
+            return False
+        
+        # Обновляем роль веб-пользователя
+        linking_data["web_users"][web_user_id]["role"] = new_role
+        telegram_id = linking_data["web_users"][web_user_id].get("telegram_id")
+        save_linking_data(linking_data)
     
     # Если есть привязанный Telegram аккаунт, обновляем и его роль
-    telegram_id = linking_data["web_users"][web_user_id].get("telegram_id")
     if telegram_id:
         from bot.user_manager import set_user_role
         set_user_role(telegram_id, new_role)
     
-    save_linking_data(linking_data)
     return True
 
 def get_all_web_users():
-    """Получить всех веб-пользователей"""
-    linking_data = load_linking_data()
-    return linking_data["web_users"]
+    """Получить всех веб-пользователей (копия)"""
+    with _linking_lock:
+        return copy.deepcopy(_get_linking_data()["web_users"])
 
 
 def admin_change_password(web_user_id, new_password_hash):
@@ -277,18 +420,19 @@ def admin_change_password(web_user_id, new_password_hash):
     import logging
     logger = logging.getLogger(__name__)
     
-    linking_data = load_linking_data()
-    
-    if web_user_id not in linking_data["web_users"]:
-        logger.error(f"admin_change_password: web_user_id {web_user_id} не найден")
-        return {"success": False, "error": "Пользователь не найден"}
-    
-    # Меняем пароль
-    linking_data["web_users"][web_user_id]["password_hash"] = new_password_hash
-    linking_data["web_users"][web_user_id]["password_changed_at"] = datetime.now().isoformat()
-    linking_data["web_users"][web_user_id]["password_changed_by_admin"] = True  # Отмечаем что админ менял пароль
-    
-    save_linking_data(linking_data)
+    with _linking_lock:
+        linking_data = _get_linking_data()
+        
+        if web_user_id not in linking_data["web_users"]:
+            logger.error(f"admin_change_password: web_user_id {web_user_id} не найден")
+            return {"success": False, "error": "Пользователь не найден"}
+        
+        # Меняем пароль
+        linking_data["web_users"][web_user_id]["password_hash"] = new_password_hash
+        linking_data["web_users"][web_user_id]["password_changed_at"] = datetime.now().isoformat()
+        linking_data["web_users"][web_user_id]["password_changed_by_admin"] = True  # Отмечаем что админ менял пароль
+        
+        save_linking_data(linking_data)
     logger.info(f"admin_change_password: Пароль изменен для web_user_id {web_user_id}")
     
     return {"success": True, "message": "Пароль успешно изменен администратором"}
@@ -302,24 +446,26 @@ def admin_update_email(web_user_id, new_email):
     import logging
     logger = logging.getLogger(__name__)
     
-    linking_data = load_linking_data()
-    
-    if web_user_id not in linking_data["web_users"]:
-        logger.error(f"admin_update_email: web_user_id {web_user_id} не найден")
-        return {"success": False, "error": "Пользователь не найден"}
-    
-    # Проверяем, не занят ли уже такой email
-    for wid, wuser in linking_data["web_users"].items():
-        if wid != web_user_id and wuser.get("email") == new_email:
+    with _linking_lock:
+        linking_data = _get_linking_data()
+        
+        if web_user_id not in linking_data["web_users"]:
+            logger.error(f"admin_update_email: web_user_id {web_user_id} не найден")
+            return {"success": False, "error": "Пользователь не найден"}
+        
+        # Проверяем, не занят ли уже такой email
+        owner = _find_by_email(new_email)
+        if owner and owner != web_user_id:
             logger.warning(f"admin_update_email: Email {new_email} уже используется")
             return {"success": False, "error": "Email уже используется другим пользователем"}
-    
-    # Меняем email
-    old_email = linking_data["web_users"][web_user_id].get("email", "")
-    linking_data["web_users"][web_user_id]["email"] = new_email
-    linking_data["web_users"][web_user_id]["email_changed_at"] = datetime.now().isoformat()
-    
-    save_linking_data(linking_data)
+        
+        # Меняем email
+        old_email = linking_data["web_users"][web_user_id].get("email", "")
+        linking_data["web_users"][web_user_id]["email"] = new_email
+        linking_data["web_users"][web_user_id]["email_changed_at"] = datetime.now().isoformat()
+        _reindex_web_user(web_user_id)
+        
+        save_linking_data(linking_data)
     logger.info(f"admin_update_email: Email изменен с {old_email} на {new_email} для web_user_id {web_user_id}")
     
     return {"success": True, "message": f"Email успешно изменен с {old_email} на {new_email}"}
@@ -330,29 +476,30 @@ def admin_create_web_user(email, password_hash, first_name, last_name=None, role
     Создать веб-пользователя администратором
     Возвращает web_user_id или None в случае ошибки
     """
-    linking_data = load_linking_data()
-    
-    # Проверяем, есть ли уже пользователь с таким email
-    for wid, wuser in linking_data["web_users"].items():
-        if wuser.get("email") == email:
+    with _linking_lock:
+        linking_data = _get_linking_data()
+        
+        # Проверяем, есть ли уже пользователь с таким email
+        if _find_by_email(email):
             return None  # Email уже занят
-    
-    # Генерируем уникальный ID для веб-пользователя
-    web_user_id = f"web_{int(datetime.now().timestamp())}"
-    
-    linking_data["web_users"][web_user_id] = {
-        "email": email,
-        "password_hash": password_hash,
-        "first_name": first_name,
-        "last_name": last_name,
-        "created_at": datetime.now().isoformat(),
-        "telegram_id": None,  # Еще не привязан
-        "role": role,
-        "created_by_admin": True  # Отмечаем что создан админом
-    }
-    
-    save_linking_data(linking_data)
-    return web_user_id
+        
+        # Генерируем уникальный ID для веб-пользователя
+        web_user_id = f"web_{int(datetime.now().timestamp())}"
+        
+        linking_data["web_users"][web_user_id] = {
+            "email": email,
+            "password_hash": password_hash,
+            "first_name": first_name,
+            "last_name": last_name,
+            "created_at": datetime.now().isoformat(),
+            "telegram_id": None,  # Еще не привязан
+            "role": role,
+            "created_by_admin": True  # Отмечаем что создан админом
+        }
+        _reindex_web_user(web_user_id)
+        
+        save_linking_data(linking_data)
+        return web_user_id
 
 
 def change_password(web_user_id, old_password_hash, new_password_hash):
@@ -361,25 +508,26 @@ def change_password(web_user_id, old_password_hash, new_password_hash):
     Если web_user_id = None, создаёт новый веб-аккаунт
     Возвращает словарь с результатом операции
     """
-    linking_data = load_linking_data()
-    
-    # Если пользователя нет и старый пароль пуст - создаём новый аккаунт
-    if web_user_id is None or (web_user_id not in linking_data["web_users"] and old_password_hash == ""):
-        return {"success": False, "error": "Используйте функцию создания аккаунта"}
-    
-    if web_user_id not in linking_data["web_users"]:
-        return {"success": False, "error": "Пользователь не найден"}
-    
-    # Проверяем старый пароль
-    current_password_hash = linking_data["web_users"][web_user_id].get("password_hash", "")
-    if current_password_hash and current_password_hash != old_password_hash:
-        return {"success": False, "error": "Неверный текущий пароль"}
-    
-    # Меняем пароль
-    linking_data["web_users"][web_user_id]["password_hash"] = new_password_hash
-    linking_data["web_users"][web_user_id]["password_changed_at"] = datetime.now().isoformat()
-    
-    save_linking_data(linking_data)
+    with _linking_lock:
+        linking_data = _get_linking_data()
+        
+        # Если пользователя нет и старый пароль пуст - создаём новый аккаунт
+        if web_user_id is None or (web_user_id not in linking_data["web_users"] and old_password_hash == ""):
+            return {"success": False, "error": "Используйте функцию создания аккаунта"}
+        
+        if web_user_id not in linking_data["web_users"]:
+            return {"success": False, "error": "Пользователь не найден"}
+        
+        # Проверяем старый пароль
+        current_password_hash = linking_data["web_users"][web_user_id].get("password_hash", "")
+        if current_password_hash and current_password_hash != old_password_hash:
+            return {"success": False, "error": "Неверный текущий пароль"}
+        
+        # Меняем пароль
+        linking_data["web_users"][web_user_id]["password_hash"] = new_password_hash
+        linking_data["web_users"][web_user_id]["password_changed_at"] = datetime.now().isoformat()
+        
+        save_linking_data(linking_data)
     
     return {"success": True, "message": "Пароль успешно изменен"}
 
@@ -398,26 +546,29 @@ def create_or_update_web_credentials(telegram_id, username, password_hash, email
     Returns:
         dict: результат операции
     """
-    from bot.user_manager import get_user_role, get_user_data
+    from bot.user_manager import get_user_role
     
     # Проверяем роль пользователя
     user_role = get_user_role(telegram_id)
     if user_role == 'user':
         return {"success": False, "error": "Пользователи с ролью 'user' не могут создавать веб-аккаунты"}
     
-    linking_data = load_linking_data()
+    with _linking_lock:
+        return _create_or_update_web_credentials(telegram_id, username, password_hash, user_role)
+
+
+def _create_or_update_web_credentials(telegram_id, username, password_hash, user_role):
+    from bot.user_manager import get_user_data
+
+    linking_data = _get_linking_data()
     
     # Проверяем не занят ли логин
-    for web_user_id, web_user in linking_data["web_users"].items():
-        if web_user.get("email") == username and web_user.get("telegram_id") != str(telegram_id):
-            return {"success": False, "error": f"Логин '{username}' уже занят другим пользователем"}
+    owner = _find_by_email(username)
+    if owner and str(linking_data["web_users"][owner].get("telegram_id")) != str(telegram_id):
+        return {"success": False, "error": f"Логин '{username}' уже занят другим пользователем"}
     
     # Ищем существующий веб-аккаунт для этого Telegram ID
-    existing_web_user_id = None
-    for web_user_id, web_user in linking_data["web_users"].items():
-        if web_user.get("telegram_id") == str(telegram_id):
-            existing_web_user_id = web_user_id
-            break
+    existing_web_user_id = _find_by_telegram_id(telegram_id)
     
     if existing_web_user_id:
         # Обновляем существующий аккаунт
@@ -429,6 +580,7 @@ def create_or_update_web_credentials(telegram_id, username, password_hash, email
         linking_data["web_users"][existing_web_user_id]["email"] = username
         linking_data["web_users"][existing_web_user_id]["password_hash"] = password_hash
         linking_data["web_users"][existing_web_user_id]["password_changed_at"] = datetime.now().isoformat()
+        _reindex_web_user(existing_web_user_id)
         
         # ВАЖНО: Сохраняем изменения в account_linking.json!
         save_linking_data(linking_data)
@@ -457,6 +609,7 @@ def create_or_update_web_credentials(telegram_id, username, password_hash, email
             "telegram_id": str(telegram_id),
             "role": user_role
         }
+        _reindex_web_user(web_user_id)
         
         # ВАЖНО: Сохраняем изменения в account_linking.json!
         save_linking_data(linking_data)
@@ -487,20 +640,20 @@ def admin_change_password(web_user_id, new_password_hash):
     logger = logging.getLogger(__name__)
     
     try:
-        linking_data = load_linking_data()
-        
-        # Ищем пользователя в account_linking.json
-        if web_user_id not in linking_data.get("web_users", {}):
-            return {"success": False, "error": f"Пользователь {web_user_id} не найден"}
-        
-        user_data = linking_data["web_users"][web_user_id]
-        
-        # Обновляем пароль в account_linking.json
-        linking_data["web_users"][web_user_id]["password_hash"] = new_password_hash
-        linking_data["web_users"][web_user_id]["password_changed_at"] = datetime.now().isoformat()
-        
-        # Сохраняем в account_linking.json
-        save_linking_data(linking_data)
+        with _linking_lock:
+            linking_data = _get_linking_data()
+            
+            # Ищем пользователя в account_linking.json
+            if web_user_id not in linking_data.get("web_users", {}):
+                return {"success": False, "error": f"Пользователь {web_user_id} не найден"}
+            
+            # Обновляем пароль в account_linking.json
+            linking_data["web_users"][web_user_id]["password_hash"] = new_password_hash
+            linking_data["web_users"][web_user_id]["password_changed_at"] = datetime.now().isoformat()
+            
+            # Сохраняем в account_linking.json
+            save_linking_data(linking_data)
+            user_data = dict(linking_data["web_users"][web_user_id])
         
         # Также сохраняем в web_credentials.json через save_admin_credentials
         email = user_data.get("email", "")
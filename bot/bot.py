@@ -10,7 +10,15 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')
 from bot.commands import start, button_handler, cancel_photo_command, createwebuser_command, force_reset_password_command, scan_command, invite_command, link_command, qr_photo_handler
 from bot.commands_handlers import handle_message
 from bot.dse_watcher import load_watched_dse_data, start_watcher_job
-from config.config import BOT_TOKEN
+from bot.dse_manager import start_archive_sweeper_job
+from bot.notification_client import attach_application
+from bot.digest_manager import start_digest_job
+from bot.send_scheduler import SendScheduler
+from bot.update_processor import PerUserUpdateProcessor
+from bot.state_store import start_state_maintenance_job, flush_all_states
+from bot.photo_store import start_photo_gc_job
+from bot.invite_manager import start_invite_sweeper_job
+from config.config import init_config
 from telegram.ext import Application, ApplicationBuilder, CommandHandler, CallbackQueryHandler, MessageHandler, filters
 
 
@@ -116,18 +124,40 @@ async def post_init(application) -> None:
     print("Бот инициализирован. Запуск дополнительных сервисов...")
 
     load_watched_dse_data()
+    attach_application(application)
 
     try:
         loop = asyncio.get_running_loop()
         loop.create_task(start_watcher_job(application))
         logger.info("⏱️  Задача DSE Watcher запланирована")
 
+        loop.create_task(start_archive_sweeper_job(application))
+        logger.info("🧹 Задача очистки архива заявок запланирована")
+
+        loop.create_task(start_digest_job(application))
+        logger.info("📬 Задача сводок уведомлений запланирована")
+
+        loop.create_task(start_state_maintenance_job(application))
+        logger.info("🗂️ Задача обслуживания состояний диалогов запланирована")
+
+        loop.create_task(start_photo_gc_job(application))
+        logger.info("🖼️ Задача очистки хранилища фото запланирована")
+
+        loop.create_task(start_invite_sweeper_job(application))
+        logger.info("🎟️ Задача очистки приглашений и кодов привязки запланирована")
+
         logger.info("Дополнительные сервисы инициализированы")
     except Exception as e:
         logger.error(f"Ошибка инициализации дополнительных сервисов: {e}")
         raise
 
 
+async def post_shutdown(application) -> None:
+    """Функция, вызываемая при остановке приложения."""
+    # Сохраняем незавершённые диалоги, чтобы пользователи продолжили после перезапуска
+    flush_all_states()
+
+
 def _register_handlers(app: Application) -> None:
     """Регистрирует все обработчики команд и сообщений"""
     handlers = [
@@ -152,36 +182,119 @@ def _register_handlers(app: Application) -> None:
     logger.info(f"📋 Зарегистрировано {len(handlers)} обработчиков")
 
 
+def _start_web_interface(port: int):
+    """
+    Запускает веб-интерфейс. По умолчанию — отдельным процессом gunicorn с настраиваемым
+    числом worker'ов; dev-сервер Flask в потоке остаётся только для web_server = "flask".
+
+    Returns:
+        subprocess.Popen | None: Процесс gunicorn (None для dev-сервера)
+    """
+    import importlib.util
+    from config.settings import get_web_server, get_web_workers, get_web_worker_class
+
+    project_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+    if project_dir not in sys.path:
+        sys.path.insert(0, project_dir)
+    try:
+        web_app_found = importlib.util.find_spec('web.web_app') is not None
+    except ImportError:
+        web_app_found = False
+    if not web_app_found:
+        print("❌ Веб-интерфейс не запущен: модуль web.web_app не найден")
+        return None
+
+    if get_web_server() == 'flask':
+        import threading
+
+        def run_web():
+            try:
+                from web.web_app import app as flask_app
+                flask_app.run(host="0.0.0.0", port=port, debug=False, use_reloader=False)
+            except Exception as e:
+                print(f"❌ Ошибка веб-интерфейса (Flask dev): {e}")
+        threading.Thread(target=run_web, daemon=True).start()
+        print(f"🌐 Веб-интерфейс (Flask dev) запущен на порту {port}")
+        return None
+
+    import atexit
+    import subprocess
+
+    if importlib.util.find_spec('gunicorn') is None:
+        print("❌ Веб-интерфейс не запущен: gunicorn не установлен "
+              "(pip install gunicorn или web_server = \"flask\" в ven_bot.json)")
+        return None
+
+    workers = get_web_workers()
+    command = [
+        sys.executable, '-m', 'gunicorn',
+        '--worker-class', get_web_worker_class(),
+        '-w', str(workers),
+        '--bind', f'0.0.0.0:{port}',
+        '--access-logfile', '-',
+        '--error-logfile', '-',
+        'web.web_app:app',
+    ]
+    process = subprocess.Popen(command, cwd=project_dir)
+    atexit.register(process.terminate)
+    print(f"🌐 Веб-интерфейс (gunicorn, {workers} worker) запущен на порту {port}")
+    return process
+
+
 def main() -> None:
     """Основная функция запуска бота"""
+    # Вывод в UTF-8 (русский текст в логах на консолях Windows)
+    if hasattr(sys.stdout, 'reconfigure'):
+        sys.stdout.reconfigure(encoding='utf-8')
+
+    # Явная загрузка конфигурации: директории, шаблоны настроек, проверки
+    init_config()
+
+    from config.config import BOT_TOKEN
+    from config.settings import (is_web_enabled, get_bot_web_port, get_bot_mode, get_webhook_listen,
+                                 get_webhook_port, get_webhook_path, get_webhook_secret, get_webhook_url)
 
+    # В режиме webhook Telegram принимает только HTTPS адрес на портах 443, 80, 88 или 8443
+    webhook_mode = get_bot_mode() == 'webhook'
+    webhook_url = get_webhook_url() if webhook_mode else None
+    if webhook_mode and (not webhook_url or not webhook_url.startswith('https://')):
+        print("❌ Режим webhook: нужен HTTPS адрес. Укажите DOMAIN в domain.conf "
+              "или webhook_url в ven_bot.json (порт 443, 80, 88 или 8443)")
+        sys.exit(1)
 
     # --- Запуск Telegram бота ---
-    app = ApplicationBuilder().token(BOT_TOKEN).post_init(post_init).build()
+    # Обновления разных пользователей обрабатываются параллельно, одного — по порядку
+    app = (
+        ApplicationBuilder()
+        .token(BOT_TOKEN)
+        .rate_limiter(SendScheduler())
+        .concurrent_updates(PerUserUpdateProcessor())
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
     _register_handlers(app)
 
     # --- Запуск web-интерфейса, если включён ---
-    import threading
-    import json
-    try:
-        with open("ven_bot.json", "r", encoding="utf-8") as f:
-            ven_cfg = json.load(f)
-        web_enabled = ven_cfg.get("web_enabled", True)
-        web_port = ven_cfg.get("web_port", 5000)
-    except Exception:
-        web_enabled = True
-        web_port = 5000
-
-    if web_enabled:
-        def run_web():
-            from web.web_app import app as flask_app
-            flask_app.run(host="0.0.0.0", port=web_port, debug=False, use_reloader=False)
-        threading.Thread(target=run_web, daemon=True).start()
-        print(f"🌐 Веб-интерфейс запущен на порту {web_port}")
+    if is_web_enabled():
+        _start_web_interface(get_bot_web_port())
 
     print("Бот запущен! Нажмите Ctrl+C для остановки")
     print("=" * 50)
-    app.run_polling()
+
+    if webhook_mode:
+        # Telegram сам доставляет обновления на HTTPS адрес (nginx проксирует на webhook_port)
+        print(f"🔗 Режим webhook: {webhook_url}")
+        app.run_webhook(
+            listen=get_webhook_listen(),
+            port=get_webhook_port(),
+            url_path=get_webhook_path(),
+            webhook_url=webhook_url,
+            secret_token=get_webhook_secret(),
+            drop_pending_updates=False,
+        )
+    else:
+        app.run_polling()
 
 
 if __name__ == "__main__":
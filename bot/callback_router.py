@@ -0,0 +1,104 @@
+"""
+Callback Router - маршрутизация callback_data нажатий на кнопки
+Обработчики регистрируются декораторами:
+- точное совпадение (словарь, O(1)):    @router.exact('back_to_main')
+- префикс с параметром (префиксное дерево, O(длина callback_data)):
+                                        @router.prefix('pending_toggle_')
+  параметр — остаток callback_data после префикса, при нескольких подходящих
+  префиксах выбирается самый длинный.
+
+Точное совпадение имеет приоритет над префиксом.
+"""
+import os
+import sys
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Добавляем корневую директорию проекта в sys.path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+
+class _TrieNode:
+    __slots__ = ('children', 'handler', 'prefix')
+
+    def __init__(self):
+        self.children: Dict[str, '_TrieNode'] = {}
+        self.handler: Optional[Callable] = None
+        self.prefix: Optional[str] = None
+
+
+class CallbackRouter:
+    """Таблица маршрутов callback_data -> обработчик"""
+
+    def __init__(self):
+        self._exact: Dict[str, Callable] = {}
+        self._root = _TrieNode()
+        self._prefixes: Dict[str, Callable] = {}
+        # Порядок регистрации — для листинга маршрутов
+        self._registered: List[Tuple[str, str, Callable]] = []
+
+    def add_exact(self, key: str, handler: Callable) -> None:
+        if key in self._exact:
+            raise ValueError(f"Маршрут '{key}' уже зарегистрирован")
+        self._exact[key] = handler
+        self._registered.append(('exact', key, handler))
+
+    def add_prefix(self, prefix: str, handler: Callable) -> None:
+        if not prefix:
+            raise ValueError("Пустой префикс маршрута")
+        if prefix in self._prefixes:
+            raise ValueError(f"Префикс '{prefix}' уже зарегистрирован")
+        node = self._root
+        for char in prefix:
+            node = node.children.setdefault(char, _TrieNode())
+        node.handler = handler
+        node.prefix = prefix
+        self._prefixes[prefix] = handler
+        self._registered.append(('prefix', prefix, handler))
+
+    def exact(self, *keys: str) -> Callable:
+        """Декоратор: обработчик для точных значений callback_data"""
+        def decorator(handler):
+            for key in keys:
+                self.add_exact(key, handler)
+            return handler
+        return decorator
+
+    def prefix(self, *prefixes: str) -> Callable:
+        """Декоратор: обработчик для callback_data, начинающихся с префикса"""
+        def decorator(handler):
+            for prefix in prefixes:
+                self.add_prefix(prefix, handler)
+            return handler
+        return decorator
+
+    def resolve(self, data: str) -> Optional[Tuple[Callable, str]]:
+        """
+        Найти обработчик для callback_data
+
+        Returns:
+            tuple: (обработчик, параметр) или None. Для точного совпадения параметр — ''.
+        """
+        handler = self._exact.get(data)
+        if handler is not None:
+            return handler, ''
+
+        node = self._root
+        best = None
+        for char in data:
+            node = node.children.get(char)
+            if node is None:
+                break
+            if node.handler is not None:
+                best = node
+        if best is None:
+            return None
+        return best.handler, data[len(best.prefix):]
+
+    def routes(self) -> List[Tuple[str, str, Callable]]:
+        """
+        Список всех маршрутов в порядке регистрации
+
+        Returns:
+            list: [(тип 'exact'|'prefix', шаблон, обработчик)]
+        """
+        return list(self._registered)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Листинг и бенчмарк маршрутов callback_data
+Выводит все маршруты, зарегистрированные в commands.callback_router, и сравнивает
+стоимость выбора обработчика через таблицу маршрутов со старой цепочкой
+if/elif (эмулируется последовательной проверкой маршрутов в порядке регистрации).
+
+Запуск: python bot/callback_routes.py [--list] [--iterations 20000]
+"""
+import argparse
+import os
+import sys
+import timeit
+
+# Добавляем корневую директорию проекта в sys.path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from bot.commands import callback_router
+
+
+def _linear_resolve(routes, data: str):
+    """Выбор обработчика так, как это делала цепочка if/elif"""
+    for kind, pattern, handler in routes:
+        if kind == 'exact' and data == pattern:
+            return handler
+        if kind == 'prefix' and data.startswith(pattern):
+            return handler
+    return None
+
+
+def _sample_callbacks(routes):
+    """Пример callback_data для каждого маршрута (для префиксов — с параметром)"""
+    return [pattern if kind == 'exact' else f"{pattern}42" for kind, pattern, _ in routes]
+
+
+def print_routes(routes) -> None:
+    print(f"Зарегистрировано маршрутов: {len(routes)}")
+    for kind, pattern, handler in routes:
+        shown = pattern if kind == 'exact' else f"{pattern}*"
+        print(f"  {kind:6}  {shown:40}  {handler.__name__}")
+
+
+def run_benchmark(routes, iterations: int) -> None:
+    samples = _sample_callbacks(routes)
+    print(f"\nСтоимость выбора обработчика (среднее по {iterations} проходам, мкс на callback):")
+    print(f"  {'callback_data':42} {'if/elif':>9} {'router':>9}")
+
+    linear_total = router_total = 0.0
+    # Показываем первые, средние и последние маршруты — поздние ветки платили больше всего
+    shown = set(samples[:3] + samples[len(samples) // 2:len(samples) // 2 + 2] + samples[-5:])
+    for data in samples:
+        linear = timeit.timeit(lambda: _linear_resolve(routes, data), number=iterations) / iterations * 1e6
+        routed = timeit.timeit(lambda: callback_router.resolve(data), number=iterations) / iterations * 1e6
+        linear_total += linear
+        router_total += routed
+        if data in shown:
+            print(f"  {data:42} {linear:9.3f} {routed:9.3f}")
+
+    count = len(samples)
+    print(f"\n  Среднее по всем маршрутам:  if/elif {linear_total / count:.3f} мкс,  "
+          f"router {router_total / count:.3f} мкс")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Листинг и бенчмарк маршрутов callback_data")
+    parser.add_argument('--list', action='store_true', help="Только вывести маршруты")
+    parser.add_argument('--iterations', type=int, default=20000)
+    args = parser.parse_args()
+
+    routes = callback_router.routes()
+    print_routes(routes)
+    if not args.list:
+        run_benchmark(routes, args.iterations)
+
+
+if __name__ == "__main__":
+    main()
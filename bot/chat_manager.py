@@ -8,11 +8,13 @@ from telegram.ext import ContextTypes
 # Добавляем корневую директорию проекта в sys.path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from config.config import load_data, save_data, DATA_FILE, USERS_FILE
+from config.config import load_data, save_data, DATA_FILE, USERS_FILE, next_sequence
+from bot.send_scheduler import PRIORITY_CHAT
+from bot.state_store import StateStore
 from datetime import datetime
 
-dse_chat_states = {}
-active_chats = {}
+dse_chat_states = StateStore('dse_chat_states', ttl=24 * 3600)
+active_chats = StateStore('active_chats', ttl=7 * 24 * 3600)
 
 
 def get_users_data():
@@ -256,6 +258,7 @@ async def request_initiator_confirmation(update: Update, context: ContextTypes.D
     # Отправляем сообщение инициатору
     try:
         await context.bot.send_message(
+            rate_limit_args=PRIORITY_CHAT,
             chat_id=initiator_user_id,
             text=f"❓ Вы уверены, что хотите начать чат с {target_name} по ДСЕ '{dse_value}'?\nПожалуйста, подтвердите.",
             reply_markup=reply_markup
@@ -377,6 +380,7 @@ async def request_responder_confirmation(context: ContextTypes.DEFAULT_TYPE, ini
     # Отправляем сообщение ответчику
     try:
         sent_message = await context.bot.send_message(
+            rate_limit_args=PRIORITY_CHAT,
             chat_id=target_user_id,
             text=f"💬 С вами хочет связаться пользователь {initiator_name} по ДСЕ '{dse_value}'.\nПожалуйста, подтвердите начало чата.",
             reply_markup=reply_markup
@@ -389,6 +393,7 @@ async def request_responder_confirmation(context: ContextTypes.DEFAULT_TYPE, ini
         # Проще всего просто отправить новое сообщение инициатору
         try:
             await context.bot.send_message(
+                rate_limit_args=PRIORITY_CHAT,
                 chat_id=initiator_user_id,
                 text=f"⏳ Запрос на подтверждение чата отправлен пользователю {target_user_id}. Ожидаем ответ..."
             )
@@ -403,6 +408,7 @@ async def request_responder_confirmation(context: ContextTypes.DEFAULT_TYPE, ini
             del dse_chat_states[initiator_user_id]
         try:
             await context.bot.send_message(
+                rate_limit_args=PRIORITY_CHAT,
                 chat_id=initiator_user_id,
                 text="❌ Не удалось связаться с пользователем. Возможно, он заблокировал бота."
             )
@@ -443,6 +449,7 @@ async def handle_responder_confirmation(update: Update, context: ContextTypes.DE
         # Уведомляем инициатора
         try:
             await context.bot.send_message(
+                rate_limit_args=PRIORITY_CHAT,
                 chat_id=initiator_user_id,
                 text="❌ Пользователь отклонил запрос на начало чата."
             )
@@ -473,7 +480,10 @@ async def handle_responder_confirmation(update: Update, context: ContextTypes.DE
                 print(f"🔄 Переиспользую существующий чат {chat_id} для ДСЕ '{dse_value}'")
             else:
                 # Создаём новый чат
-                chat_id = max([int(k) for k in chats.keys()] if chats else [0]) + 1
+                chat_id = next_sequence(
+                    'chat',
+                    seed=lambda: max([int(k) for k in chats.keys() if str(k).isdigit()] or [0])
+                )
 
                 # Попробуем получить короткое имя/описание ДСЕ из записей
                 records = get_dse_records_by_dse_value(dse_value)
@@ -517,6 +527,7 @@ async def handle_responder_confirmation(update: Update, context: ContextTypes.DE
 
         try:
             await context.bot.send_message(
+                rate_limit_args=PRIORITY_CHAT,
                 chat_id=initiator_user_id,
                 text=f"✅ Чат с пользователем по ДСЕ '{dse_value}' установлен!\nМожете начинать писать сообщения.",
                 reply_markup=initiator_reply_markup
@@ -577,6 +588,7 @@ async def handle_chat_control(update: Update, context: ContextTypes.DEFAULT_TYPE
                 ]
                 partner_reply_markup = InlineKeyboardMarkup(partner_keyboard)
                 await context.bot.send_message(
+                    rate_limit_args=PRIORITY_CHAT,
                     chat_id=partner_id,
                     text="⏸️ Собеседник поставил чат на паузу.",
                     reply_markup=partner_reply_markup
@@ -608,6 +620,7 @@ async def handle_chat_control(update: Update, context: ContextTypes.DEFAULT_TYPE
             # Уведомляем партнера
             try:
                 await context.bot.send_message(
+                    rate_limit_args=PRIORITY_CHAT,
                     chat_id=partner_id,
                     text="▶️ Собеседник возобновил чат.",
                     reply_markup=InlineKeyboardMarkup(get_chat_control_keyboard())
@@ -656,6 +669,7 @@ async def handle_chat_message(update: Update, context: ContextTypes.DEFAULT_TYPE
     try:
         # Отправляем сообщение партнёру по чату
         await context.bot.send_message(
+            rate_limit_args=PRIORITY_CHAT,
             chat_id=partner_id,
             text=f"👤 {user.first_name}: {text}"
         )
@@ -695,13 +709,13 @@ async def end_chat_for_users(user1_id: str, user2_id: str, context: ContextTypes
 
     # Уведомляем первого пользователя
     try:
-        await context.bot.send_message(chat_id=user1_id, text=f"🔚 {reason}")
+        await context.bot.send_message(chat_id=user1_id, text=f"🔚 {reason}", rate_limit_args=PRIORITY_CHAT)
     except:
         pass  # Игнорируем ошибки, если пользователь заблокировал бота
 
     # Уведомляем второго пользователя
     try:
-        await context.bot.send_message(chat_id=user2_id, text=f"🔚 {reason}")
+        await context.bot.send_message(chat_id=user2_id, text=f"🔚 {reason}", rate_limit_args=PRIORITY_CHAT)
     except:
         pass  # Игнорируем ошибки, если пользователь заблокировал бота
 
@@ -7,30 +7,36 @@ from email.mime.multipart import MIMEMultipart
 from email.mime.base import MIMEBase
 from email.mime.text import MIMEText
 from email import encoders
-import mimetypes
+import logging
 import sys
 import os
+import tempfile
 
 # Добавляем корневую директорию проекта в sys.path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from config.config import load_data, save_data, PROBLEM_TYPES, RC_TYPES, DATA_FILE, PHOTOS_DIR
+from config.config import load_data, save_data, PROBLEM_TYPES, RC_TYPES, DATA_FILE
 from bot.dse_manager import get_all_dse_records, search_dse_records, get_unique_dse_values, add_pending_dse_request
 from bot.user_manager import (register_user, get_user_role, has_permission, set_user_role, ROLES, get_all_users,
                          set_user_nickname, remove_user_nickname, get_user_nickname, get_user_display_name,
                          check_nickname_exists, get_all_nicknames, get_user_data)
+from bot.send_scheduler import PRIORITY_BULK
+from bot.callback_router import CallbackRouter
+from bot.state_store import StateStore
+from bot.photo_store import ingest_telegram_photo, get_photo_variant_path
 
 import telegram
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 
-import os
-print(str(os.urandom(32)))
-# Глобальные переменные
-user_states = {}
-admin_states = {}  # Для отслеживания состояния админских операций
-dse_view_states = {}  # Для отслеживания состояния просмотра ДСЕ
-registration_states = {}  # Для отслеживания процесса регистрации
+logger = logging.getLogger(__name__)
+
+# Глобальные переменные (словари с TTL, заполнение форм переживает перезапуск бота)
+user_states = StateStore('user_states', ttl=24 * 3600, max_bytes=20 * 1024 * 1024)
+admin_states = StateStore('admin_states', ttl=2 * 3600)  # Для отслеживания состояния админских операций
+# Для отслеживания состояния просмотра ДСЕ (списки записей — не сохраняются на диск)
+dse_view_states = StateStore('dse_view_states', ttl=2 * 3600, max_bytes=50 * 1024 * 1024, persistent=False)
+registration_states = StateStore('registration_states', ttl=7 * 24 * 3600)  # Для отслеживания процесса регистрации
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -298,6 +304,10 @@ async def show_main_menu(update: Update, user_id: str) -> None:
     if has_permission(user_id, 'watch_dse'):  # Используем новое право
         keyboard.append([InlineKeyboardButton("👀 Отслеживание ДСЕ", callback_data='watch_dse_menu')])
 
+    # === "📥 Заявки на проверку" ===
+    if has_permission(user_id, 'approve_dse_requests'):
+        keyboard.append([InlineKeyboardButton("📥 Заявки на проверку", callback_data='pending_review_menu')])
+
     # === КНОПКА 8: "🔔 Подписка на заявки" (только для админов) ===
     if has_permission(user_id, 'manage_subscriptions'):
         keyboard.append([InlineKeyboardButton("🔔 Подписка на заявки", callback_data='subscription_menu')])
@@ -1041,8 +1051,10 @@ async def show_watched_dse_menu(update: Update, context: ContextTypes.DEFAULT_TY
 
     keyboard = [
         [InlineKeyboardButton("➕ Добавить ДСЕ", callback_data='watch_add_dse')],
+        [InlineKeyboardButton("🔣 Добавить шаблон", callback_data='watch_add_pattern')],
         [InlineKeyboardButton("➖ Удалить ДСЕ", callback_data='watch_remove_dse')],
         [InlineKeyboardButton("📋 Список отслеживаемых", callback_data='watch_list_dse')],
+        [InlineKeyboardButton("⏰ Режим уведомлений", callback_data='digest_menu')],
         [InlineKeyboardButton("⬅️ Назад", callback_data='back_to_main')]
     ]
 
@@ -1050,6 +1062,9 @@ async def show_watched_dse_menu(update: Update, context: ContextTypes.DEFAULT_TY
 
     menu_text = "👀 Меню отслеживания ДСЕ\n\n"
     menu_text += "Здесь вы можете настроить уведомления о появлении новых записей по определённым ДСЕ.\n"
+    menu_text += "Шаблоны позволяют отслеживать целое семейство ДСЕ, например АБВГ.301.*\n"
+    if watched_list:
+        menu_text += f"\nОтслеживается: {len(watched_list)}\n"
 
     if update.callback_query:
         await update.callback_query.edit_message_text(text=menu_text, reply_markup=reply_markup)
@@ -1138,16 +1153,140 @@ async def show_watched_dse_list(update: Update, context: ContextTypes.DEFAULT_TY
     else:
         text = "📋 Список отслеживаемых ДСЕ:\n\n"
         # Отображаем в верхнем регистре для удобства чтения
+        from .dse_watcher import is_watch_pattern
         for i, dse_value in enumerate(watched_list, 1):
-            text += f"{i}. {dse_value.upper()}\n"
+            suffix = " (шаблон)" if is_watch_pattern(dse_value) else ""
+            text += f"{i}. {dse_value.upper()}{suffix}\n"
         keyboard = [[InlineKeyboardButton("⬅️ Назад", callback_data='watch_dse_menu')]]
 
     reply_markup = InlineKeyboardMarkup(keyboard)
     await update.callback_query.edit_message_text(text=text, reply_markup=reply_markup)
 
 
+# === ПРОВЕРКА ЗАЯВОК (МАССОВОЕ УТВЕРЖДЕНИЕ / ОТКЛОНЕНИЕ) ===
+
+PENDING_REVIEW_PAGE_SIZE = 20
+
+
+async def show_pending_requests_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Показать заявки на проверку с множественным выбором."""
+    query = update.callback_query
+    user_id = str(query.from_user.id)
+
+    if not has_permission(user_id, 'approve_dse_requests'):
+        await query.edit_message_text(" У вас нет прав для проверки заявок.")
+        return
+
+    from .dse_manager import get_pending_dse_requests
+    pending = get_pending_dse_requests()[:PENDING_REVIEW_PAGE_SIZE]
+
+    dse_view_states[user_id] = dse_view_states.get(user_id, {})
+    pending_ids = {str(item['id']) for item in pending}
+    selected = [rid for rid in dse_view_states[user_id].get('pending_selected', []) if rid in pending_ids]
+    dse_view_states[user_id]['pending_selected'] = selected
+
+    if not pending:
+        keyboard = [[InlineKeyboardButton("⬅️ Назад", callback_data='back_to_main')]]
+        await query.edit_message_text("📭 Нет заявок на проверку.", reply_markup=InlineKeyboardMarkup(keyboard))
+        return
+
+    keyboard = []
+    for item in pending:
+        req_id = str(item['id'])
+        mark = "☑️" if req_id in selected else "⬜"
+        label = f"{mark} #{req_id} {item.get('dse', 'N/A')} — {item.get('problem_type', '')}"
+        keyboard.append([InlineKeyboardButton(label[:60], callback_data=f'pending_toggle_{req_id}')])
+
+    keyboard.append([
+        InlineKeyboardButton("Выбрать все", callback_data='pending_select_all'),
+        InlineKeyboardButton("Снять выбор", callback_data='pending_clear')
+    ])
+    keyboard.append([
+        InlineKeyboardButton(f"✅ Утвердить ({len(selected)})", callback_data='pending_approve_selected'),
+        InlineKeyboardButton(f"❌ Отклонить ({len(selected)})", callback_data='pending_reject_selected')
+    ])
+    keyboard.append([InlineKeyboardButton("⬅️ Назад", callback_data='back_to_main')])
+
+    await query.edit_message_text(
+        "📥 Заявки на проверку\n\n"
+        "Отметьте заявки и утвердите или отклоните их одним действием.",
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+
+async def toggle_pending_request_selection(update: Update, context: ContextTypes.DEFAULT_TYPE, request_id: str) -> None:
+    """Отметить/снять отметку с заявки в списке проверки."""
+    user_id = str(update.callback_query.from_user.id)
+    dse_view_states[user_id] = dse_view_states.get(user_id, {})
+    selected = dse_view_states[user_id].setdefault('pending_selected', [])
+    if request_id in selected:
+        selected.remove(request_id)
+    else:
+        selected.append(request_id)
+    await show_pending_requests_menu(update, context)
+
+
+async def process_selected_pending_requests(update: Update, context: ContextTypes.DEFAULT_TYPE, action: str) -> None:
+    """Утвердить или отклонить все отмеченные заявки одной операцией."""
+    query = update.callback_query
+    user_id = str(query.from_user.id)
+
+    if not has_permission(user_id, 'approve_dse_requests'):
+        await query.edit_message_text(" У вас нет прав для проверки заявок.")
+        return
+
+    selected = dse_view_states.get(user_id, {}).get('pending_selected', [])
+    if not selected:
+        # Нечего обрабатывать — просто обновляем список
+        await show_pending_requests_menu(update, context)
+        return
+
+    from .dse_manager import approve_pending_dse_requests, reject_pending_dse_requests
+    if action == 'approve':
+        results = approve_pending_dse_requests(selected, approver_id=user_id)
+        action_text = "Утверждено"
+    else:
+        results = reject_pending_dse_requests(selected, approver_id=user_id)
+        action_text = "Отклонено"
+
+    dse_view_states[user_id]['pending_selected'] = []
+    skipped = len(selected) - len(results)
+
+    text = f"✅ {action_text} заявок: {len(results)}"
+    if skipped:
+        text += f"\n⚠️ Уже обработаны другими: {skipped}"
+    keyboard = [
+        [InlineKeyboardButton("📥 К заявкам", callback_data='pending_review_menu')],
+        [InlineKeyboardButton("⬅️ Главное меню", callback_data='back_to_main')]
+    ]
+    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+
+
 # === ФУНКЦИИ ЭКСПОРТА ДАННЫХ ===
 
+def write_export_excel(rows, output_file: str) -> None:
+    """Записать строки выгрузки ДСЕ в Excel файл (блокирующая работа — вызывать через asyncio.to_thread)"""
+    import pandas as pd
+
+    df = pd.DataFrame(rows)
+    with pd.ExcelWriter(output_file, engine='openpyxl') as writer:
+        df.to_excel(writer, index=False, sheet_name='Отчет ДСЕ')
+
+        # Настройка ширины колонок
+        worksheet = writer.sheets['Отчет ДСЕ']
+        for column in worksheet.columns:
+            max_length = 0
+            column_letter = column[0].column_letter
+            for cell in column:
+                try:
+                    if len(str(cell.value)) > max_length:
+                        max_length = len(str(cell.value))
+                except:
+                    pass
+            adjusted_width = min(max_length + 2, 50)
+            worksheet.column_dimensions[column_letter].width = adjusted_width
+
+
 async def start_data_export(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Начать процесс экспорта данных"""
     user_id = str(update.callback_query.from_user.id)
@@ -1163,7 +1302,6 @@ async def start_data_export(update: Update, context: ContextTypes.DEFAULT_TYPE)
     )
     
     try:
-        import pandas as pd
         from bot.dse_manager import get_all_dse_records
         from bot.user_manager import get_user_data
         
@@ -1205,27 +1343,18 @@ async def start_data_export(update: Update, context: ContextTypes.DEFAULT_TYPE)
             }
             rows.append(row)
         
-        # Создание DataFrame
-        df = pd.DataFrame(rows)
-        
-        # Сохранение в Excel
-        output_file = 'RezultBot.xlsx'
-        with pd.ExcelWriter(output_file, engine='openpyxl') as writer:
-            df.to_excel(writer, index=False, sheet_name='Отчет ДСЕ')
-            
-            # Настройка ширины колонок
-            worksheet = writer.sheets['Отчет ДСЕ']
-            for column in worksheet.columns:
-                max_length = 0
-                column_letter = column[0].column_letter
-                for cell in column:
-                    try:
-                        if len(str(cell.value)) > max_length:
-                            max_length = len(str(cell.value))
-                    except:
-                        pass
-                adjusted_width = min(max_length + 2, 50)
-                worksheet.column_dimensions[column_letter].width = adjusted_width
+        # Сохранение в Excel — в отдельный файл на каждую выгрузку,
+        # чтобы одновременные экспорты разных администраторов не перезаписывали друг друга
+        _discard_export_file(user_id)
+        with tempfile.NamedTemporaryFile(delete=False, prefix=f'RezultBot_{user_id}_', suffix='.xlsx') as tmp_file:
+            output_file = tmp_file.name
+
+        # Генерация в пуле потоков, чтобы не блокировать обработку других пользователей
+        try:
+            await asyncio.to_thread(write_export_excel, rows, output_file)
+        except Exception:
+            _remove_file_quietly(output_file)
+            raise
         
         # Файл создан успешно
         admin_states[user_id]['export_completed'] = True
@@ -1241,6 +1370,22 @@ async def start_data_export(update: Update, context: ContextTypes.DEFAULT_TYPE)
             admin_states[user_id].pop('exporting_data', None)
 
 
+def _remove_file_quietly(file_path) -> None:
+    if not file_path:
+        return
+    try:
+        os.remove(file_path)
+    except OSError:
+        pass
+
+
+def _discard_export_file(user_id: str) -> None:
+    """Удалить файл выгрузки пользователя (после отправки или перед новой выгрузкой)"""
+    state = admin_states.get(user_id)
+    if state:
+        _remove_file_quietly(state.pop('export_file', None))
+
+
 async def show_export_delivery_options(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Показать варианты доставки экспортированного файла"""
     keyboard = [
@@ -1262,12 +1407,13 @@ async def send_file_to_chat(update: Update, context: ContextTypes.DEFAULT_TYPE)
     user_id = str(update.callback_query.from_user.id)
     
     try:
-        file_path = admin_states.get(user_id, {}).get('export_file', 'RezultBot.xlsx')
+        file_path = admin_states.get(user_id, {}).get('export_file')
         
-        if os.path.exists(file_path):
+        if file_path and os.path.exists(file_path):
             # Отправляем файл
             with open(file_path, 'rb') as file:
                 await context.bot.send_document(
+                    rate_limit_args=PRIORITY_BULK,
                     chat_id=update.callback_query.message.chat_id,
                     document=file,
                     filename=f"Выгрузка_данных_{dt.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
@@ -1283,11 +1429,11 @@ async def send_file_to_chat(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await update.callback_query.edit_message_text(f" Ошибка отправки файла: {str(e)}")
     
     finally:
-        # Очищаем состояние
+        # Очищаем состояние и удаляем файл выгрузки
+        _discard_export_file(user_id)
         if user_id in admin_states:
             admin_states[user_id].pop('exporting_data', None)
             admin_states[user_id].pop('export_completed', None)
-            admin_states[user_id].pop('export_file', None)
 
 
 async def request_email_address(update: Update, context: ContextTypes.DEFAULT_TYPE, format_type: str = "excel") -> None:
@@ -1360,7 +1506,7 @@ async def send_file_by_email(update: Update, context: ContextTypes.DEFAULT_TYPE,
             )
             return
         
-        file_path = admin_states.get(user_id, {}).get('export_file', 'RezultBot.xlsx')
+        file_path = admin_states.get(user_id, {}).get('export_file')
         format_type = admin_states.get(user_id, {}).get('email_format', 'excel')
         
         smtp_server = SMTP_SETTINGS["SMTP_SERVER"]
@@ -1383,7 +1529,7 @@ async def send_file_by_email(update: Update, context: ContextTypes.DEFAULT_TYPE,
         msg['Subject'] = "ЖП Бот"
         
         if format_type == "excel":
-            if not os.path.exists(file_path):
+            if not file_path or not os.path.exists(file_path):
                 await update.message.reply_text(" Файл не найден!")
                 return
             
@@ -1402,7 +1548,7 @@ async def send_file_by_email(update: Update, context: ContextTypes.DEFAULT_TYPE,
             msg.attach(part)
             
         elif format_type == "text":
-            report_text = await generate_text_report()
+            report_text = await generate_text_report(file_path)
             body = f"Здравствуйте!\n\nВыгрузка данных ДСЕ в виде текста:\n\n{report_text}\n\nС уважением,\n{SMTP_SETTINGS['FROM_NAME']}"
             msg.attach(MIMEText(body, 'plain', 'utf-8'))
         else:
@@ -1410,18 +1556,18 @@ async def send_file_by_email(update: Update, context: ContextTypes.DEFAULT_TYPE,
             return
         
         await update.message.reply_text("📧 Подключение к серверу...")
-        server = smtplib.SMTP(smtp_server, smtp_port)
+        server = await asyncio.to_thread(smtplib.SMTP, smtp_server, smtp_port)
         server.set_debuglevel(0)
         
         await update.message.reply_text("🔒 Установка защищенного соединения...")
-        server.starttls()
+        await asyncio.to_thread(server.starttls)
         
         await update.message.reply_text("👤 Авторизация...")
-        server.login(smtp_user, smtp_password)
+        await asyncio.to_thread(server.login, smtp_user, smtp_password)
         
         await update.message.reply_text("📤 Отправка письма...")
         text = msg.as_string()
-        server.sendmail(smtp_user, valid_emails, text)  # Отправка на все адреса
+        await asyncio.to_thread(server.sendmail, smtp_user, valid_emails, text)  # Отправка на все адреса
         
         # Сохраняем каждый email в историю
         for recipient_email in valid_emails:
@@ -1445,10 +1591,10 @@ async def send_file_by_email(update: Update, context: ContextTypes.DEFAULT_TYPE,
                 server.quit()
             except Exception:
                 pass
+        _discard_export_file(user_id)
         if user_id in admin_states:
             admin_states[user_id].pop('exporting_data', None)
             admin_states[user_id].pop('export_completed', None)
-            admin_states[user_id].pop('export_file', None)
             admin_states[user_id].pop('waiting_for_email', None)
             admin_states[user_id].pop('email_format', None)
 
@@ -1470,9 +1616,9 @@ async def test_smtp_connection(update: Update, context: ContextTypes.DEFAULT_TYP
         # Тестируем подключение
         server = None
         try:
-            server = smtplib.SMTP(SMTP_SETTINGS["SMTP_SERVER"], SMTP_SETTINGS["SMTP_PORT"])
-            server.starttls()
-            server.login(SMTP_SETTINGS["SMTP_USER"], SMTP_SETTINGS["SMTP_PASSWORD"])
+            server = await asyncio.to_thread(smtplib.SMTP, SMTP_SETTINGS["SMTP_SERVER"], SMTP_SETTINGS["SMTP_PORT"])
+            await asyncio.to_thread(server.starttls)
+            await asyncio.to_thread(server.login, SMTP_SETTINGS["SMTP_USER"], SMTP_SETTINGS["SMTP_PASSWORD"])
             
             await update.callback_query.edit_message_text(
                 f"✅ SMTP соединение успешно!\n\n"
@@ -1644,72 +1790,45 @@ async def send_application_by_email(update: Update, context: ContextTypes.DEFAUL
         
         msg.attach(MIMEText(body, 'plain', 'utf-8'))
         
-        # Добавляем фото если есть
+        # Добавляем фото если есть (скачивается один раз и сохраняется в хранилище фото)
+        stored_photo = None
         if photo_file_id:
             await update.message.reply_text("📎 Подготовка вложения с фото...")
             try:
-                # Скачиваем фото
-                photo_file = await context.bot.get_file(photo_file_id)
-                photo_path = f"{PHOTOS_DIR}/temp_{user_id}_{dt.now().strftime('%Y%m%d_%H%M%S')}.jpg"
-                await photo_file.download_to_drive(photo_path)
-                
-                # Прикрепляем к письму
-                with open(photo_path, 'rb') as f:
+                stored_photo = await ingest_telegram_photo(context.bot, photo_file_id)
+                if not stored_photo:
+                    raise RuntimeError("фото не удалось скачать")
+                # Во вложение идёт копия для письма, а не оригинал в полном разрешении
+                img_path = await asyncio.to_thread(get_photo_variant_path, stored_photo['hash'], 'email')
+                with open(img_path, 'rb') as f:
                     img_data = f.read()
-                
-                # Определяем MIME тип
-                mime_type, _ = mimetypes.guess_type(photo_path)
-                if not mime_type:
-                    mime_type = 'image/jpeg'
-                
-                maintype, subtype = mime_type.split('/', 1)
-                img_part = MIMEBase(maintype, subtype)
+
+                img_part = MIMEBase('image', 'jpeg')
                 img_part.set_payload(img_data)
                 encoders.encode_base64(img_part)
                 img_part.add_header('Content-Disposition', f'attachment; filename="photo_{dse_number}.jpg"')
                 msg.attach(img_part)
-                
-                # Удаляем временный файл
-                try:
-                    os.remove(photo_path)
-                except:
-                    pass
-                    
+
             except Exception as e:
                 await update.message.reply_text(f"⚠️ Не удалось прикрепить фото: {str(e)}")
         
         await update.message.reply_text("📧 Подключение к серверу...")
-        server = smtplib.SMTP(smtp_server, smtp_port)
+        server = await asyncio.to_thread(smtplib.SMTP, smtp_server, smtp_port)
         server.set_debuglevel(0)
         
         await update.message.reply_text("🔒 Установка защищенного соединения...")
-        server.starttls()
+        await asyncio.to_thread(server.starttls)
         
         await update.message.reply_text("👤 Авторизация...")
-        server.login(smtp_user, smtp_password)
+        await asyncio.to_thread(server.login, smtp_user, smtp_password)
         
         await update.message.reply_text("📤 Отправка заявки...")
         text = msg.as_string()
-        server.sendmail(smtp_user, valid_emails, text)  # Отправка на все адреса
+        await asyncio.to_thread(server.sendmail, smtp_user, valid_emails, text)  # Отправка на все адреса
         
-        # Скачиваем фото локально для веб-доступа
-        photo_path = None
-        if photo_file_id:
-            try:
-                import uuid
-                # Скачиваем файл
-                file = await context.bot.get_file(photo_file_id)
-                
-                # Создаём имя файла
-                photo_filename = f"{user_id}_{dse_number}_{uuid.uuid4().hex[:8]}.jpg"
-                photo_path = os.path.join(PHOTOS_DIR, photo_filename)
-                
-                # Скачиваем
-                await file.download_to_drive(photo_path)
-                print(f"✅ Photo downloaded to {photo_path}")
-            except Exception as e:
-                print(f" Failed to download photo: {e}")
-                photo_path = None
+        # Фото уже в хранилище (скачано для вложения) — для веб-доступа используем тот же файл
+        photo_path = stored_photo['path'] if stored_photo else None
+        photo_hash = stored_photo['hash'] if stored_photo else None
         
         # Сохраняем заявку как ожидающую проверку
         record = {
@@ -1721,6 +1840,7 @@ async def send_application_by_email(update: Update, context: ContextTypes.DEFAUL
             'user_id': user_id,
             'photo_file_id': photo_file_id,
             'photo_path': photo_path,
+            'photo_hash': photo_hash,
             'sent_to_emails': ', '.join(valid_emails)  # Сохраняем все адреса
         }
         
@@ -1905,11 +2025,13 @@ async def show_nicknames_list(update: Update, context: ContextTypes.DEFAULT_TYPE
 
 
 # === ГЕНЕРАЦИЯ ТЕКСТОВОГО ОТЧЁТА ===
-async def generate_text_report():
-    """Генерирует текстовый отчёт по данным из RezultBot.xlsx"""
+async def generate_text_report(file_path: str):
+    """Генерирует текстовый отчёт по файлу выгрузки пользователя (admin_states[user_id]['export_file'])"""
     import pandas as pd
     try:
-        df = pd.read_excel('RezultBot.xlsx')
+        if not file_path:
+            raise FileNotFoundError("файл выгрузки не найден")
+        df = await asyncio.to_thread(pd.read_excel, file_path)
         lines = []
         for idx, row in df.iterrows():
             line = (
@@ -1929,582 +2051,835 @@ async def generate_text_report():
 
 # === ОБРАБОТЧИКИ КНОПОК И СООБЩЕНИЙ ===
 
-async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Обработчик всех нажатий на кнопки"""
-    query = update.callback_query
-    await query.answer()
-    
-    data = query.data
-    user = query.from_user
-    user_id = str(user.id)
-    
-    # === ПОДТВЕРЖДЕНИЕ ФИО ПРИ РЕГИСТРАЦИИ ===
-    if data == 'reg_confirm_name':
-        if user_id in registration_states:
-            reg_state = registration_states[user_id]
-            if reg_state.get('step') == 'confirm_name':
-                first_name = reg_state.get('first_name', '').strip()
-                last_name = reg_state.get('last_name', '').strip()
-                username = reg_state.get('username', '')
-                invite_code = reg_state.get('invite_code')
-                del registration_states[user_id]
-
-                if invite_code:
-                    from bot.invite_manager import use_invite
-                    result = use_invite(
-                        invite_code,
-                        int(user_id),
-                        username,
-                        first_name,
-                        last_name
-                    )
+# === МАРШРУТЫ НАЖАТИЙ НА КНОПКИ ===
+# Обработчики регистрируются в callback_router и вызываются из button_handler
+# с аргументами (update, context, query, data, user, user_id, param).
+callback_router = CallbackRouter()
 
-                    if result.get("success"):
-                        await query.message.reply_text(
-                            f"🎉 {result.get('message', '')}\n\n"
-                            f"✅ Регистрация завершена!\n"
-                            f"Имя: {first_name} {last_name}\n\n"
-                            f"Добро пожаловать в систему!"
-                        )
-                    else:
-                        register_user(user_id, username, first_name, last_name)
-                        await query.message.reply_text(
-                            f"⚠️ Ошибка при обработке приглашения: {result.get('error', 'Неизвестная ошибка')}\n\n"
-                            f"✅ Вы зарегистрированы с базовыми правами.\n"
-                            f"Имя: {first_name} {last_name}"
-                        )
-                else:
-                    register_user(user_id, username, first_name, last_name)
+
+# === ПОДТВЕРЖДЕНИЕ ФИО ПРИ РЕГИСТРАЦИИ ===
+@callback_router.exact('reg_confirm_name')
+async def _on_reg_confirm_name(update, context, query, data, user, user_id, param):
+    if user_id in registration_states:
+        reg_state = registration_states[user_id]
+        if reg_state.get('step') == 'confirm_name':
+            first_name = reg_state.get('first_name', '').strip()
+            last_name = reg_state.get('last_name', '').strip()
+            username = reg_state.get('username', '')
+            invite_code = reg_state.get('invite_code')
+            del registration_states[user_id]
+
+            if invite_code:
+                from bot.invite_manager import use_invite
+                result = use_invite(
+                    invite_code,
+                    int(user_id),
+                    username,
+                    first_name,
+                    last_name
+                )
+
+                if result.get("success"):
                     await query.message.reply_text(
+                        f"🎉 {result.get('message', '')}\n\n"
                         f"✅ Регистрация завершена!\n"
                         f"Имя: {first_name} {last_name}\n\n"
                         f"Добро пожаловать в систему!"
                     )
-
-                user_states[user_id] = {
-                    'application': '',
-                    'dse': '',
-                    'problem_type': '',
-                    'description': '',
-                    'rc': '',
-                    'photo_file_id': None
-                }
-
-                user_role = get_user_role(user_id)
-                if user_role == 'user':
-                    await show_scan_menu(update, user_id)
                 else:
-                    await show_main_menu(update, user_id)
-        return
-
-    elif data == 'reg_edit_name':
-        if user_id in registration_states:
-            registration_states[user_id]['step'] = 'ask_first_name'
-            registration_states[user_id].pop('first_name', None)
-            registration_states[user_id].pop('last_name', None)
-            await query.edit_message_text("Хорошо, давайте исправим. Введите ваше имя:")
-        return
+                    register_user(user_id, username, first_name, last_name)
+                    await query.message.reply_text(
+                        f"⚠️ Ошибка при обработке приглашения: {result.get('error', 'Неизвестная ошибка')}\n\n"
+                        f"✅ Вы зарегистрированы с базовыми правами.\n"
+                        f"Имя: {first_name} {last_name}"
+                    )
+            else:
+                register_user(user_id, username, first_name, last_name)
+                await query.message.reply_text(
+                    f"✅ Регистрация завершена!\n"
+                    f"Имя: {first_name} {last_name}\n\n"
+                    f"Добро пожаловать в систему!"
+                )
 
-    # === ГЛАВНОЕ МЕНЮ ===
-    if data == 'back_to_main':
-        await show_main_menu(update, user_id)
-    
-    elif data == 'open_application':
-        user_states[user_id]['application'] = 'started'
-        await show_application_menu(update, user_id)
-    
-    # === ЗАПОЛНЕНИЕ ЗАЯВКИ ===
-    elif data == 'back_to_application':
-        await show_application_menu(update, user_id)
-    
-    elif data == 'set_dse':
-        if user_id not in user_states:
-            user_states[user_id] = {
-                'application': '', 'dse': '', 'dse_name': '', 'problem_type': '',
-                'description': '', 'rc': '', 'photo_file_id': None
-            }
-        user_states[user_id]['waiting_for'] = 'dse'
-        await query.edit_message_text("Введите номер ДСЕ:")
-    
-    elif data == 'set_dse_name':
-        if user_id not in user_states:
-            user_states[user_id] = {
-                'application': '', 'dse': '', 'dse_name': '', 'problem_type': '',
-                'description': '', 'rc': '', 'photo_file_id': None
-            }
-        user_states[user_id]['waiting_for'] = 'dse_name'
-        await query.edit_message_text("Введите наименование ДСЕ:")
-    
-    elif data == 'set_problem':
-        await show_problem_types(update, user_id)
-    
-    elif data.startswith('problem_'):
-        if user_id not in user_states:
-            user_states[user_id] = {
-                'application': '', 'dse': '', 'problem_type': '',
-                'description': '', 'rc': '', 'photo_file_id': None
-            }
-        idx = int(data.split('_')[1])
-        user_states[user_id]['problem_type'] = PROBLEM_TYPES[idx]
-        await show_application_menu(update, user_id)
-    
-    elif data == 'set_rc':
-        await show_rc_types(update, user_id)
-    
-    elif data.startswith('rc_'):
-        if user_id not in user_states:
-            user_states[user_id] = {
-                'application': '', 'dse': '', 'problem_type': '',
-                'description': '', 'rc': '', 'photo_file_id': None
-            }
-        idx = int(data.split('_')[1])
-        user_states[user_id]['rc'] = RC_TYPES[idx]
-        await show_application_menu(update, user_id)
-    
-    elif data == 'set_programmer':
-        if user_id not in user_states:
-            user_states[user_id] = {
-                'application': '', 'dse': '', 'problem_type': '',
-                'description': '', 'rc': '', 'programmer_name': '', 
-                'machine_number': '', 'photo_file_id': None
-            }
-        user_states[user_id]['waiting_for'] = 'programmer_name'
-        await query.edit_message_text("Введите ФИО программиста:")
-    
-    elif data == 'set_machine':
-        if user_id not in user_states:
-            user_states[user_id] = {
-                'application': '', 'dse': '', 'problem_type': '',
-                'description': '', 'rc': '', 'programmer_name': '', 
-                'machine_number': '', 'photo_file_id': None
-            }
-        user_states[user_id]['waiting_for'] = 'machine_number'
-        await query.edit_message_text("Введите номер станка:")
-    
-    elif data == 'set_description':
-        if user_id not in user_states:
             user_states[user_id] = {
-                'application': '', 'dse': '', 'problem_type': '',
-                'description': '', 'rc': '', 'photo_file_id': None
+                'application': '',
+                'dse': '',
+                'problem_type': '',
+                'description': '',
+                'rc': '',
+                'photo_file_id': None
             }
-        user_states[user_id]['waiting_for'] = 'description'
-        await query.edit_message_text("Введите описание проблемы:")
-    
-    elif data == 'set_photo':
-        if user_id not in user_states:
-            user_states[user_id] = {
-                'application': '', 'dse': '', 'problem_type': '',
-                'description': '', 'rc': '', 'photo_file_id': None
-            }
-        user_states[user_id]['waiting_for'] = 'photo'
-        await query.edit_message_text(
-            "📸 Отправьте фото или используйте /cancel_photo для пропуска.\n\n"
-            "Вы можете отправить одно фото."
-        )
-    
-    elif data == 'send':
-        # Отправка заявки
-        # Проверяем наличие данных пользователя
-        if user_id not in user_states:
-            await query.edit_message_text(
-                " Данные заявки не найдены!\n\n"
-                "Пожалуйста, создайте заявку заново через /start"
-            )
-            return
-        
-        user_data = user_states[user_id]
-        
-        # Получаем ФИО наладчика из данных пользователя
-        creator_data = get_user_data(user_id)
-        creator_fio = ''
-        if creator_data:
-            first_name = creator_data.get('first_name', '')
-            last_name = creator_data.get('last_name', '')
-            creator_fio = f"{first_name} {last_name}".strip()
-        
-        # Скачиваем фото локально для веб-доступа
-        photo_file_id = user_data.get('photo_file_id')
-        photo_path = None
-        if photo_file_id:
-            try:
-                import uuid
-                # Скачиваем файл
-                file = await context.bot.get_file(photo_file_id)
-                
-                # Создаём имя файла
-                dse_number = user_data.get('dse', 'unknown')
-                photo_filename = f"{user_id}_{dse_number}_{uuid.uuid4().hex[:8]}.jpg"
-                photo_path = os.path.join(PHOTOS_DIR, photo_filename)
-                
-                # Скачиваем
-                await file.download_to_drive(photo_path)
-                print(f"✅ Photo downloaded to {photo_path}")
-            except Exception as e:
-                print(f" Failed to download photo: {e}")
-                photo_path = None
-        
-        record = {
-            'dse': user_data.get('dse', ''),
-            'dse_name': user_data.get('dse_name', ''),
-            'problem_type': user_data.get('problem_type', ''),
-            'rc': user_data.get('rc', ''),
-            'description': user_data.get('description', ''),
-            'datetime': dt.now().strftime('%Y-%m-%d %H:%M:%S'),
-            'user_id': user_id,
-            'photo_file_id': photo_file_id,
-            'photo_path': photo_path,
-            'programmer_name': user_data.get('programmer_name', ''),
-            'machine_number': user_data.get('machine_number', ''),
-            'installer_fio': creator_fio
+
+            user_role = get_user_role(user_id)
+            if user_role == 'user':
+                await show_scan_menu(update, user_id)
+            else:
+                await show_main_menu(update, user_id)
+    return
+
+
+@callback_router.exact('reg_edit_name')
+async def _on_reg_edit_name(update, context, query, data, user, user_id, param):
+    if user_id in registration_states:
+        registration_states[user_id]['step'] = 'ask_first_name'
+        registration_states[user_id].pop('first_name', None)
+        registration_states[user_id].pop('last_name', None)
+        await query.edit_message_text("Хорошо, давайте исправим. Введите ваше имя:")
+    return
+
+
+# === ГЛАВНОЕ МЕНЮ ===
+@callback_router.exact('back_to_main')
+async def _on_back_to_main(update, context, query, data, user, user_id, param):
+    await show_main_menu(update, user_id)
+
+
+@callback_router.exact('open_application')
+async def _on_open_application(update, context, query, data, user, user_id, param):
+    user_states[user_id]['application'] = 'started'
+    await show_application_menu(update, user_id)
+
+
+# === ЗАПОЛНЕНИЕ ЗАЯВКИ ===
+@callback_router.exact('back_to_application')
+async def _on_back_to_application(update, context, query, data, user, user_id, param):
+    await show_application_menu(update, user_id)
+
+
+@callback_router.exact('set_dse')
+async def _on_set_dse(update, context, query, data, user, user_id, param):
+    if user_id not in user_states:
+        user_states[user_id] = {
+            'application': '', 'dse': '', 'dse_name': '', 'problem_type': '',
+            'description': '', 'rc': '', 'photo_file_id': None
         }
-        
-        request_id = add_pending_dse_request(record, user_id)
-        
-        # Очищаем данные пользователя
+    user_states[user_id]['waiting_for'] = 'dse'
+    await query.edit_message_text("Введите номер ДСЕ:")
+
+
+@callback_router.exact('set_dse_name')
+async def _on_set_dse_name(update, context, query, data, user, user_id, param):
+    if user_id not in user_states:
         user_states[user_id] = {
-            'application': '',
-            'dse': '',
-            'dse_name': '',
-            'problem_type': '',
-            'description': '',
-            'rc': '',
-            'programmer_name': '',
-            'machine_number': '',
-            'photo_file_id': None
+            'application': '', 'dse': '', 'dse_name': '', 'problem_type': '',
+            'description': '', 'rc': '', 'photo_file_id': None
         }
-        
+    user_states[user_id]['waiting_for'] = 'dse_name'
+    await query.edit_message_text("Введите наименование ДСЕ:")
+
+
+@callback_router.exact('set_problem')
+async def _on_set_problem(update, context, query, data, user, user_id, param):
+    await show_problem_types(update, user_id)
+
+
+@callback_router.prefix('problem_')
+async def _on_problem(update, context, query, data, user, user_id, param):
+    if user_id not in user_states:
+        user_states[user_id] = {
+            'application': '', 'dse': '', 'problem_type': '',
+            'description': '', 'rc': '', 'photo_file_id': None
+        }
+    idx = int(param)
+    user_states[user_id]['problem_type'] = PROBLEM_TYPES[idx]
+    await show_application_menu(update, user_id)
+
+
+@callback_router.exact('set_rc')
+async def _on_set_rc(update, context, query, data, user, user_id, param):
+    await show_rc_types(update, user_id)
+
+
+@callback_router.prefix('rc_')
+async def _on_rc(update, context, query, data, user, user_id, param):
+    if user_id not in user_states:
+        user_states[user_id] = {
+            'application': '', 'dse': '', 'problem_type': '',
+            'description': '', 'rc': '', 'photo_file_id': None
+        }
+    idx = int(param)
+    user_states[user_id]['rc'] = RC_TYPES[idx]
+    await show_application_menu(update, user_id)
+
+
+@callback_router.exact('set_programmer')
+async def _on_set_programmer(update, context, query, data, user, user_id, param):
+    if user_id not in user_states:
+        user_states[user_id] = {
+            'application': '', 'dse': '', 'problem_type': '',
+            'description': '', 'rc': '', 'programmer_name': '', 
+            'machine_number': '', 'photo_file_id': None
+        }
+    user_states[user_id]['waiting_for'] = 'programmer_name'
+    await query.edit_message_text("Введите ФИО программиста:")
+
+
+@callback_router.exact('set_machine')
+async def _on_set_machine(update, context, query, data, user, user_id, param):
+    if user_id not in user_states:
+        user_states[user_id] = {
+            'application': '', 'dse': '', 'problem_type': '',
+            'description': '', 'rc': '', 'programmer_name': '', 
+            'machine_number': '', 'photo_file_id': None
+        }
+    user_states[user_id]['waiting_for'] = 'machine_number'
+    await query.edit_message_text("Введите номер станка:")
+
+
+@callback_router.exact('set_description')
+async def _on_set_description(update, context, query, data, user, user_id, param):
+    if user_id not in user_states:
+        user_states[user_id] = {
+            'application': '', 'dse': '', 'problem_type': '',
+            'description': '', 'rc': '', 'photo_file_id': None
+        }
+    user_states[user_id]['waiting_for'] = 'description'
+    await query.edit_message_text("Введите описание проблемы:")
+
+
+@callback_router.exact('set_photo')
+async def _on_set_photo(update, context, query, data, user, user_id, param):
+    if user_id not in user_states:
+        user_states[user_id] = {
+            'application': '', 'dse': '', 'problem_type': '',
+            'description': '', 'rc': '', 'photo_file_id': None
+        }
+    user_states[user_id]['waiting_for'] = 'photo'
+    await query.edit_message_text(
+        "📸 Отправьте фото или используйте /cancel_photo для пропуска.\n\n"
+        "Вы можете отправить одно фото."
+    )
+
+
+@callback_router.exact('send')
+async def _on_send(update, context, query, data, user, user_id, param):
+    # Отправка заявки
+    # Проверяем наличие данных пользователя
+    if user_id not in user_states:
         await query.edit_message_text(
-            "✅ Заявка отправлена на проверку. После утверждения она будет добавлена в базу.\n\n"
-            f"ДСЕ: {record['dse']}\n"
-            f"Тип проблемы: {record['problem_type']}\n"
-            f"РЦ: {record['rc']}\n"
-            f"Номер станка: {record['machine_number']}\n"
-            f"ФИО наладчика: {record['installer_fio']}\n"
-            f"ФИО программиста: {record['programmer_name']}\n"
-            f"Описание: {record['description']}\n"
-            f"Дата: {record['datetime']}\n"
-            f"ID заявки: {request_id}"
+            " Данные заявки не найдены!\n\n"
+            "Пожалуйста, создайте заявку заново через /start"
         )
-        await show_main_menu(update, user_id)
-    
-    elif data == 'send_application_email':
-        # Отправка заявки по email
-        await request_application_email_address(update, context)
-    
-    elif data == 'edit_application':
-        await show_application_menu(update, user_id)
-    
-    # === ПРОСМОТР ДСЕ ===
-    elif data == 'view_dse_list':
-        if has_permission(user_id, 'view_dse_list'):
-            await show_dse_list_menu(update, context)
-        else:
-            await query.edit_message_text(" У вас нет прав для просмотра списка ДСЕ.")
-    
-    elif data == 'dse_view_all' or data == 'view_all_dse':
-        await show_all_dse_records(update, context, page=0)
-    
-    elif data.startswith('dse_view_all_'):
-        page = int(data.split('_')[-1])
-        await show_all_dse_records(update, context, page=page)
-    
-    elif data.startswith('page_'):
-        page = int(data.split('_')[1])
-        await show_all_dse_records(update, context, page=page)
-    
-    elif data == 'dse_search_interactive' or data == 'interactive_dse_search':
-        await start_interactive_dse_search(update, context)
-    
-    elif data.startswith('dse_search_select_'):
-        idx = int(data.split('_')[-1])
-        await select_dse_from_search(update, context, idx)
-    
-    elif data == 'search_dse':
-        await start_dse_search(update, context, 'dse')
-    
-    elif data == 'dse_search_type' or data == 'search_type':
-        await start_dse_search(update, context, 'type')
-    
-    elif data == 'dse_statistics':
-        await show_dse_statistics(update, context)
-    
-    # === АДМИН МЕНЮ ===
-    elif data == 'admin_users':
-        if get_user_role(user_id) == 'admin':
-            await show_admin_menu(update, context)
-        else:
-            await query.edit_message_text(" У вас нет прав администратора.")
-    
-    elif data == 'admin_list_users':
-        if get_user_role(user_id) == 'admin':
-            await show_users_list(update, context)
-        else:
-            await query.edit_message_text(" У вас нет прав администратора.")
-    
-    elif data == 'admin_change_role_start':
-        if get_user_role(user_id) == 'admin':
-            await start_change_role_process(update, context, user_id)
-        else:
-            await query.edit_message_text(" У вас нет прав администратора.")
-    
-    # Новый обработчик для set_role_ (формат: set_role_<user_id>_<role>)
-    elif data.startswith('set_role_'):
-        if get_user_role(user_id) == 'admin':
-            parts = data.split('_')
-            if len(parts) >= 4:
-                target_user_id = parts[2]
-                role_name = parts[3]
-                
-                if role_name in ROLES:
-                    set_user_role(target_user_id, role_name)
-                    await query.answer(f"✅ Роль изменена на: {ROLES[role_name]}", show_alert=True)
-                    await show_admin_menu(update, context)
-                else:
-                    await query.answer(" Неверная роль", show_alert=True)
-        else:
-            await query.answer(" У вас нет прав администратора.", show_alert=True)
-    
-    # Старый обработчик role_ (оставляем для совместимости)
-    elif data.startswith('role_'):
-        if get_user_role(user_id) == 'admin':
-            role_name = data.split('_', 1)[1]
-            if user_id in admin_states and 'changing_role_for' in admin_states[user_id]:
-                target_user_id = admin_states[user_id]['changing_role_for']
+        return
+
+    user_data = user_states[user_id]
+
+    # Получаем ФИО наладчика из данных пользователя
+    creator_data = get_user_data(user_id)
+    creator_fio = ''
+    if creator_data:
+        first_name = creator_data.get('first_name', '')
+        last_name = creator_data.get('last_name', '')
+        creator_fio = f"{first_name} {last_name}".strip()
+
+    # Сохраняем фото локально для веб-доступа (повторно не скачивается)
+    photo_file_id = user_data.get('photo_file_id')
+    stored_photo = await ingest_telegram_photo(context.bot, photo_file_id) if photo_file_id else None
+    photo_path = stored_photo['path'] if stored_photo else None
+    photo_hash = stored_photo['hash'] if stored_photo else None
+
+    record = {
+        'dse': user_data.get('dse', ''),
+        'dse_name': user_data.get('dse_name', ''),
+        'problem_type': user_data.get('problem_type', ''),
+        'rc': user_data.get('rc', ''),
+        'description': user_data.get('description', ''),
+        'datetime': dt.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'user_id': user_id,
+        'photo_file_id': photo_file_id,
+        'photo_path': photo_path,
+        'photo_hash': photo_hash,
+        'programmer_name': user_data.get('programmer_name', ''),
+        'machine_number': user_data.get('machine_number', ''),
+        'installer_fio': creator_fio
+    }
+
+    request_id = add_pending_dse_request(record, user_id)
+
+    # Очищаем данные пользователя
+    user_states[user_id] = {
+        'application': '',
+        'dse': '',
+        'dse_name': '',
+        'problem_type': '',
+        'description': '',
+        'rc': '',
+        'programmer_name': '',
+        'machine_number': '',
+        'photo_file_id': None
+    }
+
+    await query.edit_message_text(
+        "✅ Заявка отправлена на проверку. После утверждения она будет добавлена в базу.\n\n"
+        f"ДСЕ: {record['dse']}\n"
+        f"Тип проблемы: {record['problem_type']}\n"
+        f"РЦ: {record['rc']}\n"
+        f"Номер станка: {record['machine_number']}\n"
+        f"ФИО наладчика: {record['installer_fio']}\n"
+        f"ФИО программиста: {record['programmer_name']}\n"
+        f"Описание: {record['description']}\n"
+        f"Дата: {record['datetime']}\n"
+        f"ID заявки: {request_id}"
+    )
+    await show_main_menu(update, user_id)
+
+
+@callback_router.exact('send_application_email')
+async def _on_send_application_email(update, context, query, data, user, user_id, param):
+    # Отправка заявки по email
+    await request_application_email_address(update, context)
+
+
+@callback_router.exact('edit_application')
+async def _on_edit_application(update, context, query, data, user, user_id, param):
+    await show_application_menu(update, user_id)
+
+
+# === ПРОСМОТР ДСЕ ===
+@callback_router.exact('view_dse_list')
+async def _on_view_dse_list(update, context, query, data, user, user_id, param):
+    if has_permission(user_id, 'view_dse_list'):
+        await show_dse_list_menu(update, context)
+    else:
+        await query.edit_message_text(" У вас нет прав для просмотра списка ДСЕ.")
+
+
+@callback_router.exact('dse_view_all', 'view_all_dse')
+async def _on_dse_view_all(update, context, query, data, user, user_id, param):
+    await show_all_dse_records(update, context, page=0)
+
+
+@callback_router.prefix('dse_view_all_')
+async def _on_dse_view_all_prefix(update, context, query, data, user, user_id, param):
+    page = int(param)
+    await show_all_dse_records(update, context, page=page)
+
+
+@callback_router.prefix('page_')
+async def _on_page(update, context, query, data, user, user_id, param):
+    page = int(param)
+    await show_all_dse_records(update, context, page=page)
+
+
+@callback_router.exact('dse_search_interactive', 'interactive_dse_search')
+async def _on_dse_search_interactive(update, context, query, data, user, user_id, param):
+    await start_interactive_dse_search(update, context)
+
+
+@callback_router.prefix('dse_search_select_')
+async def _on_dse_search_select(update, context, query, data, user, user_id, param):
+    idx = int(param)
+    await select_dse_from_search(update, context, idx)
+
+
+@callback_router.exact('search_dse')
+async def _on_search_dse(update, context, query, data, user, user_id, param):
+    await start_dse_search(update, context, 'dse')
+
+
+@callback_router.exact('dse_search_type', 'search_type')
+async def _on_dse_search_type(update, context, query, data, user, user_id, param):
+    await start_dse_search(update, context, 'type')
+
+
+@callback_router.exact('dse_statistics')
+async def _on_dse_statistics(update, context, query, data, user, user_id, param):
+    await show_dse_statistics(update, context)
+
+
+# === АДМИН МЕНЮ ===
+@callback_router.exact('admin_users')
+async def _on_admin_users(update, context, query, data, user, user_id, param):
+    if get_user_role(user_id) == 'admin':
+        await show_admin_menu(update, context)
+    else:
+        await query.edit_message_text(" У вас нет прав администратора.")
+
+
+@callback_router.exact('admin_list_users')
+async def _on_admin_list_users(update, context, query, data, user, user_id, param):
+    if get_user_role(user_id) == 'admin':
+        await show_users_list(update, context)
+    else:
+        await query.edit_message_text(" У вас нет прав администратора.")
+
+
+@callback_router.exact('admin_change_role_start')
+async def _on_admin_change_role_start(update, context, query, data, user, user_id, param):
+    if get_user_role(user_id) == 'admin':
+        await start_change_role_process(update, context, user_id)
+    else:
+        await query.edit_message_text(" У вас нет прав администратора.")
+
+
+# Новый обработчик для set_role_ (формат: set_role_<user_id>_<role>)
+@callback_router.prefix('set_role_')
+async def _on_set_role(update, context, query, data, user, user_id, param):
+    if get_user_role(user_id) == 'admin':
+        parts = data.split('_')
+        if len(parts) >= 4:
+            target_user_id = parts[2]
+            role_name = parts[3]
+
+            if role_name in ROLES:
                 set_user_role(target_user_id, role_name)
-                admin_states[user_id].pop('changing_role_for', None)
-                admin_states[user_id].pop('changing_role', None)
-                await query.edit_message_text(f"✅ Роль изменена на: {ROLES[role_name]}")
+                await query.answer(f"✅ Роль изменена на: {ROLES[role_name]}", show_alert=True)
                 await show_admin_menu(update, context)
-    
-    elif data == 'admin_export_data':
-        if get_user_role(user_id) == 'admin':
-            await start_data_export(update, context)
-        else:
-            await query.edit_message_text(" У вас нет прав администратора.")
-    
-    # === ОБРАБОТЧИКИ ЭКСПОРТА ===
-    elif data == 'export_send_chat':
-        if get_user_role(user_id) == 'admin':
-            await send_file_to_chat(update, context)
-        else:
-            await query.edit_message_text(" У вас нет прав администратора.")
-    
-    elif data == 'export_send_email_excel':
-        if get_user_role(user_id) == 'admin':
-            await request_email_address(update, context, format_type="excel")
-        else:
-            await query.edit_message_text(" У вас нет прав администратора.")
-    
-    elif data == 'export_send_email_text':
-        if get_user_role(user_id) == 'admin':
-            await request_email_address(update, context, format_type="text")
-        else:
-            await query.edit_message_text(" У вас нет прав администратора.")
-    
-    elif data == 'admin_test_smtp':
-        if get_user_role(user_id) == 'admin':
-            await test_smtp_connection(update, context)
-        else:
-            await query.edit_message_text(" У вас нет прав администратора.")
-    
-    elif data == 'admin_manage_nicknames':
-        if get_user_role(user_id) == 'admin':
-            await show_nicknames_menu(update, context)
-        else:
-            await query.edit_message_text(" У вас нет прав администратора.")
-    
-    elif data == 'nickname_set':
-        if get_user_role(user_id) == 'admin':
-            await show_users_for_nickname(update, context, 'set')
-        else:
-            await query.edit_message_text(" У вас нет прав администратора.")
-    
-    elif data == 'nickname_remove':
-        if get_user_role(user_id) == 'admin':
-            await show_users_for_nickname(update, context, 'remove')
-        else:
-            await query.edit_message_text(" У вас нет прав администратора.")
-    
-    elif data == 'nickname_list':
-        if get_user_role(user_id) == 'admin':
-            await show_nicknames_list(update, context)
-        else:
-            await query.edit_message_text(" У вас нет прав администратора.")
-    
-    elif data.startswith('nickname_set_user_'):
-        if get_user_role(user_id) == 'admin':
-            target_user_id = data.split('_')[-1]
-            await start_nickname_input(update, context, target_user_id)
-        else:
-            await query.edit_message_text(" У вас нет прав администратора.")
-    
-    elif data.startswith('nickname_remove_user_'):
-        if get_user_role(user_id) == 'admin':
-            target_user_id = data.split('_')[-1]
-            await remove_nickname_confirm(update, context, target_user_id)
-        else:
-            await query.edit_message_text(" У вас нет прав администратора.")
-    
-    # === ОТСЛЕЖИВАНИЕ ДСЕ ===
-    elif data == 'watch_dse_menu':
+            else:
+                await query.answer(" Неверная роль", show_alert=True)
+    else:
+        await query.answer(" У вас нет прав администратора.", show_alert=True)
+
+
+# Старый обработчик role_ (оставляем для совместимости)
+@callback_router.prefix('role_')
+async def _on_role(update, context, query, data, user, user_id, param):
+    if get_user_role(user_id) == 'admin':
+        role_name = data.split('_', 1)[1]
+        if user_id in admin_states and 'changing_role_for' in admin_states[user_id]:
+            target_user_id = admin_states[user_id]['changing_role_for']
+            set_user_role(target_user_id, role_name)
+            admin_states[user_id].pop('changing_role_for', None)
+            admin_states[user_id].pop('changing_role', None)
+            await query.edit_message_text(f"✅ Роль изменена на: {ROLES[role_name]}")
+            await show_admin_menu(update, context)
+
+
+@callback_router.exact('admin_export_data')
+async def _on_admin_export_data(update, context, query, data, user, user_id, param):
+    if get_user_role(user_id) == 'admin':
+        await start_data_export(update, context)
+    else:
+        await query.edit_message_text(" У вас нет прав администратора.")
+
+
+# === ОБРАБОТЧИКИ ЭКСПОРТА ===
+@callback_router.exact('export_send_chat')
+async def _on_export_send_chat(update, context, query, data, user, user_id, param):
+    if get_user_role(user_id) == 'admin':
+        await send_file_to_chat(update, context)
+    else:
+        await query.edit_message_text(" У вас нет прав администратора.")
+
+
+@callback_router.exact('export_send_email_excel')
+async def _on_export_send_email_excel(update, context, query, data, user, user_id, param):
+    if get_user_role(user_id) == 'admin':
+        await request_email_address(update, context, format_type="excel")
+    else:
+        await query.edit_message_text(" У вас нет прав администратора.")
+
+
+@callback_router.exact('export_send_email_text')
+async def _on_export_send_email_text(update, context, query, data, user, user_id, param):
+    if get_user_role(user_id) == 'admin':
+        await request_email_address(update, context, format_type="text")
+    else:
+        await query.edit_message_text(" У вас нет прав администратора.")
+
+
+@callback_router.exact('admin_test_smtp')
+async def _on_admin_test_smtp(update, context, query, data, user, user_id, param):
+    if get_user_role(user_id) == 'admin':
+        await test_smtp_connection(update, context)
+    else:
+        await query.edit_message_text(" У вас нет прав администратора.")
+
+
+@callback_router.exact('admin_manage_nicknames')
+async def _on_admin_manage_nicknames(update, context, query, data, user, user_id, param):
+    if get_user_role(user_id) == 'admin':
+        await show_nicknames_menu(update, context)
+    else:
+        await query.edit_message_text(" У вас нет прав администратора.")
+
+
+@callback_router.exact('nickname_set')
+async def _on_nickname_set(update, context, query, data, user, user_id, param):
+    if get_user_role(user_id) == 'admin':
+        await show_users_for_nickname(update, context, 'set')
+    else:
+        await query.edit_message_text(" У вас нет прав администратора.")
+
+
+@callback_router.exact('nickname_remove')
+async def _on_nickname_remove(update, context, query, data, user, user_id, param):
+    if get_user_role(user_id) == 'admin':
+        await show_users_for_nickname(update, context, 'remove')
+    else:
+        await query.edit_message_text(" У вас нет прав администратора.")
+
+
+@callback_router.exact('nickname_list')
+async def _on_nickname_list(update, context, query, data, user, user_id, param):
+    if get_user_role(user_id) == 'admin':
+        await show_nicknames_list(update, context)
+    else:
+        await query.edit_message_text(" У вас нет прав администратора.")
+
+
+@callback_router.prefix('nickname_set_user_')
+async def _on_nickname_set_user(update, context, query, data, user, user_id, param):
+    if get_user_role(user_id) == 'admin':
+        target_user_id = param
+        await start_nickname_input(update, context, target_user_id)
+    else:
+        await query.edit_message_text(" У вас нет прав администратора.")
+
+
+@callback_router.prefix('nickname_remove_user_')
+async def _on_nickname_remove_user(update, context, query, data, user, user_id, param):
+    if get_user_role(user_id) == 'admin':
+        target_user_id = param
+        await remove_nickname_confirm(update, context, target_user_id)
+    else:
+        await query.edit_message_text(" У вас нет прав администратора.")
+
+
+# === ОТСЛЕЖИВАНИЕ ДСЕ ===
+@callback_router.exact('watch_dse_menu')
+async def _on_watch_dse_menu(update, context, query, data, user, user_id, param):
+    await show_watched_dse_menu(update, context)
+
+
+@callback_router.exact('watch_add_dse')
+async def _on_watch_add_dse(update, context, query, data, user, user_id, param):
+    await start_add_watched_dse(update, context)
+
+
+@callback_router.exact('watch_remove_dse')
+async def _on_watch_remove_dse(update, context, query, data, user, user_id, param):
+    await start_remove_watched_dse(update, context)
+
+
+@callback_router.prefix('watch_rm_idx_')
+async def _on_watch_rm_idx(update, context, query, data, user, user_id, param):
+    idx = int(param)
+    from .dse_watcher import get_watched_dse_list, remove_watched_dse
+    watched_list = get_watched_dse_list(user_id)
+    if 0 <= idx < len(watched_list):
+        dse_to_remove = watched_list[idx]
+        remove_watched_dse(user_id, dse_to_remove)
+        await query.edit_message_text(f"✅ ДСЕ {dse_to_remove} удалён из отслеживания.")
         await show_watched_dse_menu(update, context)
-    
-    elif data == 'watch_add_dse':
-        await start_add_watched_dse(update, context)
-    
-    elif data == 'watch_remove_dse':
-        await start_remove_watched_dse(update, context)
-    
-    elif data.startswith('watch_rm_idx_'):
-        idx = int(data.split('_')[-1])
-        from .dse_watcher import get_watched_dse_list, remove_watched_dse
-        watched_list = get_watched_dse_list(user_id)
-        if 0 <= idx < len(watched_list):
-            dse_to_remove = watched_list[idx]
-            remove_watched_dse(user_id, dse_to_remove)
-            await query.edit_message_text(f"✅ ДСЕ {dse_to_remove} удалён из отслеживания.")
+
+
+@callback_router.exact('watch_list', 'watch_list_dse')
+async def _on_watch_list(update, context, query, data, user, user_id, param):
+    await show_watched_dse_list(update, context)
+
+
+@callback_router.exact('watch_add_pattern')
+async def _on_watch_add_pattern(update, context, query, data, user, user_id, param):
+    user_states[user_id] = user_states.get(user_id, {})
+    user_states[user_id]['watch_dse_state'] = 'awaiting_pattern_input'
+    await query.edit_message_text(
+        "🔣 Введите шаблон ДСЕ для отслеживания.\n\n"
+        "* — любая последовательность символов, ? — один символ.\n"
+        "Шаблон начинается минимум с 3 обычных символов, символов * — не больше 2.\n"
+        "Пример: АБВГ.301.*"
+    )
+
+
+@callback_router.prefix('watch_select_dse_')
+async def _on_watch_select_dse(update, context, query, data, user, user_id, param):
+    idx_str = param
+    if idx_str == 'manual':
+        user_states[user_id] = user_states.get(user_id, {})
+        user_states[user_id]['watch_dse_state'] = 'awaiting_manual_input'
+        await query.edit_message_text("📝 Введите номер ДСЕ для отслеживания:")
+    else:
+        from .dse_watcher import add_watched_dse
+        dse_list = get_unique_dse_values()
+        idx = int(idx_str)
+        if 0 <= idx < len(dse_list):
+            dse_value = dse_list[idx]
+            add_watched_dse(user_id, dse_value)
+            await query.edit_message_text(f"✅ ДСЕ {dse_value} добавлен в отслеживание!")
             await show_watched_dse_menu(update, context)
-    
-    elif data == 'watch_list':
-        await show_watched_dse_list(update, context)
-    
-    elif data.startswith('watch_select_dse_'):
-        idx_str = data.split('_')[-1]
-        if idx_str == 'manual':
-            user_states[user_id] = user_states.get(user_id, {})
-            user_states[user_id]['watch_dse_state'] = 'awaiting_manual_input'
-            await query.edit_message_text("📝 Введите номер ДСЕ для отслеживания:")
+
+
+# === ПОДПИСКА НА ЗАЯВКИ ===
+@callback_router.exact('subscription_menu')
+async def _on_subscription_menu(update, context, query, data, user, user_id, param):
+    await show_subscription_menu(update, context)
+
+
+@callback_router.exact('subscription_add')
+async def _on_subscription_add(update, context, query, data, user, user_id, param):
+    await start_add_subscription(update, context)
+
+
+@callback_router.prefix('subscription_delivery_')
+async def _on_subscription_delivery(update, context, query, data, user, user_id, param):
+    delivery_type = param
+    await process_subscription_delivery_type(update, context, delivery_type)
+
+
+@callback_router.exact('subscription_remove')
+async def _on_subscription_remove(update, context, query, data, user, user_id, param):
+    await confirm_remove_subscription(update, context)
+
+
+@callback_router.exact('subscription_remove_confirm')
+async def _on_subscription_remove_confirm(update, context, query, data, user, user_id, param):
+    await remove_user_subscription(update, context)
+
+
+@callback_router.exact('subscription_toggle')
+async def _on_subscription_toggle(update, context, query, data, user, user_id, param):
+    await toggle_user_subscription(update, context)
+
+
+@callback_router.exact('subscription_status')
+async def _on_subscription_status(update, context, query, data, user, user_id, param):
+    await show_subscription_status(update, context)
+
+
+@callback_router.exact('subscription_filters')
+async def _on_subscription_filters(update, context, query, data, user, user_id, param):
+    await show_subscription_filters_menu(update, context)
+
+
+@callback_router.exact('sub_filter_field_rc', 'sub_filter_field_problem_type')
+async def _on_sub_filter_field_rc(update, context, query, data, user, user_id, param):
+    await show_subscription_filter_options(update, context, data.replace('sub_filter_field_', '', 1))
+
+
+@callback_router.prefix('sub_filter_toggle_')
+async def _on_sub_filter_toggle(update, context, query, data, user, user_id, param):
+    field, idx_str = param.rsplit('_', 1)
+    options = RC_TYPES if field == 'rc' else PROBLEM_TYPES
+    idx = int(idx_str)
+    if field in ('rc', 'problem_type') and 0 <= idx < len(options):
+        from bot.subscription_manager import get_subscription_filters, set_subscription_filters
+        filters = get_subscription_filters(user_id)
+        values = list(filters.get(field, []))
+        if options[idx] in values:
+            values.remove(options[idx])
         else:
-            from .dse_watcher import add_watched_dse
-            dse_list = get_unique_dse_values()
-            idx = int(idx_str)
-            if 0 <= idx < len(dse_list):
-                dse_value = dse_list[idx]
-                add_watched_dse(user_id, dse_value)
-                await query.edit_message_text(f"✅ ДСЕ {dse_value} добавлен в отслеживание!")
-                await show_watched_dse_menu(update, context)
-    
-    # === ПОДПИСКА НА ЗАЯВКИ ===
-    elif data == 'subscription_menu':
-        await show_subscription_menu(update, context)
-    
-    elif data == 'subscription_add':
-        await start_add_subscription(update, context)
-    
-    elif data.startswith('subscription_delivery_'):
-        delivery_type = data.split('_')[-1]
-        await process_subscription_delivery_type(update, context, delivery_type)
-    
-    elif data == 'subscription_remove':
-        await confirm_remove_subscription(update, context)
-    
-    elif data == 'subscription_remove_confirm':
-        await remove_user_subscription(update, context)
-    
-    elif data == 'subscription_toggle':
-        await toggle_user_subscription(update, context)
-    
-    elif data == 'subscription_status':
-        await show_subscription_status(update, context)
-    
-    # === ЧАТ ПО ДСЕ ===
-    elif data == 'chat_dse_menu':
-        from .chat_manager import show_chat_menu
-        await show_chat_menu(update, context)
-    
-    elif data == 'chat_start_search':
-        await start_dse_chat_search_with_selection(update, context)
-    
-    elif data.startswith('chat_select_dse_'):
-        idx_str = data.split('_')[-1]
-        if idx_str == 'manual':
+            values.append(options[idx])
+        filters[field] = values
+        set_subscription_filters(user_id, filters)
+        await show_subscription_filter_options(update, context, field)
+
+
+@callback_router.exact('sub_filter_input_dse_prefix', 'sub_filter_input_machine_number')
+async def _on_sub_filter_input_dse_prefix(update, context, query, data, user, user_id, param):
+    field = data.replace('sub_filter_input_', '', 1)
+    user_states[user_id] = user_states.get(user_id, {})
+    user_states[user_id]['waiting_for'] = f'subscription_filter_{field}'
+    prompt = "префиксы ДСЕ (например АБВГ.301)" if field == 'dse_prefix' else "номера станков"
+    await query.edit_message_text(
+        f"✏️ Введите {prompt} через запятую.\n"
+        f"Отправьте «-», чтобы снять ограничение."
+    )
+
+
+@callback_router.exact('sub_filter_reset')
+async def _on_sub_filter_reset(update, context, query, data, user, user_id, param):
+    from bot.subscription_manager import set_subscription_filters
+    set_subscription_filters(user_id, {})
+    await show_subscription_filters_menu(update, context)
+
+
+# === РЕЖИМ УВЕДОМЛЕНИЙ (СВОДКИ) ===
+@callback_router.exact('digest_menu')
+async def _on_digest_menu(update, context, query, data, user, user_id, param):
+    await show_digest_menu(update, context)
+
+
+@callback_router.prefix('digest_mode_')
+async def _on_digest_mode(update, context, query, data, user, user_id, param):
+    from bot.digest_manager import set_digest_mode
+    set_digest_mode(user_id, param)
+    await show_digest_menu(update, context)
+
+
+@callback_router.exact('digest_toggle_pdf')
+async def _on_digest_toggle_pdf(update, context, query, data, user, user_id, param):
+    from bot.digest_manager import toggle_digest_pdf
+    toggle_digest_pdf(user_id)
+    await show_digest_menu(update, context)
+
+
+# === ЧАТ ПО ДСЕ ===
+@callback_router.exact('chat_dse_menu')
+async def _on_chat_dse_menu(update, context, query, data, user, user_id, param):
+    from .chat_manager import show_chat_menu
+    await show_chat_menu(update, context)
+
+
+@callback_router.exact('chat_start_search')
+async def _on_chat_start_search(update, context, query, data, user, user_id, param):
+    await start_dse_chat_search_with_selection(update, context)
+
+
+@callback_router.prefix('chat_select_dse_')
+async def _on_chat_select_dse(update, context, query, data, user, user_id, param):
+    idx_str = param
+    if idx_str == 'manual':
+        user_states[user_id] = user_states.get(user_id, {})
+        user_states[user_id]['dse_chat_state'] = 'awaiting_manual_input'
+        await query.edit_message_text("📝 Введите номер ДСЕ для начала чата:")
+    else:
+        from .chat_manager import handle_dse_input
+        dse_list = get_unique_dse_values()
+        idx = int(idx_str)
+        if 0 <= idx < len(dse_list):
+            dse_value = dse_list[idx]
+            # Имитируем текстовое сообщение
             user_states[user_id] = user_states.get(user_id, {})
-            user_states[user_id]['dse_chat_state'] = 'awaiting_manual_input'
-            await query.edit_message_text("📝 Введите номер ДСЕ для начала чата:")
-        else:
-            from .chat_manager import handle_dse_input
-            dse_list = get_unique_dse_values()
-            idx = int(idx_str)
-            if 0 <= idx < len(dse_list):
-                dse_value = dse_list[idx]
-                # Имитируем текстовое сообщение
-                user_states[user_id] = user_states.get(user_id, {})
-                user_states[user_id]['dse_chat_state'] = 'selecting_or_manual'
-                # Вызываем handle_dse_input с выбранным ДСЕ
-                from .chat_manager import initiate_dse_chat_search
-                user_states[user_id]['dse_chat_dse_value'] = dse_value
-                await handle_dse_input(update, context)
-    
-    # === ПРОСМОТР ДЕТАЛЬНОЙ ИНФОРМАЦИИ О ЗАПИСИ ===
-    elif data.startswith('view_record_'):
-        idx = int(data.split('_')[-1])
-        await show_dse_record_detail(update, context, idx)
-    
-    # === ОБРАБОТЧИКИ ЧАТА (из chat_manager) ===
-    elif data.startswith('dse_chat_'):
-        # Обработка всех callback от чата
-        from .chat_manager import handle_chat_callbacks
-        await handle_chat_callbacks(update, context)
-    
-    elif data.startswith('chat_confirm_target_') or data.startswith('chat_decline_target_'):
-        from .chat_manager import handle_initiator_confirmation
-        await handle_initiator_confirmation(update, context)
-    
-    elif data.startswith('chat_accept_') or data.startswith('chat_decline_'):
-        from .chat_manager import handle_responder_confirmation
-        await handle_responder_confirmation(update, context)
-    
-    elif data in ['chat_pause', 'chat_resume', 'chat_end', 'chat_back']:
-        from .chat_manager import handle_chat_control
-        await handle_chat_control(update, context)
-    
-    # === PDF ЭКСПОРТ ===
-    elif data == 'pdf_export_menu':
-        if has_permission(user_id, 'pdf_export'):
-            # Быстрое отображение меню без загрузки данных
-            keyboard = [
-                [InlineKeyboardButton("📄 Экспорт всех записей", callback_data='pdf_export_all')],
-                [InlineKeyboardButton("📋 Выбрать записи", callback_data='pdf_export_select')],
-                [InlineKeyboardButton("⬅️ Главное меню", callback_data='back_to_main')]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.edit_message_text(
-                "📊 *Экспорт в PDF*\n\n"
-                "Выберите опцию экспорта:",
-                reply_markup=reply_markup,
-                parse_mode='Markdown'
-            )
-        else:
-            await query.edit_message_text(" У вас нет прав для экспорта PDF.")
-    
-    elif data == 'pdf_export_all':
-        if has_permission(user_id, 'pdf_export'):
-            from .pdf_generator import handle_pdf_export_all
-            await handle_pdf_export_all(update, context)
-        else:
-            await query.answer(" У вас нет прав для экспорта PDF.", show_alert=True)
-    
-    elif data == 'pdf_export_select':
-        if has_permission(user_id, 'pdf_export'):
-            from .pdf_generator import handle_pdf_export_select
-            await handle_pdf_export_select(update, context)
-        else:
-            await query.answer(" У вас нет прав для экспорта PDF.", show_alert=True)
+            user_states[user_id]['dse_chat_state'] = 'selecting_or_manual'
+            # Вызываем handle_dse_input с выбранным ДСЕ
+            from .chat_manager import initiate_dse_chat_search
+            user_states[user_id]['dse_chat_dse_value'] = dse_value
+            await handle_dse_input(update, context)
+
+
+# === ПРОСМОТР ДЕТАЛЬНОЙ ИНФОРМАЦИИ О ЗАПИСИ ===
+@callback_router.prefix('view_record_')
+async def _on_view_record(update, context, query, data, user, user_id, param):
+    idx = int(param)
+    await show_dse_record_detail(update, context, idx)
+
+
+# === ОБРАБОТЧИКИ ЧАТА (из chat_manager) ===
+@callback_router.prefix('dse_chat_')
+async def _on_dse_chat(update, context, query, data, user, user_id, param):
+    # Обработка всех callback от чата
+    from .chat_manager import handle_chat_callbacks
+    await handle_chat_callbacks(update, context)
+
+
+@callback_router.prefix('chat_confirm_target_', 'chat_decline_target_')
+async def _on_chat_confirm_target(update, context, query, data, user, user_id, param):
+    from .chat_manager import handle_initiator_confirmation
+    await handle_initiator_confirmation(update, context)
+
+
+@callback_router.prefix('chat_accept_', 'chat_decline_')
+async def _on_chat_accept(update, context, query, data, user, user_id, param):
+    from .chat_manager import handle_responder_confirmation
+    await handle_responder_confirmation(update, context)
+
+
+@callback_router.exact('chat_pause', 'chat_resume', 'chat_end', 'chat_back')
+async def _on_chat_pause(update, context, query, data, user, user_id, param):
+    from .chat_manager import handle_chat_control
+    await handle_chat_control(update, context)
+
+
+# === ПРОВЕРКА ЗАЯВОК ===
+@callback_router.exact('pending_review_menu')
+async def _on_pending_review_menu(update, context, query, data, user, user_id, param):
+    await show_pending_requests_menu(update, context)
+
+
+@callback_router.prefix('pending_toggle_')
+async def _on_pending_toggle(update, context, query, data, user, user_id, param):
+    await toggle_pending_request_selection(update, context, param)
+
+
+@callback_router.exact('pending_select_all')
+async def _on_pending_select_all(update, context, query, data, user, user_id, param):
+    from .dse_manager import get_pending_dse_requests
+    dse_view_states[user_id] = dse_view_states.get(user_id, {})
+    dse_view_states[user_id]['pending_selected'] = [
+        str(item['id']) for item in get_pending_dse_requests()[:PENDING_REVIEW_PAGE_SIZE]
+    ]
+    await show_pending_requests_menu(update, context)
+
+
+@callback_router.exact('pending_clear')
+async def _on_pending_clear(update, context, query, data, user, user_id, param):
+    dse_view_states.get(user_id, {}).pop('pending_selected', None)
+    await show_pending_requests_menu(update, context)
+
+
+@callback_router.exact('pending_approve_selected')
+async def _on_pending_approve_selected(update, context, query, data, user, user_id, param):
+    await process_selected_pending_requests(update, context, 'approve')
+
+
+@callback_router.exact('pending_reject_selected')
+async def _on_pending_reject_selected(update, context, query, data, user, user_id, param):
+    await process_selected_pending_requests(update, context, 'reject')
+
+
+# === PDF ЭКСПОРТ ===
+@callback_router.exact('pdf_export_menu')
+async def _on_pdf_export_menu(update, context, query, data, user, user_id, param):
+    if has_permission(user_id, 'pdf_export'):
+        # Быстрое отображение меню без загрузки данных
+        keyboard = [
+            [InlineKeyboardButton("📄 Экспорт всех записей", callback_data='pdf_export_all')],
+            [InlineKeyboardButton("📋 Выбрать записи", callback_data='pdf_export_select')],
+            [InlineKeyboardButton("⬅️ Главное меню", callback_data='back_to_main')]
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        await query.edit_message_text(
+            "📊 *Экспорт в PDF*\n\n"
+            "Выберите опцию экспорта:",
+            reply_markup=reply_markup,
+            parse_mode='Markdown'
+        )
+    else:
+        await query.edit_message_text(" У вас нет прав для экспорта PDF.")
+
+
+@callback_router.exact('pdf_export_all')
+async def _on_pdf_export_all(update, context, query, data, user, user_id, param):
+    if has_permission(user_id, 'pdf_export'):
+        from .pdf_generator import handle_pdf_export_all
+        await handle_pdf_export_all(update, context)
+    else:
+        await query.answer(" У вас нет прав для экспорта PDF.", show_alert=True)
+
+
+@callback_router.exact('pdf_export_select')
+async def _on_pdf_export_select(update, context, query, data, user, user_id, param):
+    if has_permission(user_id, 'pdf_export'):
+        from .pdf_generator import handle_pdf_export_select
+        await handle_pdf_export_select(update, context)
+    else:
+        await query.answer(" У вас нет прав для экспорта PDF.", show_alert=True)
+
+
+@callback_router.prefix('pdf_select_dse_')
+async def _on_pdf_select_dse(update, context, query, data, user, user_id, param):
+    if has_permission(user_id, 'pdf_export'):
+        from .pdf_generator import handle_pdf_select_dse
+        dse_name = param
+        await handle_pdf_select_dse(update, context, dse_name)
+    else:
+        await query.answer(" У вас нет прав для экспорта PDF.", show_alert=True)
+
+
+@callback_router.exact('pdf_export_selected')
+async def _on_pdf_export_selected(update, context, query, data, user, user_id, param):
+    if has_permission(user_id, 'pdf_export'):
+        from .pdf_generator import handle_pdf_export_selected
+        await handle_pdf_export_selected(update, context)
+    else:
+        await query.answer(" У вас нет прав для экспорта PDF.", show_alert=True)
+
+
+async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обработчик всех нажатий на кнопки"""
+    query = update.callback_query
+    await query.answer()
     
-    elif data.startswith('pdf_select_dse_'):
-        if has_permission(user_id, 'pdf_export'):
-            from .pdf_generator import handle_pdf_select_dse
-            dse_name = data.replace('pdf_select_dse_', '')
-            await handle_pdf_select_dse(update, context, dse_name)
-        else:
-            await query.answer(" У вас нет прав для экспорта PDF.", show_alert=True)
+    data = query.data
+    user = query.from_user
+    user_id = str(user.id)
     
-    elif data == 'pdf_export_selected':
-        if has_permission(user_id, 'pdf_export'):
-            from .pdf_generator import handle_pdf_export_selected
-            await handle_pdf_export_selected(update, context)
-        else:
-            await query.answer(" У вас нет прав для экспорта PDF.", show_alert=True)
+    # Выбор обработчика по таблице маршрутов (точное совпадение или самый длинный префикс)
+    route = callback_router.resolve(data)
+    if route is None:
+        return
+    handler, param = route
+    await handler(update, context, query, data, user, user_id, param)
 
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -2637,13 +3012,35 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             
             # === ОТСЛЕЖИВАНИЕ ДСЕ ===
             elif user_data.get('watch_dse_state') == 'awaiting_manual_input':
-                from .dse_watcher import add_watched_dse
+                from .dse_watcher import add_watched_dse, validate_watch_pattern
                 dse_value = text.strip().upper()
+                error = validate_watch_pattern(dse_value)
+                if error:
+                    await update.message.reply_text(f"❌ {error}\n\nПример: АБВГ.301.*")
+                    return
                 add_watched_dse(user_id, dse_value)
                 user_states[user_id].pop('watch_dse_state', None)
                 await update.message.reply_text(f"✅ ДСЕ {dse_value} добавлен в отслеживание!")
                 await show_watched_dse_menu(update, context)
                 return
+
+            elif user_data.get('watch_dse_state') == 'awaiting_pattern_input':
+                from .dse_watcher import add_watched_dse, is_watch_pattern, validate_watch_pattern
+                pattern = text.strip().upper()
+                if not is_watch_pattern(pattern):
+                    await update.message.reply_text(
+                        "❌ Шаблон должен содержать * или ?.\n\nПример: АБВГ.301.*"
+                    )
+                    return
+                error = validate_watch_pattern(pattern)
+                if error:
+                    await update.message.reply_text(f"❌ {error}\n\nПример: АБВГ.301.*")
+                    return
+                add_watched_dse(user_id, pattern)
+                user_states[user_id].pop('watch_dse_state', None)
+                await update.message.reply_text(f"✅ Шаблон {pattern} добавлен в отслеживание!")
+                await show_watched_dse_menu(update, context)
+                return
             
             # === ЧАТ ПО ДСЕ ===
             elif user_data.get('dse_chat_state') == 'awaiting_manual_input':
@@ -3065,122 +3462,100 @@ async def qr_photo_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     try:
         # Получаем фото в максимальном разрешении
         photo = update.message.photo[-1]
-        file = await context.bot.get_file(photo.file_id)
         
-        # Скачиваем фото во временный файл
-        import tempfile
-        import os
-        from pyzbar import pyzbar
-        from PIL import Image
-        import requests
+        # Скачиваем фото в память и распознаём QR в пуле потоков (не блокирует бота)
+        from bot.qr_scanner import scan_qr_from_photo
+        qr_data = await scan_qr_from_photo(context.bot, photo)
         
-        with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as temp_file:
-            # Скачиваем файл
-            response = requests.get(file.file_path)
-            temp_file.write(response.content)
-            temp_path = temp_file.name
+        if not qr_data:
+            await update.message.reply_text(" QR код не найден на изображении.")
+            return
         
-        try:
-            # Открываем изображение и ищем QR коды
-            image = Image.open(temp_path)
-            decoded_objects = pyzbar.decode(image)
+        # Ищем код приглашения в QR данных
+        invite_code = None
+        
+        # Проверяем разные форматы:
+        # 1. https://t.me/bot?start=invite_CODE
+        import re
+        url_match = re.search(r'start=invite_([A-Z0-9]+)', qr_data, re.IGNORECASE)
+        if url_match:
+            invite_code = url_match.group(1).upper()
+        # 2. Просто код
+        elif re.match(r'^[A-Z0-9]{12}$', qr_data.strip(), re.IGNORECASE):
+            invite_code = qr_data.strip().upper()
+        
+        if invite_code:
+            # Проверяем, зарегистрирован ли пользователь
+            from bot.user_manager import is_user_registered, get_user_data
             
-            if not decoded_objects:
-                await update.message.reply_text(" QR код не найден на изображении.")
+            if not is_user_registered(user_id):
+                # Пользователь не зарегистрирован - запускаем процесс регистрации с кодом приглашения
+                registration_states[user_id] = {
+                    'step': 'ask_first_name',
+                    'username': user.username,
+                    'invite_code': invite_code
+                }
+                await update.message.reply_text(
+                    f"🎉 QR код успешно отсканирован!\n\n"
+                    f"Для завершения регистрации, пожалуйста, укажите ваше имя:"
+                )
                 return
             
-            # Обрабатываем первый найденный QR код
-            qr_data = decoded_objects[0].data.decode('utf-8')
-            
-            # Ищем код приглашения в QR данных
-            invite_code = None
-            
-            # Проверяем разные форматы:
-            # 1. https://t.me/bot?start=invite_CODE
-            import re
-            url_match = re.search(r'start=invite_([A-Z0-9]+)', qr_data, re.IGNORECASE)
-            if url_match:
-                invite_code = url_match.group(1).upper()
-            # 2. Просто код
-            elif re.match(r'^[A-Z0-9]{12}$', qr_data.strip(), re.IGNORECASE):
-                invite_code = qr_data.strip().upper()
-            
-            if invite_code:
-                # Проверяем, зарегистрирован ли пользователь
-                from bot.user_manager import is_user_registered, get_user_data
-                
-                if not is_user_registered(user_id):
-                    # Пользователь не зарегистрирован - запускаем процесс регистрации с кодом приглашения
-                    registration_states[user_id] = {
-                        'step': 'ask_first_name',
-                        'username': user.username,
-                        'invite_code': invite_code
-                    }
+            # Проверяем наличие имени и фамилии
+            user_data = get_user_data(user_id)
+            if not user_data.get('first_name') or not user_data.get('last_name'):
+                # У пользователя нет полных данных - запрашиваем с кодом приглашения
+                registration_states[user_id] = {
+                    'step': 'ask_first_name' if not user_data.get('first_name') else 'ask_last_name',
+                    'username': user.username,
+                    'first_name': user_data.get('first_name', ''),
+                    'invite_code': invite_code
+                }
+                if not user_data.get('first_name'):
                     await update.message.reply_text(
                         f"🎉 QR код успешно отсканирован!\n\n"
-                        f"Для завершения регистрации, пожалуйста, укажите ваше имя:"
+                        f"Пожалуйста, укажите ваше имя:"
                     )
-                    return
-                
-                # Проверяем наличие имени и фамилии
-                user_data = get_user_data(user_id)
-                if not user_data.get('first_name') or not user_data.get('last_name'):
-                    # У пользователя нет полных данных - запрашиваем с кодом приглашения
-                    registration_states[user_id] = {
-                        'step': 'ask_first_name' if not user_data.get('first_name') else 'ask_last_name',
-                        'username': user.username,
-                        'first_name': user_data.get('first_name', ''),
-                        'invite_code': invite_code
-                    }
-                    if not user_data.get('first_name'):
-                        await update.message.reply_text(
-                            f"🎉 QR код успешно отсканирован!\n\n"
-                            f"Пожалуйста, укажите ваше имя:"
-                        )
-                    else:
-                        await update.message.reply_text(
-                            f"🎉 QR код успешно отсканирован!\n\n"
-                            f"Пожалуйста, укажите вашу фамилию:"
-                        )
-                    return
-                
-                # Пользователь полностью зарегистрирован - используем приглашение для обновления роли
-                from bot.invite_manager import use_invite
-                result = use_invite(
-                    invite_code, 
-                    int(user_id), 
-                    user.username, 
-                    user_data.get('first_name'),
-                    user_data.get('last_name')
-                )
-                
-                if result["success"]:
+                else:
                     await update.message.reply_text(
                         f"🎉 QR код успешно отсканирован!\n\n"
-                        f"{result['message']}\n\n"
-                        f"Добро пожаловать в систему!"
+                        f"Пожалуйста, укажите вашу фамилию:"
                     )
-                    # Показываем главное меню
-                    user_states[user_id] = {
-                        'application': '',
-                        'dse': '',
-                        'problem_type': '',
-                        'description': '',
-                        'rc': '',
-                        'photo_file_id': None
-                    }
-                    await show_main_menu(update, user_id)
-                else:
-                    await update.message.reply_text(f" {result['error']}")
-            else:
+                return
+            
+            # Пользователь полностью зарегистрирован - используем приглашение для обновления роли
+            from bot.invite_manager import use_invite
+            result = use_invite(
+                invite_code, 
+                int(user_id), 
+                user.username, 
+                user_data.get('first_name'),
+                user_data.get('last_name')
+            )
+            
+            if result["success"]:
                 await update.message.reply_text(
-                    " QR код не содержит корректное приглашение.\n\n"
-                    f"Найденные данные: {qr_data[:100]}..."
+                    f"🎉 QR код успешно отсканирован!\n\n"
+                    f"{result['message']}\n\n"
+                    f"Добро пожаловать в систему!"
                 )
-        
-        finally:
-            # Удаляем временный файл
-            os.unlink(temp_path)
+                # Показываем главное меню
+                user_states[user_id] = {
+                    'application': '',
+                    'dse': '',
+                    'problem_type': '',
+                    'description': '',
+                    'rc': '',
+                    'photo_file_id': None
+                }
+                await show_main_menu(update, user_id)
+            else:
+                await update.message.reply_text(f" {result['error']}")
+        else:
+            await update.message.reply_text(
+                " QR код не содержит корректное приглашение.\n\n"
+                f"Найденные данные: {qr_data[:100]}..."
+            )
             
     except ImportError:
         await update.message.reply_text(
@@ -3207,19 +3582,19 @@ async def send_dse_to_subscribers(application, record: dict, creator_user_id: st
     print(f"🔔 send_dse_to_subscribers вызвана для ДСЕ: {record.get('dse')}")
     
     try:
-        from bot.subscription_manager import get_telegram_subscribers, get_email_subscribers
+        from bot.subscription_manager import get_matching_subscribers
         from bot.pdf_generator import create_dse_pdf_report
         from bot.user_manager import get_user_data
-        import tempfile
         import os
         
         if not application:
             print(" Application не передан в send_dse_to_subscribers")
             return
         
-        # Получаем подписчиков
-        telegram_subs = get_telegram_subscribers()
-        email_subs = get_email_subscribers()
+        # Получаем подписчиков, чьи фильтры подходят под заявку
+        recipients = get_matching_subscribers(record)
+        telegram_subs = recipients['telegram']
+        email_subs = recipients['email']
         
         if not telegram_subs and not email_subs:
             print("ℹ️ Нет активных подписчиков для рассылки")
@@ -3228,8 +3603,7 @@ async def send_dse_to_subscribers(application, record: dict, creator_user_id: st
         print(f"📧 Найдено подписчиков - Telegram: {len(telegram_subs)}, Email: {len(email_subs)}")
         
         # Создаём PDF отчёт
-        import tempfile
-        pdf_filename = create_dse_pdf_report(record)
+        pdf_filename = await asyncio.to_thread(create_dse_pdf_report, record)
         
         if not pdf_filename:
             print(" Ошибка создания PDF для подписчиков")
@@ -3254,8 +3628,9 @@ async def send_dse_to_subscribers(application, record: dict, creator_user_id: st
         else:
             creator_name = f"ID: {creator_user_id}"
         
-        # Формируем текст уведомления (без Markdown, чтобы избежать ошибок парсинга)
-        notification_text = (
+        # Формируем текст уведомления (без Markdown, чтобы избежать ошибок парсинга).
+        # В сводку попадает текст без упоминания PDF — общий PDF прикладывается к сводке отдельно
+        digest_text = (
             f"🆕 Новая заявка!\n\n"
             f"ДСЕ: {record.get('dse', 'N/A')}\n"
             f"Тип: {record.get('problem_type', 'N/A')}\n"
@@ -3264,18 +3639,26 @@ async def send_dse_to_subscribers(application, record: dict, creator_user_id: st
             f"Наладчик: {record.get('installer_fio', 'N/A')}\n"
             f"Программист: {record.get('programmer_name', 'N/A')}\n"
             f"Создатель: {creator_name}\n"
-            f"Дата: {record.get('datetime', 'N/A')}\n\n"
-            f"📄 PDF отчёт прикреплён к сообщению"
+            f"Дата: {record.get('datetime', 'N/A')}"
         )
+        notification_text = f"{digest_text}\n\n📄 PDF отчёт прикреплён к сообщению"
         
         # Отправка в Telegram
         if telegram_subs:
             print(f"📱 Отправка в Telegram {len(telegram_subs)} подписчикам...")
+            from bot.digest_manager import queue_notifications
+            # Подписчики в режиме сводки получат заявку в общем сообщении/PDF
+            # (все получатели ставятся в буфер за одно чтение/запись файла сводок)
+            queued = queue_notifications((sub_user_id, digest_text, [record]) for sub_user_id in telegram_subs)
             for sub_user_id in telegram_subs:
                 # Временно отключена проверка на создателя для тестирования
                 # if sub_user_id == creator_user_id:
                 #     print(f"⏭️ Пропускаем создателя заявки: {sub_user_id}")
                 #     continue
+
+                if str(sub_user_id) in queued:
+                    print(f"📬 Заявка добавлена в сводку подписчика {sub_user_id}")
+                    continue
                 
                 print(f"📤 Отправка подписчику {sub_user_id}...")
                 try:
@@ -3286,6 +3669,7 @@ async def send_dse_to_subscribers(application, record: dict, creator_user_id: st
                     
                     # Отправляем PDF как документ (без parse_mode чтобы избежать ошибок)
                     await application.bot.send_document(
+                        rate_limit_args=PRIORITY_BULK,
                         chat_id=int(sub_user_id),
                         document=open(tmp_path, 'rb'),
                         filename=f"DSE_{record.get('dse', 'report')}.pdf",
@@ -3409,12 +3793,21 @@ async def show_subscription_menu(update: Update, context: ContextTypes.DEFAULT_T
         if subscription.get('email'):
             status_text += f"📧 Email: {subscription['email']}\n"
         
+        filters = subscription.get('filters') or {}
+        if filters:
+            from bot.subscription_manager import FILTER_FIELDS
+            status_text += "🎯 Фильтры:\n"
+            for field, values in filters.items():
+                status_text += f"   {FILTER_FIELDS.get(field, field)}: {', '.join(values)}\n"
+        
         status_text += (
             f"\n💡 При создании новой заявки другим пользователем вы автоматически получите PDF отчёт.\n"
         )
         
         keyboard = [
+            [InlineKeyboardButton("🎯 Фильтры", callback_data='subscription_filters')],
             [InlineKeyboardButton("🔕 Отключить подписку", callback_data='subscription_toggle')],
+            [InlineKeyboardButton("⏰ Режим уведомлений", callback_data='digest_menu')],
             [InlineKeyboardButton("🗑️ Удалить подписку", callback_data='subscription_remove')],
             [InlineKeyboardButton("⬅️ Главное меню", callback_data='back_to_main')]
         ]
@@ -3577,3 +3970,72 @@ async def show_subscription_status(update: Update, context: ContextTypes.DEFAULT
     await update.callback_query.answer(text)
 
 
+async def show_subscription_filters_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Показать фильтры подписки (РЦ, тип проблемы, префикс ДСЕ, станок)"""
+    user_id = str(update.callback_query.from_user.id)
+
+    from bot.subscription_manager import FILTER_FIELDS, get_subscription_filters
+
+    filters = get_subscription_filters(user_id)
+
+    text = "🎯 Фильтры подписки\n\nВы будете получать только заявки, подходящие под все заданные условия.\n\n"
+    for field, title in FILTER_FIELDS.items():
+        values = filters.get(field)
+        text += f"{title}: {', '.join(values) if values else 'любой'}\n"
+
+    keyboard = [
+        [InlineKeyboardButton("🏭 РЦ", callback_data='sub_filter_field_rc'),
+         InlineKeyboardButton("⚠️ Тип проблемы", callback_data='sub_filter_field_problem_type')],
+        [InlineKeyboardButton("🔢 Префикс ДСЕ", callback_data='sub_filter_input_dse_prefix'),
+         InlineKeyboardButton("⚙️ Номер станка", callback_data='sub_filter_input_machine_number')],
+        [InlineKeyboardButton("♻️ Сбросить фильтры", callback_data='sub_filter_reset')],
+        [InlineKeyboardButton("⬅️ Назад", callback_data='subscription_menu')]
+    ]
+    await update.callback_query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+
+
+async def show_subscription_filter_options(update: Update, context: ContextTypes.DEFAULT_TYPE, field: str) -> None:
+    """Показать варианты фильтра (РЦ или тип проблемы) с отметками выбранных"""
+    user_id = str(update.callback_query.from_user.id)
+
+    from bot.subscription_manager import FILTER_FIELDS, get_subscription_filters
+
+    selected = get_subscription_filters(user_id).get(field, [])
+    options = RC_TYPES if field == 'rc' else PROBLEM_TYPES
+
+    keyboard = []
+    for i, option in enumerate(options):
+        mark = "☑️" if option in selected else "⬜"
+        keyboard.append([InlineKeyboardButton(f"{mark} {option}", callback_data=f'sub_filter_toggle_{field}_{i}')])
+    keyboard.append([InlineKeyboardButton("⬅️ Назад", callback_data='subscription_filters')])
+
+    await update.callback_query.edit_message_text(
+        f"{FILTER_FIELDS[field]}: отметьте нужные значения (ничего не выбрано — любые)",
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+
+async def show_digest_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Показать настройки режима уведомлений (сразу / сводка раз в час / раз в день)"""
+    user_id = str(update.callback_query.from_user.id)
+
+    from bot.digest_manager import DIGEST_MODES, get_digest_preferences
+
+    prefs = get_digest_preferences(user_id)
+
+    keyboard = []
+    for mode, title in DIGEST_MODES.items():
+        mark = "✅ " if prefs['mode'] == mode else ""
+        keyboard.append([InlineKeyboardButton(f"{mark}{title}", callback_data=f'digest_mode_{mode}')])
+
+    pdf_text = "📄 Общий PDF к сводке: вкл" if prefs['pdf'] else "📄 Общий PDF к сводке: выкл"
+    keyboard.append([InlineKeyboardButton(pdf_text, callback_data='digest_toggle_pdf')])
+    keyboard.append([InlineKeyboardButton("⬅️ Главное меню", callback_data='back_to_main')])
+
+    text = (
+        "⏰ Режим уведомлений\n\n"
+        "Уведомления об отслеживаемых ДСЕ и новых заявках по подписке можно получать "
+        "сразу или одним сводным сообщением раз в час / раз в день.\n\n"
+        f"Текущий режим: {DIGEST_MODES.get(prefs['mode'], prefs['mode'])}"
+    )
+    await update.callback_query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
@@ -180,27 +180,12 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             last_name = creator_data.get('last_name', '')
             creator_fio = f"{first_name} {last_name}".strip()
         
-        # Скачиваем фото локально для веб-доступа
-        photo_path = None
+        # Сохраняем фото локально для веб-доступа (повторно не скачивается)
+        from bot.photo_store import ingest_telegram_photo
         photo_file_id = user_data.get('photo_file_id')
-        if photo_file_id:
-            try:
-                import uuid
-                from config.config import PHOTOS_DIR
-                # Скачиваем файл
-                file = await context.bot.get_file(photo_file_id)
-                
-                # Создаём имя файла
-                dse_safe = user_data['dse'].replace('/', '_').replace('\\', '_')
-                photo_filename = f"{user_id}_{dse_safe}_{uuid.uuid4().hex[:8]}.jpg"
-                photo_path = os.path.join(PHOTOS_DIR, photo_filename)
-                
-                # Скачиваем
-                await file.download_to_drive(photo_path)
-                print(f"✅ Photo downloaded to {photo_path}")
-            except Exception as e:
-                print(f"❌ Failed to download photo: {e}")
-                photo_path = None
+        stored_photo = await ingest_telegram_photo(context.bot, photo_file_id) if photo_file_id else None
+        photo_path = stored_photo['path'] if stored_photo else None
+        photo_hash = stored_photo['hash'] if stored_photo else None
         
         record = {
             'dse': user_data['dse'],
@@ -214,7 +199,8 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             'datetime': dt.now().strftime('%Y-%m-%d %H:%M:%S'),
             'user_id': user_id,
             'photo_file_id': photo_file_id,
-            'photo_path': photo_path
+            'photo_path': photo_path,
+            'photo_hash': photo_hash
         }
         
         request_id = add_pending_dse_request(record, user_id)
@@ -704,6 +690,26 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                     )
                 return
             
+            # === ФИЛЬТРЫ ПОДПИСКИ (префикс ДСЕ / номер станка) ===
+            elif user_data.get('waiting_for') in ('subscription_filter_dse_prefix', 'subscription_filter_machine_number'):
+                from bot.subscription_manager import get_subscription_filters, set_subscription_filters
+                field = user_data['waiting_for'].replace('subscription_filter_', '', 1)
+                values = [] if text == '-' else [v.strip() for v in text.split(',') if v.strip()]
+                filters = get_subscription_filters(user_id)
+                filters[field] = values
+                if set_subscription_filters(user_id, filters):
+                    user_states[user_id].pop('waiting_for', None)
+                    await update.message.reply_text(
+                        f"✅ Фильтр обновлён: {', '.join(values) if values else 'без ограничения'}",
+                        reply_markup=InlineKeyboardMarkup([
+                            [InlineKeyboardButton("🎯 К фильтрам", callback_data='subscription_filters')]
+                        ])
+                    )
+                else:
+                    user_states[user_id].pop('waiting_for', None)
+                    await update.message.reply_text("❌ Сначала оформите подписку.")
+                return
+            
             # === ПОИСК ДСЕ ===
             elif user_id in dse_view_states:
                 dse_state = dse_view_states[user_id]
@@ -721,13 +727,35 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             
             # === ОТСЛЕЖИВАНИЕ ДСЕ ===
             elif user_data.get('watch_dse_state') == 'awaiting_manual_input':
-                from .dse_watcher import add_watched_dse
+                from .dse_watcher import add_watched_dse, validate_watch_pattern
                 dse_value = text.strip().upper()
+                error = validate_watch_pattern(dse_value)
+                if error:
+                    await update.message.reply_text(f"❌ {error}\n\nПример: АБВГ.301.*")
+                    return
                 add_watched_dse(user_id, dse_value)
                 user_states[user_id].pop('watch_dse_state', None)
                 await update.message.reply_text(f"✅ ДСЕ {dse_value} добавлен в отслеживание!")
                 await show_watched_dse_menu(update, context)
                 return
+
+            elif user_data.get('watch_dse_state') == 'awaiting_pattern_input':
+                from .dse_watcher import add_watched_dse, is_watch_pattern, validate_watch_pattern
+                pattern = text.strip().upper()
+                if not is_watch_pattern(pattern):
+                    await update.message.reply_text(
+                        "❌ Шаблон должен содержать * или ?.\n\nПример: АБВГ.301.*"
+                    )
+                    return
+                error = validate_watch_pattern(pattern)
+                if error:
+                    await update.message.reply_text(f"❌ {error}\n\nПример: АБВГ.301.*")
+                    return
+                add_watched_dse(user_id, pattern)
+                user_states[user_id].pop('watch_dse_state', None)
+                await update.message.reply_text(f"✅ Шаблон {pattern} добавлен в отслеживание!")
+                await show_watched_dse_menu(update, context)
+                return
             
             # === ЧАТ ПО ДСЕ ===
             elif user_data.get('dse_chat_state') == 'awaiting_manual_input':
@@ -0,0 +1,332 @@
+"""
+Менеджер сводок уведомлений
+Пользователь выбирает режим: сразу / раз в час / раз в день. В режимах сводки
+уведомления наблюдателя ДСЕ и подписок копятся в буфере и отправляются одним
+сообщением (и, по желанию, одним общим PDF) по окончании окна.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# Добавляем корневую директорию проекта в sys.path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from config.config import DATA_DIR, load_data, save_data
+from telegram.error import Forbidden
+
+from bot.send_scheduler import PRIORITY_NOTIFICATION, PRIORITY_BULK
+
+# Файл настроек и буфера сводок
+DIGEST_FILE = str(DATA_DIR / "notification_digest.json")
+
+# Режимы доставки уведомлений
+DIGEST_MODES = {
+    'immediate': 'Сразу',
+    'hourly': 'Раз в час',
+    'daily': 'Раз в день',
+}
+
+# Час отправки ежедневной сводки (локальное время сервера)
+DIGEST_DAILY_HOUR = 8
+
+# Интервал проверки буфера фоновой задачей (секунды)
+DIGEST_CHECK_INTERVAL_SECONDS = 60
+
+# Ограничение длины сообщения Telegram
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+# Повторная отправка сводки после ошибки: число попыток и пауза (умножается на номер попытки)
+DIGEST_MAX_SEND_ATTEMPTS = 5
+DIGEST_RETRY_DELAY_SECONDS = 300
+
+_lock = threading.Lock()
+
+
+def load_digest_data() -> Dict:
+    """
+    Загрузить настройки и буфер сводок
+
+    Returns:
+        dict: {"preferences": {user_id: {...}}, "pending": {user_id: {...}}}
+    """
+    data = load_data(DIGEST_FILE)
+    if not isinstance(data, dict):
+        data = {}
+    data.setdefault('preferences', {})
+    data.setdefault('pending', {})
+    return data
+
+
+def save_digest_data(data: Dict) -> None:
+    """Сохранить настройки и буфер сводок"""
+    save_data(data, DIGEST_FILE)
+
+
+def get_digest_preferences(user_id: str) -> Dict:
+    """
+    Получить настройки сводки пользователя
+
+    Returns:
+        dict: {"mode": 'immediate'|'hourly'|'daily', "pdf": bool}
+    """
+    prefs = load_digest_data()['preferences'].get(str(user_id), {})
+    return {
+        'mode': prefs.get('mode', 'immediate'),
+        'pdf': bool(prefs.get('pdf', False)),
+    }
+
+
+def set_digest_mode(user_id: str, mode: str) -> bool:
+    """
+    Установить режим доставки уведомлений
+
+    Args:
+        user_id: ID пользователя
+        mode: Один из DIGEST_MODES
+
+    Returns:
+        bool: True если успешно
+    """
+    if mode not in DIGEST_MODES:
+        return False
+
+    user_id = str(user_id)
+    with _lock:
+        data = load_digest_data()
+        prefs = data['preferences'].setdefault(user_id, {})
+        prefs['mode'] = mode
+        # При переходе в режим "сразу" накопленное отправится ближайшей проверкой
+        if mode == 'immediate' and user_id in data['pending']:
+            data['pending'][user_id]['due_at'] = datetime.now().isoformat()
+        save_digest_data(data)
+    return True
+
+
+def toggle_digest_pdf(user_id: str) -> bool:
+    """
+    Переключить прикрепление общего PDF к сводке
+
+    Returns:
+        bool: Новое значение
+    """
+    user_id = str(user_id)
+    with _lock:
+        data = load_digest_data()
+        prefs = data['preferences'].setdefault(user_id, {})
+        prefs['pdf'] = not prefs.get('pdf', False)
+        save_digest_data(data)
+        return prefs['pdf']
+
+
+def _window_end(mode: str, now: datetime) -> datetime:
+    """Конец окна сводки, в которое попадает момент now"""
+    if mode == 'hourly':
+        return now.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+    due = now.replace(hour=DIGEST_DAILY_HOUR, minute=0, second=0, microsecond=0)
+    if due <= now:
+        due += timedelta(days=1)
+    return due
+
+
+def queue_notification(user_id: str, text: str, records: Optional[List[Dict]] = None) -> bool:
+    """
+    Поместить уведомление в буфер сводки, если пользователь выбрал сводку.
+
+    Args:
+        user_id: ID получателя
+        text: Текст уведомления
+        records: Записи ДСЕ для общего PDF, необязательно
+
+    Returns:
+        bool: True если уведомление отложено, False если его нужно отправить сразу
+    """
+    return str(user_id) in queue_notifications([(user_id, text, records)])
+
+
+def queue_notifications(entries: Iterable[Tuple[str, str, Optional[List[Dict]]]]) -> Set[str]:
+    """
+    Поместить в буфер сводки уведомления сразу для нескольких получателей
+    (одно чтение и одна запись файла на всю рассылку).
+
+    Args:
+        entries: Пары уведомлений (user_id, текст, записи ДСЕ или None)
+
+    Returns:
+        set: ID получателей в режиме сводки — им уведомление отложено,
+             остальным его нужно отправить сразу
+    """
+    queued = set()
+    with _lock:
+        data = load_digest_data()
+        now = datetime.now()
+        for user_id, text, records in entries:
+            user_id = str(user_id)
+            mode = data['preferences'].get(user_id, {}).get('mode', 'immediate')
+            if mode not in ('hourly', 'daily'):
+                continue
+
+            bucket = data['pending'].setdefault(user_id, {
+                'due_at': _window_end(mode, now).isoformat(),
+                'items': []
+            })
+            bucket['items'].append({
+                'text': text,
+                'records': records or [],
+                'created_at': now.isoformat()
+            })
+            queued.add(user_id)
+        if queued:
+            save_digest_data(data)
+    return queued
+
+
+def pop_due_digests(now: Optional[datetime] = None) -> Dict[str, Dict]:
+    """
+    Извлечь из буфера все сводки, окно которых завершилось
+    (если отправка не удалась — вернуть их через requeue_digest)
+
+    Returns:
+        dict: {user_id: {'items': [...], 'attempts': неудачных попыток отправки}}
+    """
+    now = now or datetime.now()
+    due = {}
+    with _lock:
+        data = load_digest_data()
+        for user_id, bucket in list(data['pending'].items()):
+            try:
+                due_at = datetime.fromisoformat(bucket.get('due_at', ''))
+            except ValueError:
+                due_at = now
+            if due_at <= now:
+                due[user_id] = {'items': bucket.get('items', []), 'attempts': bucket.get('attempts', 0)}
+                del data['pending'][user_id]
+        if due:
+            save_digest_data(data)
+    return due
+
+
+def requeue_digest(user_id: str, items: List[Dict], attempts: int) -> bool:
+    """
+    Вернуть неотправленную сводку в буфер (перед уведомлениями, накопленными за время отправки)
+
+    Args:
+        attempts: Число неудачных попыток с учётом текущей
+
+    Returns:
+        bool: False, если попытки исчерпаны и сводка отброшена
+    """
+    user_id = str(user_id)
+    if attempts >= DIGEST_MAX_SEND_ATTEMPTS:
+        return False
+    due_at = datetime.now() + timedelta(seconds=DIGEST_RETRY_DELAY_SECONDS * attempts)
+    with _lock:
+        data = load_digest_data()
+        bucket = data['pending'].get(user_id)
+        if bucket is None:
+            data['pending'][user_id] = {'due_at': due_at.isoformat(), 'items': list(items),
+                                        'attempts': attempts}
+        else:
+            bucket['items'] = list(items) + bucket.get('items', [])
+            bucket['attempts'] = attempts
+            try:
+                if datetime.fromisoformat(bucket.get('due_at', '')) > due_at:
+                    bucket['due_at'] = due_at.isoformat()
+            except ValueError:
+                bucket['due_at'] = due_at.isoformat()
+        save_digest_data(data)
+    return True
+
+
+def format_digest_message(items: List[Dict]) -> str:
+    """Собрать одно сообщение из накопленных уведомлений"""
+    header = f"📬 Сводка уведомлений ({len(items)})\n\n"
+    separator = "\n\n———\n\n"
+    parts = []
+    length = len(header)
+    for i, item in enumerate(items):
+        text = item.get('text', '')
+        if length + len(text) + len(separator) > TELEGRAM_MESSAGE_LIMIT - 50:
+            parts.append(f"…и ещё {len(items) - i}")
+            break
+        parts.append(text)
+        length += len(text) + len(separator)
+    return header + separator.join(parts)
+
+
+async def _send_digest(bot, user_id: str, items: List[Dict]) -> None:
+    """Отправить одну сводку пользователю"""
+    await bot.send_message(chat_id=int(user_id), text=format_digest_message(items),
+                           rate_limit_args=PRIORITY_NOTIFICATION)
+
+    if not get_digest_preferences(user_id)['pdf']:
+        return
+    records = [record for item in items for record in item.get('records', [])]
+    if not records:
+        return
+
+    # Текст сводки уже доставлен: ошибка PDF не должна приводить к повторной отправке сводки
+    from bot.pdf_generator import create_multi_dse_pdf_report
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
+        tmp_path = tmp_file.name
+    try:
+        created = await asyncio.to_thread(create_multi_dse_pdf_report, records, tmp_path)
+        if created:
+            with open(tmp_path, 'rb') as pdf_file:
+                await bot.send_document(
+                    rate_limit_args=PRIORITY_BULK,
+                    chat_id=int(user_id),
+                    document=pdf_file,
+                    filename=f"digest_{datetime.now().strftime('%Y%m%d_%H%M')}.pdf",
+                    caption=f"📄 Сводный отчёт: {len(records)} заявок"
+                )
+    except Exception as e:
+        print(f"❌ Ошибка отправки PDF сводки пользователю {user_id}: {e}")
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+
+async def flush_due_digests(application) -> int:
+    """
+    Отправить все сводки с завершившимся окном
+
+    Returns:
+        int: Количество отправленных сводок
+    """
+    due = await asyncio.to_thread(pop_due_digests)
+    sent = 0
+    for user_id, bucket in due.items():
+        items = bucket['items']
+        if not items:
+            continue
+        try:
+            await _send_digest(application.bot, user_id, items)
+            sent += 1
+            print(f"📬 Сводка ({len(items)} уведомл.) отправлена пользователю {user_id}")
+        except Exception as e:
+            # Пользователь заблокировал бота — повторять бессмысленно
+            attempts = DIGEST_MAX_SEND_ATTEMPTS if isinstance(e, Forbidden) else bucket['attempts'] + 1
+            if await asyncio.to_thread(requeue_digest, user_id, items, attempts):
+                print(f"⚠️ Ошибка отправки сводки пользователю {user_id} (попытка {attempts}), "
+                      f"повтор позже: {e}")
+            else:
+                print(f"❌ Сводка пользователю {user_id} отброшена ({len(items)} уведомл.): {e}")
+    return sent
+
+
+async def start_digest_job(application):
+    """Периодически отправляет накопленные сводки."""
+    print("📬 Задача сводок уведомлений запущена.")
+    while True:
+        try:
+            await flush_due_digests(application)
+        except asyncio.CancelledError:
+            print("⏹️ Задача сводок уведомлений остановлена.")
+            break
+        except Exception as e:
+            print(f"❌ Ошибка в задаче сводок уведомлений: {e}")
+        await asyncio.sleep(DIGEST_CHECK_INTERVAL_SECONDS)
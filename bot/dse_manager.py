@@ -1,6 +1,7 @@
 import sys
 import os
 import asyncio
+import heapq
 import threading
 
 # Добавляем корневую директорию проекта в sys.path
@@ -8,12 +9,15 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')
 
 from datetime import datetime, timedelta
 
-from config.config import DATA_FILE, load_data, save_data
+from config.config import DATA_FILE, load_data, save_data, next_sequence
+from config.settings import get_web_base_url
+from bot.photo_store import add_reference, release_reference
 
 
 PENDING_DSE_REQUESTS_KEY = 'pending_dse_requests'
 ARCHIVED_DSE_REQUESTS_KEY = 'archived_dse_requests'
 ARCHIVE_RETENTION_DAYS = 30
+PENDING_DSE_REQUEST_SEQUENCE = 'pending_dse_request'
 
 
 def _normalize_text(value: str) -> str:
@@ -25,52 +29,9 @@ def _ensure_dict(value):
 
 
 def _get_dse_receivers() -> list:
-    from bot.user_manager import get_users_data
-    from bot.permissions_manager import has_permission
+    from bot.permissions_manager import get_users_with_permission
 
-    users_data = get_users_data()
-    receivers = []
-    for user_id in users_data.keys():
-        try:
-            if has_permission(user_id, 'dse_receiver'):
-                receivers.append(str(user_id))
-        except Exception:
-            continue
-    return receivers
-
-
-def _get_web_base_url() -> str:
-    domain = None
-    port = int(os.getenv('WEB_PORT', '5000'))
-    ssl_enabled = False
-
-    config_file = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'config', 'domain.conf')
-    if os.path.exists(config_file):
-        try:
-            with open(config_file, 'r', encoding='utf-8') as f:
-                for line in f:
-                    line = line.strip()
-                    if not line or line.startswith('#') or '=' not in line:
-                        continue
-                    key, value = line.split('=', 1)
-                    key = key.strip()
-                    value = value.strip()
-                    if key == 'DOMAIN':
-                        domain = value if value and value != 'localhost' else None
-                    elif key == 'WEB_PORT':
-                        port = int(value)
-                    elif key == 'SSL_ENABLED':
-                        ssl_enabled = value.lower() in {'true', '1', 'yes'}
-        except Exception:
-            pass
-
-    scheme = 'https' if ssl_enabled else 'http'
-    if not domain:
-        return f"{scheme}://localhost:{port}"
-
-    if (scheme == 'http' and port == 80) or (scheme == 'https' and port == 443):
-        return f"{scheme}://{domain}"
-    return f"{scheme}://{domain}:{port}"
+    return sorted(get_users_with_permission('dse_receiver'))
 
 
 def _notify_dse_receivers_new_request(record: dict, request_id: int) -> None:
@@ -78,7 +39,7 @@ def _notify_dse_receivers_new_request(record: dict, request_id: int) -> None:
     if not receivers:
         return
 
-    base_url = _get_web_base_url()
+    base_url = get_web_base_url()
     link = f"{base_url}/dse/pending?request_id={request_id}"
 
     text = (
@@ -94,32 +55,8 @@ def _notify_dse_receivers_new_request(record: dict, request_id: int) -> None:
         f"Ссылка: {link}"
     )
 
-    def _runner():
-        async def _send():
-            from telegram.ext import Application
-            from config.config import BOT_TOKEN
-
-            application = Application.builder().token(BOT_TOKEN).build()
-            await application.initialize()
-            await application.bot.initialize()
-            try:
-                for user_id in receivers:
-                    try:
-                        await application.bot.send_message(chat_id=int(user_id), text=text)
-                    except Exception:
-                        continue
-            finally:
-                await application.bot.shutdown()
-                await application.shutdown()
-
-        try:
-            asyncio.run(_send())
-        except RuntimeError:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            loop.run_until_complete(_send())
-
-    threading.Thread(target=_runner, daemon=True).start()
+    from bot.notification_client import notify_many
+    notify_many(receivers, text)
 
 
 def _ensure_list(value):
@@ -147,6 +84,7 @@ def _make_record_ref(record: dict, user_id: str, index: int) -> dict:
         'description': record.get('description', ''),
         'photo_file_id': record.get('photo_file_id'),
         'photo_path': record.get('photo_path'),
+        'photo_hash': record.get('photo_hash'),
         'photos': record.get('photos')
     }
 
@@ -176,24 +114,133 @@ def _parse_datetime(value: str):
     return None
 
 
-def _cleanup_archived_requests(data):
+# === ХРАНЕНИЕ АРХИВА: ФОНОВАЯ ОЧИСТКА ===
+# Куча (expires_at, request_id) в памяти: чтение заявок ничего не удаляет,
+# просроченные архивные заявки удаляет фоновая задача пакетами.
+ARCHIVE_SWEEP_INTERVAL_SECONDS = 3600
+ARCHIVE_SWEEP_BATCH_SIZE = 200
+
+_archive_expiry_heap = []
+_archive_heap_loaded = False
+_archive_lock = threading.Lock()
+
+
+def _archive_expires_at(record: dict):
+    """Момент истечения срока хранения архивной заявки (timestamp) или None"""
+    timestamp = record.get('archived_at') or record.get('created_at') or record.get('datetime')
+    parsed = _parse_datetime(timestamp)
+    if not parsed:
+        return None
+    return (parsed + timedelta(days=ARCHIVE_RETENTION_DAYS)).timestamp()
+
+
+def _schedule_archive_expiry(req_key: str, record: dict) -> None:
+    """Поставить архивную заявку в очередь на удаление по сроку хранения"""
+    expires_at = _archive_expires_at(record)
+    if expires_at is None:
+        return
+    with _archive_lock:
+        if _archive_heap_loaded:
+            heapq.heappush(_archive_expiry_heap, (expires_at, str(req_key)))
+
+
+def _ensure_archive_heap_loaded() -> None:
+    """Однократно построить кучу сроков хранения из файла"""
+    global _archive_heap_loaded
+    with _archive_lock:
+        if _archive_heap_loaded:
+            return
+        data = load_data(DATA_FILE)
+        archived = _ensure_dict(data.get(ARCHIVED_DSE_REQUESTS_KEY)) if isinstance(data, dict) else {}
+        heap = []
+        for req_id, record in archived.items():
+            expires_at = _archive_expires_at(record)
+            if expires_at is not None:
+                heap.append((expires_at, str(req_id)))
+        heapq.heapify(heap)
+        _archive_expiry_heap[:] = heap
+        _archive_heap_loaded = True
+
+
+def sweep_archived_requests(batch_size: int = ARCHIVE_SWEEP_BATCH_SIZE) -> int:
+    """
+    Удалить из архива заявки с истёкшим сроком хранения (не более batch_size).
+    Файл читается и сохраняется только если есть что удалять.
+
+    Returns:
+        int: Количество удалённых заявок
+    """
+    _ensure_archive_heap_loaded()
+
+    now = datetime.now().timestamp()
+    due = []
+    with _archive_lock:
+        while _archive_expiry_heap and _archive_expiry_heap[0][0] <= now and len(due) < batch_size:
+            due.append(heapq.heappop(_archive_expiry_heap)[1])
+    if not due:
+        return 0
+
+    data = load_data(DATA_FILE)
+    if not isinstance(data, dict):
+        return 0
     archived = _ensure_dict(data.get(ARCHIVED_DSE_REQUESTS_KEY))
-    if not archived:
-        return False, archived
-    now = datetime.now()
-    cleaned = {}
-    for req_id, record in archived.items():
-        timestamp = record.get('archived_at') or record.get('created_at') or record.get('datetime')
-        parsed = _parse_datetime(timestamp)
-        if not parsed:
-            cleaned[req_id] = record
+
+    removed = []
+    for req_key in due:
+        record = archived.get(req_key)
+        if record is None:
+            continue
+        # Запись могла быть перезаписана после постановки в очередь
+        expires_at = _archive_expires_at(record)
+        if expires_at is not None and expires_at > now:
+            _schedule_archive_expiry(req_key, record)
             continue
-        if now - parsed <= timedelta(days=ARCHIVE_RETENTION_DAYS):
-            cleaned[req_id] = record
-    changed = cleaned != archived
-    if changed:
-        data[ARCHIVED_DSE_REQUESTS_KEY] = cleaned
-    return changed, cleaned
+        del archived[req_key]
+        removed.append((req_key, record))
+
+    if removed:
+        data[ARCHIVED_DSE_REQUESTS_KEY] = archived
+        try:
+            save_data(data, DATA_FILE)
+        except Exception:
+            # Заявки остались в файле — вернём их в очередь, ссылки на фото не трогаем
+            for req_key, record in removed:
+                _schedule_archive_expiry(req_key, record)
+            raise
+        # Ссылки на фото освобождаются только после того, как удаление сохранено
+        for _req_key, record in removed:
+            release_reference(record.get('photo_hash'))
+    return len(removed)
+
+
+async def start_archive_sweeper_job(application):
+    """Периодически удаляет просроченные архивные заявки пакетами."""
+    print("🧹 Задача очистки архива заявок запущена.")
+    while True:
+        try:
+            # Удаляем пакетами, пока есть просроченные, уступая цикл событий между пакетами
+            while True:
+                # Выполняется в цикле событий, как и обработчики, меняющие bot_data.json:
+                # чтение-изменение-запись файла не пересекается с ними
+                removed = sweep_archived_requests()
+                if removed:
+                    print(f"🧹 Удалено архивных заявок: {removed}")
+                if removed < ARCHIVE_SWEEP_BATCH_SIZE:
+                    break
+                await asyncio.sleep(0)
+        except asyncio.CancelledError:
+            print("⏹️ Задача очистки архива заявок остановлена.")
+            break
+        except Exception as e:
+            print(f"❌ Ошибка очистки архива заявок: {e}")
+        await asyncio.sleep(ARCHIVE_SWEEP_INTERVAL_SECONDS)
+
+
+def _max_request_id(data) -> int:
+    """Максимальный ID среди ожидающих и архивных заявок (для инициализации счётчика)"""
+    keys = list(_ensure_dict(data.get(PENDING_DSE_REQUESTS_KEY)).keys())
+    keys += list(_ensure_dict(data.get(ARCHIVED_DSE_REQUESTS_KEY)).keys())
+    return max([int(k) for k in keys if str(k).isdigit()] or [0])
 
 
 def add_pending_dse_request(record: dict, user_id: str) -> int:
@@ -203,7 +250,7 @@ def add_pending_dse_request(record: dict, user_id: str) -> int:
         data = {}
 
     pending = _ensure_dict(data.get(PENDING_DSE_REQUESTS_KEY))
-    next_id = max([int(k) for k in pending.keys() if str(k).isdigit()] or [0]) + 1
+    next_id = next_sequence(PENDING_DSE_REQUEST_SEQUENCE, seed=lambda: _max_request_id(data))
 
     record_copy = record.copy()
     record_copy['user_id'] = str(user_id)
@@ -213,6 +260,8 @@ def add_pending_dse_request(record: dict, user_id: str) -> int:
     pending[str(next_id)] = record_copy
     data[PENDING_DSE_REQUESTS_KEY] = pending
     save_data(data, DATA_FILE)
+    # Заявка переходит между разделами (ожидающие -> записи / архив), ссылка на фото остаётся одна
+    add_reference(record_copy.get('photo_hash'))
 
     _notify_dse_receivers_new_request(record_copy, next_id)
 
@@ -225,10 +274,6 @@ def get_pending_dse_requests():
     if not isinstance(data, dict):
         return []
 
-    changed, _ = _cleanup_archived_requests(data)
-    if changed:
-        save_data(data, DATA_FILE)
-
     pending = _ensure_dict(data.get(PENDING_DSE_REQUESTS_KEY))
     requests = []
     for req_id, record in pending.items():
@@ -240,17 +285,20 @@ def get_pending_dse_requests():
     return requests
 
 
-def approve_pending_dse_request(request_id: int, approver_id: str = None):
-    """Утвердить заявку ДСЕ и перенести в основную базу"""
-    data = load_data(DATA_FILE)
-    if not isinstance(data, dict):
-        return None
+def _build_dse_link_index(data) -> dict:
+    """Индекс (ДСЕ, наименование) -> [(user_id, index)] по всем утверждённым записям"""
+    index = {}
+    for existing_user_id, user_records in data.items():
+        if not isinstance(user_records, list):
+            continue
+        for idx, existing_record in enumerate(user_records):
+            key = (_normalize_text(existing_record.get('dse')), _normalize_text(existing_record.get('dse_name')))
+            index.setdefault(key, []).append((existing_user_id, idx))
+    return index
 
-    pending = _ensure_dict(data.get(PENDING_DSE_REQUESTS_KEY))
-    req_key = str(request_id)
-    if req_key not in pending:
-        return None
 
+def _approve_loaded_request(data: dict, pending: dict, req_key: str, approver_id, link_index: dict):
+    """Утвердить одну заявку в уже загруженных данных (без сохранения)"""
     record = pending.pop(req_key)
     user_id = str(record.get('user_id', ''))
     if user_id not in data or not isinstance(data.get(user_id), list):
@@ -276,50 +324,30 @@ def approve_pending_dse_request(request_id: int, approver_id: str = None):
     # Создаем взаимные ссылки с существующими записями с тем же ДСЕ и именем ДСЕ
     target_dse = _normalize_text(record_copy.get('dse'))
     target_name = _normalize_text(record_copy.get('dse_name'))
+    key = (target_dse, target_name)
     if target_dse or target_name:
         new_ref = _make_record_ref(record_copy, user_id, new_index)
-        for existing_user_id, user_records in data.items():
-            if not isinstance(user_records, list):
-                continue
-            for idx, existing_record in enumerate(user_records):
-                if _normalize_text(existing_record.get('dse')) != target_dse:
-                    continue
-                if _normalize_text(existing_record.get('dse_name')) != target_name:
-                    continue
-
-                # Обновляем record_id у существующей записи для стабильной ссылки
-                if not existing_record.get('record_id'):
-                    existing_record['record_id'] = _make_record_id(existing_user_id, idx)
+        for existing_user_id, idx in link_index.get(key, []):
+            existing_record = data[existing_user_id][idx]
 
-                existing_ref = _make_record_ref(existing_record, existing_user_id, idx)
+            # Обновляем record_id у существующей записи для стабильной ссылки
+            if not existing_record.get('record_id'):
+                existing_record['record_id'] = _make_record_id(existing_user_id, idx)
 
-                # Добавляем ссылку в новую запись и во все совпавшие существующие
-                _add_related_link(record_copy, existing_ref)
-                _add_related_link(existing_record, new_ref)
+            existing_ref = _make_record_ref(existing_record, existing_user_id, idx)
 
-                # Записываем обратно измененную запись
-                user_records[idx] = existing_record
+            # Добавляем ссылку в новую запись и во все совпавшие существующие
+            _add_related_link(record_copy, existing_ref)
+            _add_related_link(existing_record, new_ref)
 
     data[user_id].append(record_copy)
-    data[PENDING_DSE_REQUESTS_KEY] = pending
-    save_data(data, DATA_FILE)
-
+    link_index.setdefault(key, []).append((user_id, new_index))
     return record_copy
 
 
-def reject_pending_dse_request(request_id: int, approver_id: str = None):
-    """Отклонить заявку ДСЕ и переместить в архив"""
-    data = load_data(DATA_FILE)
-    if not isinstance(data, dict):
-        return None
-
-    pending = _ensure_dict(data.get(PENDING_DSE_REQUESTS_KEY))
-    req_key = str(request_id)
-    if req_key not in pending:
-        return None
-
+def _reject_loaded_request(pending: dict, archived: dict, req_key: str, approver_id):
+    """Отклонить одну заявку в уже загруженных данных (без сохранения)"""
     record = pending.pop(req_key)
-    archived = _ensure_dict(data.get(ARCHIVED_DSE_REQUESTS_KEY))
 
     record_copy = record.copy()
     record_copy['status'] = 'rejected'
@@ -328,13 +356,82 @@ def reject_pending_dse_request(request_id: int, approver_id: str = None):
         record_copy['rejected_by'] = str(approver_id)
 
     archived[req_key] = record_copy
+    return record_copy
+
+
+def approve_pending_dse_requests(request_ids, approver_id: str = None) -> dict:
+    """
+    Утвердить несколько заявок ДСЕ за одну транзакцию:
+    одна загрузка файла, один проход построения индекса связей, одна запись.
+
+    Returns:
+        dict: {request_id: утверждённая запись} только для найденных заявок
+    """
+    data = load_data(DATA_FILE)
+    if not isinstance(data, dict):
+        return {}
+
+    pending = _ensure_dict(data.get(PENDING_DSE_REQUESTS_KEY))
+    req_keys = [str(r) for r in request_ids if str(r) in pending]
+    if not req_keys:
+        return {}
+
+    link_index = _build_dse_link_index(data)
+    results = {}
+    for req_key in req_keys:
+        if req_key not in pending:
+            continue
+        record = _approve_loaded_request(data, pending, req_key, approver_id, link_index)
+        results[int(req_key) if req_key.isdigit() else req_key] = record
+
     data[PENDING_DSE_REQUESTS_KEY] = pending
-    data[ARCHIVED_DSE_REQUESTS_KEY] = archived
+    save_data(data, DATA_FILE)
+    return results
 
-    _cleanup_archived_requests(data)
+
+def reject_pending_dse_requests(request_ids, approver_id: str = None) -> dict:
+    """
+    Отклонить несколько заявок ДСЕ за одну транзакцию и переместить в архив.
+
+    Returns:
+        dict: {request_id: архивная запись} только для найденных заявок
+    """
+    data = load_data(DATA_FILE)
+    if not isinstance(data, dict):
+        return {}
+
+    pending = _ensure_dict(data.get(PENDING_DSE_REQUESTS_KEY))
+    req_keys = [str(r) for r in request_ids if str(r) in pending]
+    if not req_keys:
+        return {}
+
+    archived = _ensure_dict(data.get(ARCHIVED_DSE_REQUESTS_KEY))
+    results = {}
+    for req_key in req_keys:
+        if req_key not in pending:
+            continue
+        record = _reject_loaded_request(pending, archived, req_key, approver_id)
+        results[int(req_key) if req_key.isdigit() else req_key] = record
+
+    data[PENDING_DSE_REQUESTS_KEY] = pending
+    data[ARCHIVED_DSE_REQUESTS_KEY] = archived
     save_data(data, DATA_FILE)
 
-    return record_copy
+    for req_id, record in results.items():
+        _schedule_archive_expiry(str(req_id), record)
+    return results
+
+
+def approve_pending_dse_request(request_id: int, approver_id: str = None):
+    """Утвердить заявку ДСЕ и перенести в основную базу"""
+    results = approve_pending_dse_requests([request_id], approver_id)
+    return next(iter(results.values()), None)
+
+
+def reject_pending_dse_request(request_id: int, approver_id: str = None):
+    """Отклонить заявку ДСЕ и переместить в архив"""
+    results = reject_pending_dse_requests([request_id], approver_id)
+    return next(iter(results.values()), None)
 
 
 def find_archived_dse_matches(dse: str, dse_name: str):
@@ -343,9 +440,7 @@ def find_archived_dse_matches(dse: str, dse_name: str):
     if not isinstance(data, dict):
         return []
 
-    changed, archived = _cleanup_archived_requests(data)
-    if changed:
-        save_data(data, DATA_FILE)
+    archived = _ensure_dict(data.get(ARCHIVED_DSE_REQUESTS_KEY))
 
     target_dse = _normalize_text(dse)
     target_name = _normalize_text(dse_name)
@@ -2,18 +2,141 @@ import json
 import os
 import asyncio
 import sys
-from typing import Dict, List, Set
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 
 # Добавляем корневую директорию проекта в sys.path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 # Импортируем load_data из config
 from config.config import WATCHED_DSE_FILE, DATA_FILE, load_data as config_load_data
+from bot.send_scheduler import PRIORITY_NOTIFICATION
 
 # Глобальная переменная для хранения отслеживаемых ДСЕ в памяти
 # Формат: {user_id: set(dse_values)}. Храним в нижнем регистре для сравнения.
 watched_dse_data: Dict[str, Set[str]] = {}
 
+# Обратный индекс: {dse_normalized: set(user_ids)} — кто отслеживает данное ДСЕ.
+# Поддерживается вместе с watched_dse_data функциями add/remove_watched_dse.
+dse_watchers: Dict[str, Set[str]] = {}
+
+# Шаблоны отслеживания: значение с символами '*' (любая последовательность)
+# или '?' (один символ), например 'абвг.301.*'. Хранятся в watched_dse_data и
+# dse_watchers наравне с точными ДСЕ, а для сопоставления — в префиксном дереве.
+WATCH_PATTERN_CHARS = ('*', '?')
+
+
+# Ограничения шаблонов: сопоставление выполняется для каждой утверждённой заявки
+# при каждой проверке, а число вариантов перебора растёт со степенью числа '*'
+WATCH_PATTERN_MAX_STARS = 2
+WATCH_PATTERN_MAX_LENGTH = 64
+# Сколько обычных символов должно стоять перед первой подстановкой
+WATCH_PATTERN_MIN_PREFIX = 3
+
+
+def is_watch_pattern(value: str) -> bool:
+    """Является ли значение шаблоном (содержит '*' или '?')."""
+    return any(ch in value for ch in WATCH_PATTERN_CHARS)
+
+
+def validate_watch_pattern(value: str) -> Optional[str]:
+    """
+    Проверить шаблон отслеживания.
+
+    Returns:
+        str: Текст ошибки для пользователя или None, если шаблон допустим
+             (значения без подстановок не проверяются)
+    """
+    pattern = value.strip()
+    if not is_watch_pattern(pattern):
+        return None
+    if len(pattern) > WATCH_PATTERN_MAX_LENGTH:
+        return f"Шаблон длиннее {WATCH_PATTERN_MAX_LENGTH} символов."
+    if pattern.count('*') > WATCH_PATTERN_MAX_STARS:
+        return f"В шаблоне может быть не больше {WATCH_PATTERN_MAX_STARS} символов *."
+    prefix_length = min(pattern.find(ch) for ch in WATCH_PATTERN_CHARS if ch in pattern)
+    if prefix_length < WATCH_PATTERN_MIN_PREFIX:
+        return (f"Шаблон должен начинаться минимум с {WATCH_PATTERN_MIN_PREFIX} "
+                f"обычных символов (например, АБВГ.301.*).")
+    return None
+
+
+class _PatternTrie:
+    """
+    Префиксное дерево шаблонов отслеживания.
+    Символы шаблона — рёбра дерева, '*' и '?' — отдельные рёбра-подстановки.
+    Для шаблонов вида 'префикс*' сопоставление занимает O(длины ДСЕ)
+    независимо от количества шаблонов.
+    """
+
+    __slots__ = ('children', 'patterns')
+
+    def __init__(self):
+        self.children: Dict[str, '_PatternTrie'] = {}
+        self.patterns: Set[str] = set()
+
+    @staticmethod
+    def _tokens(pattern: str) -> str:
+        # Несколько '*' подряд эквивалентны одной
+        while '**' in pattern:
+            pattern = pattern.replace('**', '*')
+        return pattern
+
+    def insert(self, pattern: str) -> None:
+        node = self
+        for ch in self._tokens(pattern):
+            node = node.children.setdefault(ch, _PatternTrie())
+        node.patterns.add(pattern)
+
+    def remove(self, pattern: str) -> None:
+        path = []
+        node = self
+        for ch in self._tokens(pattern):
+            child = node.children.get(ch)
+            if child is None:
+                return
+            path.append((node, ch))
+            node = child
+        node.patterns.discard(pattern)
+        # Удаляем опустевшие ветви
+        for parent, ch in reversed(path):
+            child = parent.children[ch]
+            if child.patterns or child.children:
+                break
+            del parent.children[ch]
+
+    def match(self, value: str) -> Set[str]:
+        """Вернуть все шаблоны, которым соответствует value."""
+        found: Set[str] = set()
+        self._match(value, 0, found)
+        return found
+
+    def _match(self, value: str, pos: int, found: Set[str]) -> None:
+        star = self.children.get('*')
+        if star is not None:
+            # Завершающая '*' совпадает с любым остатком — без перебора
+            found.update(star.patterns)
+            if star.children:
+                for next_pos in range(pos, len(value) + 1):
+                    star._match(value, next_pos, found)
+
+        if pos == len(value):
+            found.update(self.patterns)
+            return
+
+        any_char = self.children.get('?')
+        if any_char is not None:
+            any_char._match(value, pos + 1, found)
+
+        child = self.children.get(value[pos])
+        if child is not None:
+            child._match(value, pos + 1, found)
+
+    def __bool__(self) -> bool:
+        return bool(self.children or self.patterns)
+
+
+_pattern_trie = _PatternTrie()
+
 # Храним последние известные ID записей, чтобы не дублировать уведомления
 # Формат: {dse_value_lower: set(record_ids)}
 last_known_records: Dict[str, Set[str]] = {}
@@ -34,9 +157,28 @@ def load_watched_dse_data():
             watched_dse_data = {}
     else:
         watched_dse_data = {}
+    _rebuild_watchers_index()
     return watched_dse_data
 
 
+def _rebuild_watchers_index():
+    """Перестраивает обратный индекс ДСЕ -> пользователи и дерево шаблонов по watched_dse_data."""
+    global dse_watchers, _pattern_trie
+    dse_watchers = {}
+    _pattern_trie = _PatternTrie()
+    for user_id, dse_set in watched_dse_data.items():
+        for dse_normalized in dse_set:
+            if is_watch_pattern(dse_normalized):
+                error = validate_watch_pattern(dse_normalized)
+                if error:
+                    # Шаблоны, сохранённые до появления ограничений, не сопоставляются
+                    print(f"⚠️ Шаблон '{dse_normalized}' пользователя {user_id} пропущен: {error}")
+                    continue
+                if dse_normalized not in dse_watchers:
+                    _pattern_trie.insert(dse_normalized)
+            dse_watchers.setdefault(dse_normalized, set()).add(user_id)
+
+
 def save_watched_dse_data():
     """Сохраняет данные об отслеживаемых ДСЕ из памяти в файл."""
     global watched_dse_data
@@ -50,14 +192,31 @@ def save_watched_dse_data():
         print(f"❌ Ошибка сохранения {WATCHED_DSE_FILE}: {e}")
 
 
-def add_watched_dse(user_id: str, dse_value: str):
-    """Добавляет ДСЕ в список отслеживаемых для пользователя."""
+def add_watched_dse(user_id: str, dse_value: str) -> bool:
+    """
+    Добавляет ДСЕ в список отслеживаемых для пользователя.
+    Шаблон предварительно проверяется validate_watch_pattern.
+
+    Returns:
+        bool: False, если шаблон недопустим
+    """
     global watched_dse_data
     dse_normalized = dse_value.strip().lower()  # Нормализуем для внутренней логики
+    if validate_watch_pattern(dse_normalized):
+        return False
     if user_id not in watched_dse_data:
         watched_dse_data[user_id] = set()
     watched_dse_data[user_id].add(dse_normalized)
+    is_new_key = dse_normalized not in dse_watchers
+    if is_new_key and is_watch_pattern(dse_normalized):
+        _pattern_trie.insert(dse_normalized)
+    dse_watchers.setdefault(dse_normalized, set()).add(user_id)
     save_watched_dse_data()
+    if is_new_key:
+        # Уже существующие заявки по новому ключу считаются известными —
+        # уведомления придут только о новых
+        seed_known_records([dse_normalized])
+    return True
 
 
 def remove_watched_dse(user_id: str, dse_value: str):
@@ -66,6 +225,13 @@ def remove_watched_dse(user_id: str, dse_value: str):
     dse_normalized = dse_value.strip().lower()  # Нормализуем для внутренней логики
     if user_id in watched_dse_data:
         watched_dse_data[user_id].discard(dse_normalized)
+        watchers = dse_watchers.get(dse_normalized)
+        if watchers is not None:
+            watchers.discard(user_id)
+            if not watchers:
+                del dse_watchers[dse_normalized]
+                if is_watch_pattern(dse_normalized):
+                    _pattern_trie.remove(dse_normalized)
         # Если список для пользователя опустел, можно его удалить
         if not watched_dse_data[user_id]:
             del watched_dse_data[user_id]
@@ -85,6 +251,26 @@ def get_all_watched_dse() -> Dict[str, Set[str]]:
     return watched_dse_data
 
 
+def match_watch_keys(dse_value: str) -> Set[str]:
+    """
+    Возвращает ключи отслеживания (точное ДСЕ и/или шаблоны), которым
+    соответствует значение ДСЕ.
+    """
+    dse_normalized = dse_value.strip().lower()
+    keys = _pattern_trie.match(dse_normalized) if _pattern_trie else set()
+    if dse_normalized in dse_watchers:
+        keys.add(dse_normalized)
+    return keys
+
+
+def get_dse_watchers(dse_value: str) -> Set[str]:
+    """Возвращает множество пользователей, отслеживающих данное ДСЕ (точно или по шаблону)."""
+    users: Set[str] = set()
+    for key in match_watch_keys(dse_value):
+        users.update(dse_watchers.get(key, set()))
+    return users
+
+
 def _get_record_id(record: dict, user_id: str) -> str:
     """Генерирует уникальный ID для записи."""
     # Комбинируем пользовательский ID, ДСЕ и хэш описания для уникальности
@@ -96,6 +282,48 @@ def _get_record_id(record: dict, user_id: str) -> str:
     return f"{user_id}_{dse_normalized}_{hash(desc)}"
 
 
+def _scan_watched_records(all_bot_data, keys: Set[str]) -> Tuple[Dict[str, list], Dict[str, Set[str]]]:
+    """
+    Утверждённые заявки, подходящие под ключи отслеживания keys.
+
+    Returns:
+        tuple: ({ключ: [(автор, запись)]}, {ключ: set(ID записей)})
+    """
+    records_per_dse = {dse: [] for dse in keys}
+    record_ids_current = {dse: set() for dse in keys}
+
+    for data_user_id, user_records in all_bot_data.items():
+        if isinstance(user_records, list):
+            for record in user_records:
+                # Уведомляем только по утверждённым заявкам
+                if not record.get('approved_at'):
+                    continue
+                record_dse_original = record.get('dse', '')
+                if record_dse_original:
+                    # Проверяем, отслеживается ли это ДСЕ (точно или по шаблону)
+                    for watch_key in match_watch_keys(record_dse_original):
+                        if watch_key not in records_per_dse:
+                            continue
+                        records_per_dse[watch_key].append((data_user_id, record))
+                        record_id = _get_record_id(record, data_user_id)
+                        record_ids_current[watch_key].add(record_id)
+    return records_per_dse, record_ids_current
+
+
+def seed_known_records(keys: Optional[Iterable[str]] = None) -> None:
+    """
+    Запомнить текущие заявки по ключам отслеживания (по умолчанию — по всем) без уведомлений.
+    Вызывается при добавлении ключа и при запуске бота, чтобы пользователю
+    не приходила вся история заявок, подходящих под ключ.
+    """
+    keys = set(dse_watchers) if keys is None else set(keys)
+    if not keys:
+        return
+    all_bot_data = config_load_data(DATA_FILE)
+    _, record_ids_current = _scan_watched_records(all_bot_data, keys)
+    last_known_records.update(record_ids_current)
+
+
 async def check_for_new_dse_and_notify(context):
     """
     Проверяет новые записи ДСЕ и уведомляет пользователей.
@@ -116,10 +344,8 @@ async def check_for_new_dse_and_notify(context):
         return
 
     # 3. Для каждого отслеживаемого ДСЕ проверяем новые записи
-    # Сначала соберем все отслеживаемые DSE в один набор для эффективного поиска
-    all_watched_dse_normalized = set()
-    for dse_set in current_watched.values():
-        all_watched_dse_normalized.update(dse_set)
+    # Набор отслеживаемых DSE — ключи обратного индекса
+    all_watched_dse_normalized = set(dse_watchers.keys())
 
     if not all_watched_dse_normalized:
         print("📭 Нет отслеживаемых ДСЕ.")
@@ -129,76 +355,77 @@ async def check_for_new_dse_and_notify(context):
 
     # Теперь пройдемся по всем записям и проверим, относятся ли они к отслеживаемым ДСЕ
     # И соберем информацию о записях для каждого отслеживаемого ДСЕ
-    records_per_dse = {dse: [] for dse in all_watched_dse_normalized}
-    record_ids_current = {dse: set() for dse in all_watched_dse_normalized}
-
-    for data_user_id, user_records in all_bot_data.items():
-        if isinstance(user_records, list):
-            for record in user_records:
-                # Уведомляем только по утверждённым заявкам
-                if not record.get('approved_at'):
-                    continue
-                record_dse_original = record.get('dse', '')
-                if record_dse_original:
-                    record_dse_normalized = record_dse_original.strip().lower()
-                    # Проверяем, отслеживается ли это ДСЕ
-                    if record_dse_normalized in all_watched_dse_normalized:
-                        records_per_dse[record_dse_normalized].append((data_user_id, record))
-                        record_id = _get_record_id(record, data_user_id)
-                        record_ids_current[record_dse_normalized].add(record_id)
-
-    # Теперь проверим каждое отслеживаемое ДСЕ на наличие новых записей
-    for dse_normalized, current_record_ids in record_ids_current.items():
+    records_per_dse, record_ids_current = _scan_watched_records(all_bot_data, all_watched_dse_normalized)
+
+    # Теперь проверим каждое отслеживаемое ДСЕ на наличие новых записей.
+    # Запись может подходить под несколько ключей пользователя (точное ДСЕ и шаблоны) —
+    # собираем получателей так, чтобы каждая новая запись попала к пользователю один раз:
+    # {user_id: {record_id: (первый совпавший ключ, автор, запись)}}
+    recipients: Dict[str, Dict[str, tuple]] = {}
+    for dse_normalized in sorted(record_ids_current):
+        current_record_ids = record_ids_current[dse_normalized]
         previously_known_ids = last_known_records.get(dse_normalized, set())
         new_record_ids = current_record_ids - previously_known_ids
 
         if new_record_ids:
             print(f"🔔 Найдены новые записи для отслеживаемого ДСЕ '{dse_normalized}'")
 
-            # Найдем пользователей, которые отслеживают это ДСЕ
-            users_to_notify = []
-            for user_id, watched_set in current_watched.items():
-                if dse_normalized in watched_set:
-                    users_to_notify.append(user_id)
-
-            # Соберем информацию о новых записях для уведомления
-            new_records_info = []
+            # Пользователи, которые отслеживают это ДСЕ (по обратному индексу)
+            users_to_notify = dse_watchers.get(dse_normalized, set())
             for data_user_id, record in records_per_dse[dse_normalized]:
                 record_id = _get_record_id(record, data_user_id)
-                if record_id in new_record_ids:
-                    problem = record.get('problem_type', 'Не указано')
-                    desc = record.get('description', 'Нет описания')[:100] + "..." if len(
-                        record.get('description', '')) > 100 else record.get('description', 'Нет описания')
-                    from .user_manager import get_users_data
-                    users_data = get_users_data()
-                    user_info = users_data.get(data_user_id, {})
-                    user_name = user_info.get('first_name', f"Пользователь {data_user_id}")
-                    new_records_info.append(f"• От: {user_name}\n  Тип: {problem}\n  Описание: {desc}\n---")
-
-            if new_records_info and users_to_notify:
-                notification_text = f"🔔 Новые записи по отслеживаемому ДСЕ '{dse_normalized.upper()}':\n\n" + "\n".join(
-                    new_records_info)
-
-                # Уведомляем всех заинтересованных пользователей
-                for user_id in users_to_notify:
-                    try:
-                        await context.bot.send_message(chat_id=user_id, text=notification_text)
-                        print(f"📤 Уведомление отправлено пользователю {user_id} по ДСЕ '{dse_normalized}'")
-                    except Exception as e:
-                        print(f"❌ Ошибка уведомления пользователя {user_id} по ДСЕ '{dse_normalized}': {e}")
-            elif users_to_notify:
-                # На случай, если по какой-то причине информация о записях не собралась
+                if record_id not in new_record_ids:
+                    continue
                 for user_id in users_to_notify:
-                    try:
-                        await context.bot.send_message(chat_id=user_id,
-                                                       text=f"🔔 Появились новые данные по отслеживаемому ДСЕ '{dse_normalized.upper()}'. Проверьте список ДСЕ.")
-                        print(f"📤 Уведомление (резервное) отправлено пользователю {user_id} по ДСЕ '{dse_normalized}'")
-                    except Exception as e:
-                        print(f"❌ Ошибка резервного уведомления пользователя {user_id} по ДСЕ '{dse_normalized}': {e}")
+                    recipients.setdefault(user_id, {}).setdefault(
+                        record_id, (dse_normalized, data_user_id, record))
 
         # Обновляем список известных записей для этого ДСЕ
         last_known_records[dse_normalized] = current_record_ids
 
+    if not recipients:
+        print("✅ Проверка новых ДСЕ завершена.")
+        return
+
+    from .user_manager import get_users_data
+    from .digest_manager import queue_notifications
+    users_data = get_users_data()
+
+    messages = []
+    for user_id, user_records in recipients.items():
+        # Группируем новые записи пользователя по ключу, под который они попали первыми
+        records_by_key: Dict[str, list] = {}
+        for watch_key, data_user_id, record in user_records.values():
+            records_by_key.setdefault(watch_key, []).append((data_user_id, record))
+
+        for dse_normalized, key_records in records_by_key.items():
+            new_records_info = []
+            new_records = []
+            for data_user_id, record in key_records:
+                new_records.append(record)
+                problem = record.get('problem_type', 'Не указано')
+                desc = record.get('description', 'Нет описания')[:100] + "..." if len(
+                    record.get('description', '')) > 100 else record.get('description', 'Нет описания')
+                user_info = users_data.get(data_user_id, {})
+                user_name = user_info.get('first_name', f"Пользователь {data_user_id}")
+                new_records_info.append(f"• От: {user_name}\n  Тип: {problem}\n  Описание: {desc}\n---")
+
+            notification_text = f"🔔 Новые записи по отслеживаемому ДСЕ '{dse_normalized.upper()}':\n\n" + "\n".join(
+                new_records_info)
+            messages.append((user_id, dse_normalized, notification_text, new_records))
+
+    # Пользователи в режиме сводки получат это в общем сообщении (один проход по файлу сводок)
+    queued = queue_notifications((user_id, text, records) for user_id, _, text, records in messages)
+    for user_id, dse_normalized, notification_text, _ in messages:
+        if str(user_id) in queued:
+            continue
+        try:
+            await context.bot.send_message(chat_id=user_id, text=notification_text,
+                                           rate_limit_args=PRIORITY_NOTIFICATION)
+            print(f"📤 Уведомление отправлено пользователю {user_id} по ДСЕ '{dse_normalized}'")
+        except Exception as e:
+            print(f"❌ Ошибка уведомления пользователя {user_id} по ДСЕ '{dse_normalized}': {e}")
+
     print("✅ Проверка новых ДСЕ завершена.")
 
 
@@ -206,6 +433,9 @@ async def check_for_new_dse_and_notify(context):
 async def start_watcher_job(application):
     """Запускает периодическую задачу проверки ДСЕ."""
     print("⏱️  Задача DSE Watcher запущена.")
+    # После перезапуска известные записи не сохранены — запоминаем текущие,
+    # иначе первая проверка разослала бы всю историю заявок
+    seed_known_records()
     async def periodic_check():
         while True:
             try:
@@ -1,34 +1,145 @@
 """
 Менеджер email адресов для отправки отчетов и заявок
 Сохраняет историю отправок, частоту использования
+
+История хранится в SQLite (data/email_history.sqlite3), одна строка на пару
+(пользователь, адрес): добавление отправки обновляет одну строку, а не
+переписывает весь файл. Рейтинг подсказок (2 * отправок этого типа + всего
+отправок, при равенстве — недавние выше) хранится в индексированных столбцах,
+поэтому подсказки выбираются запросом по индексу без перебора истории.
+Старый email_history.json (в текущей папке) переносится в базу при первом обращении.
 """
 
 import json
 import os
+import sqlite3
+import sys
+import threading
 from datetime import datetime
 from typing import List, Dict, Optional, Tuple
 
+# Добавляем корневую директорию проекта в sys.path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from config.config import DATA_DIR
+
+EMAIL_HISTORY_DB_FILE = str(DATA_DIR / "email_history.sqlite3")
+
+# Прежний файл истории (путь относительно текущей папки) — только для переноса
 EMAIL_HISTORY_FILE = "email_history.json"
 
+EMAIL_TYPES = ("export", "application")
 
-def load_email_history() -> Dict:
-    """Загружает историю email отправок"""
+_db_lock = threading.RLock()
+_db_connection = None
+
+
+def _get_db() -> sqlite3.Connection:
+    """Соединение с базой истории (создаётся и при необходимости заполняется при первом обращении)"""
+    global _db_connection
+    if _db_connection is None:
+        os.makedirs(os.path.dirname(EMAIL_HISTORY_DB_FILE), exist_ok=True)
+        connection = sqlite3.connect(EMAIL_HISTORY_DB_FILE, check_same_thread=False)
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS email_history ("
+            " user_id TEXT NOT NULL, email_key TEXT NOT NULL, email TEXT NOT NULL,"
+            " count INTEGER NOT NULL DEFAULT 0,"
+            " export_count INTEGER NOT NULL DEFAULT 0, application_count INTEGER NOT NULL DEFAULT 0,"
+            " export_score INTEGER NOT NULL DEFAULT 0, application_score INTEGER NOT NULL DEFAULT 0,"
+            " first_used TEXT, last_used TEXT, dse_numbers TEXT NOT NULL DEFAULT '[]',"
+            " PRIMARY KEY (user_id, email_key))"
+        )
+        connection.execute("CREATE INDEX IF NOT EXISTS email_history_export"
+                           " ON email_history (user_id, export_score DESC, last_used DESC)")
+        connection.execute("CREATE INDEX IF NOT EXISTS email_history_application"
+                           " ON email_history (user_id, application_score DESC, last_used DESC)")
+        connection.execute("CREATE INDEX IF NOT EXISTS email_history_count"
+                           " ON email_history (user_id, count DESC, first_used)")
+        connection.commit()
+        _db_connection = connection
+        _migrate_legacy_history(connection)
+    return _db_connection
+
+
+def _row_values(user_id: str, email_key: str, data: Dict) -> tuple:
+    types = data.get("types") or {}
+    count = data.get("count", 0)
+    export_count = types.get("export", 0)
+    application_count = types.get("application", 0)
+    return (
+        str(user_id), email_key, data.get("email", email_key), count,
+        export_count, application_count,
+        export_count * 2 + count, application_count * 2 + count,
+        data.get("first_used"), data.get("last_used"),
+        json.dumps(data.get("dse_numbers", []), ensure_ascii=False)
+    )
+
+
+_INSERT_SQL = ("INSERT OR REPLACE INTO email_history (user_id, email_key, email, count,"
+               " export_count, application_count, export_score, application_score,"
+               " first_used, last_used, dse_numbers) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)")
+
+
+def _migrate_legacy_history(connection: sqlite3.Connection) -> None:
+    """Перенести историю из прежнего JSON файла и переименовать его"""
     if not os.path.exists(EMAIL_HISTORY_FILE):
-        return {}
-    
+        return
     try:
         with open(EMAIL_HISTORY_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
+            history = json.load(f)
+        rows = [_row_values(user_id, email_key, data)
+                for user_id, emails in history.items() if isinstance(emails, dict)
+                for email_key, data in emails.items() if isinstance(data, dict)]
+        connection.executemany(_INSERT_SQL, rows)
+        connection.commit()
+        os.replace(EMAIL_HISTORY_FILE, f"{EMAIL_HISTORY_FILE}.migrated")
+        print(f"📧 История email перенесена в базу: {len(rows)} адресов")
+    except Exception as e:
+        print(f"⚠️  Ошибка переноса истории email: {e}")
+
+
+def _row_to_entry(row: sqlite3.Row) -> Dict:
+    return {
+        "email": row["email"],
+        "count": row["count"],
+        "last_used": row["last_used"],
+        "first_used": row["first_used"],
+        "types": {
+            "export": row["export_count"],
+            "application": row["application_count"]
+        },
+        "dse_numbers": json.loads(row["dse_numbers"] or "[]")
+    }
+
+
+def load_email_history() -> Dict:
+    """Загружает всю историю email отправок (формат {user_id: {email: данные}})"""
+    try:
+        with _db_lock:
+            rows = _get_db().execute("SELECT * FROM email_history").fetchall()
     except Exception as e:
         print(f"⚠️  Ошибка загрузки истории email: {e}")
         return {}
+    history = {}
+    for row in rows:
+        history.setdefault(row["user_id"], {})[row["email_key"]] = _row_to_entry(row)
+    return history
 
 
 def save_email_history(history: Dict) -> bool:
-    """Сохраняет историю email отправок"""
+    """Сохраняет всю историю email отправок (заменяет содержимое базы)"""
     try:
-        with open(EMAIL_HISTORY_FILE, 'w', encoding='utf-8') as f:
-            json.dump(history, f, ensure_ascii=False, indent=2)
+        with _db_lock:
+            db = _get_db()
+            db.execute("DELETE FROM email_history")
+            db.executemany(_INSERT_SQL, [
+                _row_values(user_id, email_key, data)
+                for user_id, emails in history.items()
+                for email_key, data in emails.items()
+            ])
+            db.commit()
         return True
     except Exception as e:
         print(f"⚠️  Ошибка сохранения истории email: {e}")
@@ -45,43 +156,49 @@ def add_email_to_history(user_id: str, email: str, email_type: str = "export", d
         email_type: Тип отправки - "export" (выгрузка) или "application" (заявка)
         dse_number: Номер ДСЕ (только для заявок)
     """
-    history = load_email_history()
-    
-    if user_id not in history:
-        history[user_id] = {}
-    
+    user_id = str(user_id)
     email_lower = email.lower().strip()
+    now = datetime.now().isoformat()
     
-    if email_lower not in history[user_id]:
-        history[user_id][email_lower] = {
-            "email": email,  # Оригинальный формат написания
-            "count": 0,
-            "last_used": None,
-            "first_used": None,
-            "types": {
-                "export": 0,
-                "application": 0
-            },
-            "dse_numbers": []  # Список номеров ДСЕ для которых отправлялись заявки
-        }
-    
-    # Обновляем статистику
-    history[user_id][email_lower]["count"] += 1
-    history[user_id][email_lower]["last_used"] = datetime.now().isoformat()
-    
-    if history[user_id][email_lower]["first_used"] is None:
-        history[user_id][email_lower]["first_used"] = datetime.now().isoformat()
-    
-    # Обновляем счетчик по типу отправки
-    if email_type in history[user_id][email_lower]["types"]:
-        history[user_id][email_lower]["types"][email_type] += 1
-    
-    # Добавляем номер ДСЕ если это заявка
-    if email_type == "application" and dse_number:
-        if dse_number not in history[user_id][email_lower]["dse_numbers"]:
-            history[user_id][email_lower]["dse_numbers"].append(dse_number)
-    
-    save_email_history(history)
+    try:
+        with _db_lock:
+            db = _get_db()
+            row = db.execute("SELECT * FROM email_history WHERE user_id = ? AND email_key = ?",
+                             (user_id, email_lower)).fetchone()
+            if row is None:
+                entry = {
+                    "email": email,  # Оригинальный формат написания
+                    "count": 0,
+                    "last_used": None,
+                    "first_used": None,
+                    "types": {
+                        "export": 0,
+                        "application": 0
+                    },
+                    "dse_numbers": []  # Список номеров ДСЕ для которых отправлялись заявки
+                }
+            else:
+                entry = _row_to_entry(row)
+            
+            # Обновляем статистику
+            entry["count"] += 1
+            entry["last_used"] = now
+            if entry["first_used"] is None:
+                entry["first_used"] = now
+            
+            # Обновляем счетчик по типу отправки
+            if email_type in entry["types"]:
+                entry["types"][email_type] += 1
+            
+            # Добавляем номер ДСЕ если это заявка
+            if email_type == "application" and dse_number:
+                if dse_number not in entry["dse_numbers"]:
+                    entry["dse_numbers"].append(dse_number)
+            
+            db.execute(_INSERT_SQL, _row_values(user_id, email_lower, entry))
+            db.commit()
+    except Exception as e:
+        print(f"⚠️  Ошибка сохранения истории email: {e}")
 
 
 def get_user_emails(user_id: str, limit: int = 10) -> List[Dict]:
@@ -95,26 +212,12 @@ def get_user_emails(user_id: str, limit: int = 10) -> List[Dict]:
     Returns:
         Список словарей с информацией об email адресах
     """
-    history = load_email_history()
-    
-    if user_id not in history:
-        return []
-    
-    emails = []
-    for email_key, data in history[user_id].items():
-        emails.append({
-            "email": data["email"],
-            "count": data["count"],
-            "last_used": data["last_used"],
-            "first_used": data["first_used"],
-            "types": data["types"],
-            "dse_numbers": data.get("dse_numbers", [])
-        })
-    
-    # Сортируем по количеству использований (убывание)
-    emails.sort(key=lambda x: x["count"], reverse=True)
-    
-    return emails[:limit]
+    with _db_lock:
+        rows = _get_db().execute(
+            "SELECT * FROM email_history WHERE user_id = ? ORDER BY count DESC, first_used LIMIT ?",
+            (str(user_id), limit)
+        ).fetchall()
+    return [_row_to_entry(row) for row in rows]
 
 
 def get_formatted_emails_list(user_id: str, limit: int = 5) -> str:
@@ -176,19 +279,13 @@ def remove_email_from_history(user_id: str, email: str) -> bool:
     Returns:
         True если email был удален, False если не найден
     """
-    history = load_email_history()
-    
-    if user_id not in history:
-        return False
-    
     email_lower = email.lower().strip()
-    
-    if email_lower in history[user_id]:
-        del history[user_id][email_lower]
-        save_email_history(history)
-        return True
-    
-    return False
+    with _db_lock:
+        db = _get_db()
+        cursor = db.execute("DELETE FROM email_history WHERE user_id = ? AND email_key = ?",
+                            (str(user_id), email_lower))
+        db.commit()
+    return cursor.rowcount > 0
 
 
 def clear_user_email_history(user_id: str) -> bool:
@@ -201,11 +298,10 @@ def clear_user_email_history(user_id: str) -> bool:
     Returns:
         True если история была очищена
     """
-    history = load_email_history()
-    
-    if user_id in history:
-        history[user_id] = {}
-        save_email_history(history)
+    with _db_lock:
+        db = _get_db()
+        db.execute("DELETE FROM email_history WHERE user_id = ?", (str(user_id),))
+        db.commit()
     
     return True
 
@@ -214,6 +310,9 @@ def get_email_suggestions(user_id: str, email_type: str = "export", limit: int =
     """
     Получает список предложений email адресов для конкретного типа отправки
     
+    Чем больше адрес использовался для данного типа - тем выше приоритет
+    (рейтинг 2 * отправок типа + всего отправок хранится готовым в базе).
+    
     Args:
         user_id: ID пользователя Telegram
         email_type: Тип отправки - "export" или "application"
@@ -222,30 +321,14 @@ def get_email_suggestions(user_id: str, email_type: str = "export", limit: int =
     Returns:
         Список email адресов
     """
-    history = load_email_history()
-    
-    if user_id not in history:
-        return []
-    
-    # Собираем email, отфильтрованные по типу использования
-    emails_with_score = []
-    
-    for email_key, data in history[user_id].items():
-        # Вычисляем "релевантность" для данного типа
-        type_count = data["types"].get(email_type, 0)
-        total_count = data["count"]
-        
-        # Чем больше использовался для данного типа - тем выше приоритет
-        score = (type_count * 2) + total_count
-        
-        if score > 0:
-            emails_with_score.append((data["email"], score))
-    
-    # Сортируем по релевантности
-    emails_with_score.sort(key=lambda x: x[1], reverse=True)
-    
-    # Возвращаем только email адреса
-    return [email for email, score in emails_with_score[:limit]]
+    score_column = f"{email_type}_score" if email_type in EMAIL_TYPES else "count"
+    with _db_lock:
+        rows = _get_db().execute(
+            f"SELECT email FROM email_history WHERE user_id = ? AND {score_column} > 0"
+            f" ORDER BY {score_column} DESC, last_used DESC LIMIT ?",
+            (str(user_id), limit)
+        ).fetchall()
+    return [row["email"] for row in rows]
 
 
 def validate_email(email: str) -> Tuple[bool, str]:
@@ -296,41 +379,27 @@ def get_statistics(user_id: str) -> Dict:
     Returns:
         Словарь со статистикой
     """
-    history = load_email_history()
-    
-    if user_id not in history:
-        return {
-            "total_emails": 0,
-            "total_sends": 0,
-            "export_sends": 0,
-            "application_sends": 0,
-            "most_used_email": None,
-            "most_used_count": 0
-        }
-    
-    total_emails = len(history[user_id])
-    total_sends = 0
-    export_sends = 0
-    application_sends = 0
-    most_used_email = None
-    most_used_count = 0
-    
-    for email_key, data in history[user_id].items():
-        total_sends += data["count"]
-        export_sends += data["types"].get("export", 0)
-        application_sends += data["types"].get("application", 0)
-        
-        if data["count"] > most_used_count:
-            most_used_count = data["count"]
-            most_used_email = data["email"]
+    with _db_lock:
+        db = _get_db()
+        totals = db.execute(
+            "SELECT COUNT(*) AS total_emails, COALESCE(SUM(count), 0) AS total_sends,"
+            " COALESCE(SUM(export_count), 0) AS export_sends,"
+            " COALESCE(SUM(application_count), 0) AS application_sends"
+            " FROM email_history WHERE user_id = ?",
+            (str(user_id),)
+        ).fetchone()
+        top = db.execute(
+            "SELECT email, count FROM email_history WHERE user_id = ? ORDER BY count DESC, first_used LIMIT 1",
+            (str(user_id),)
+        ).fetchone()
     
     return {
-        "total_emails": total_emails,
-        "total_sends": total_sends,
-        "export_sends": export_sends,
-        "application_sends": application_sends,
-        "most_used_email": most_used_email,
-        "most_used_count": most_used_count
+        "total_emails": totals["total_emails"],
+        "total_sends": totals["total_sends"],
+        "export_sends": totals["export_sends"],
+        "application_sends": totals["application_sends"],
+        "most_used_email": top["email"] if top else None,
+        "most_used_count": top["count"] if top else 0
     }
 
 
@@ -1,40 +1,155 @@
 """
 Invite Manager - QR коды для приглашения пользователей
 Система генерации и валидации QR кодов приглашений с ролями
+
+Приглашения держатся в памяти (перечитываются, если файл изменён другим
+процессом) вместе со сроками действия code -> expires_at и кучей
+(expires_at, code): проверка кода — поиск в словаре, истекшие приглашения
+убирает фоновая задача, не перебирая все коды. Использованные и истекшие
+приглашения старше INVITE_ARCHIVE_AFTER_DAYS переносятся в отдельный
+архивный файл, чтобы основной файл оставался небольшим.
+
+Отрисованные QR коды кэшируются по (код, формат): в памяти (LRU, до
+QR_CACHE_MAX_ENTRIES) и в папке qr_codes; кэш очищается, когда приглашение
+использовано, удалено или истекло.
 """
+import asyncio
+import heapq
 import json
 import os
 import sys
 import secrets
 import string
-import qrcode
 import base64
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from io import BytesIO
 from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
 
 # Добавляем корневую директорию проекта в sys.path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from config.config import DATA_DIR, PHOTOS_DIR
+from config.config import DATA_DIR, PHOTOS_DIR, next_sequence
 from bot.user_manager import register_user, set_user_role, ROLES
 
 # Файл для хранения приглашений
 INVITES_FILE = os.path.join(DATA_DIR, "invites.json")
 
-def load_invites_data():
-    """Загрузить данные приглашений"""
-    if os.path.exists(INVITES_FILE):
+# Архив давно использованных и истекших приглашений
+INVITES_ARCHIVE_FILE = os.path.join(DATA_DIR, "invites_archive.json")
+
+# Через сколько дней использованное/истекшее приглашение уходит в архив
+INVITE_ARCHIVE_AFTER_DAYS = 30
+
+# Интервал фоновой очистки истекших приглашений и кодов привязки (секунды)
+INVITE_SWEEP_INTERVAL_SECONDS = 300
+
+# Интервал переноса старых приглашений в архив (секунды)
+INVITE_COMPACTION_INTERVAL_SECONDS = 24 * 3600
+
+# Максимум приглашений в одном пакете
+MAX_BATCH_INVITES = 500
+
+# Процессы для отрисовки QR пакета (qrcode — чистый Python, потоки не ускоряют)
+QR_RENDER_MAX_WORKERS = min(4, os.cpu_count() or 1)
+
+# Пакеты меньше этого размера рисуются в текущем процессе
+QR_RENDER_PARALLEL_THRESHOLD = 16
+
+QR_CODES_DIR = os.path.join(PHOTOS_DIR, "qr_codes")
+
+# Размер кэша отрисованных QR кодов в памяти (записей)
+QR_CACHE_MAX_ENTRIES = 256
+
+QR_CACHE_FORMATS = ('PNG', 'JPEG')
+
+_qr_cache_lock = threading.Lock()
+# (invite_code, format) -> байты изображения; порядок — от давно неиспользуемых к свежим
+_qr_cache: 'OrderedDict[Tuple[str, str], bytes]' = OrderedDict()
+
+_invites_lock = threading.RLock()
+_invites_data: Optional[Dict] = None
+_invites_signature: Optional[Tuple[int, int]] = None
+# code -> expires_at (timestamp) для ожидающих приглашений
+_invite_expiry: Dict[str, float] = {}
+_invite_expiry_heap = []
+
+
+def _file_signature(path) -> Optional[Tuple[int, int]]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _read_json(path, sections) -> Dict:
+    data = {}
+    if os.path.exists(path):
         try:
-            with open(INVITES_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except:
-            return {"invites": {}, "used_invites": {}}
-    return {"invites": {}, "used_invites": {}}
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except Exception:
+            data = {}
+    if not isinstance(data, dict):
+        data = {}
+    for key in sections:
+        if not isinstance(data.get(key), dict):
+            data[key] = {}
+    return data
+
+
+def _write_json_atomic(path, data) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _parse_expires_at(invite_data) -> float:
+    try:
+        return datetime.fromisoformat(invite_data["expires_at"]).timestamp()
+    except (KeyError, TypeError, ValueError):
+        # Без корректного срока приглашение считается истекшим
+        return 0.0
+
+
+def _track_invite_expiry(code, invite_data) -> None:
+    expires_at = _parse_expires_at(invite_data)
+    _invite_expiry[code] = expires_at
+    heapq.heappush(_invite_expiry_heap, (expires_at, code))
+
+
+def _rebuild_invite_expiry() -> None:
+    _invite_expiry.clear()
+    for code, invite_data in _invites_data["invites"].items():
+        _invite_expiry[code] = _parse_expires_at(invite_data)
+    _invite_expiry_heap[:] = [(expires_at, code) for code, expires_at in _invite_expiry.items()]
+    heapq.heapify(_invite_expiry_heap)
+
+
+def load_invites_data():
+    """Загрузить данные приглашений (из памяти; файл перечитывается, если изменён извне)"""
+    global _invites_data, _invites_signature
+    with _invites_lock:
+        signature = _file_signature(INVITES_FILE)
+        if _invites_data is None or signature != _invites_signature:
+            _invites_data = _read_json(INVITES_FILE, ("invites", "used_invites"))
+            _invites_signature = signature
+            _rebuild_invite_expiry()
+        return _invites_data
 
 def save_invites_data(data):
     """Сохранить данные приглашений"""
-    with open(INVITES_FILE, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    global _invites_data, _invites_signature
+    with _invites_lock:
+        _write_json_atomic(INVITES_FILE, data)
+        if data is not _invites_data:
+            _invites_data = data
+            _rebuild_invite_expiry()
+        _invites_signature = _file_signature(INVITES_FILE)
 
 def generate_invite_code():
     """Генерировать уникальный код приглашения (12 символов)"""
@@ -54,75 +169,209 @@ def create_invite(admin_id, role, expires_hours=168, note=""):
     if role not in allowed_roles:
         return {"success": False, "error": f"QR коды могут создавать только роли: {', '.join(allowed_roles)}"}
     
+    with _invites_lock:
+        return _create_invite(admin_id, role, expires_hours, note)
+
+
+def _create_invite(admin_id, role, expires_hours, note):
+    result = _create_invites(admin_id, role, 1, expires_hours, note)
+    invite_data = result[0]
+    return {"success": True, "invite_code": invite_data["code"], "data": invite_data}
+
+
+def _create_invites(admin_id, role, count, expires_hours, note):
+    """Создать count приглашений одной записью файла (вызывается под _invites_lock)"""
     invites_data = load_invites_data()
     
-    # Генерируем уникальный код
-    invite_code = generate_invite_code()
-    while invite_code in invites_data["invites"] or invite_code in invites_data["used_invites"]:
-        invite_code = generate_invite_code()
+    # Порядковые номера приглашений (для журналов и печатных листов) — одним резервированием
+    first_number = next_sequence(
+        'invite',
+        seed=lambda: len(invites_data["invites"]) + len(invites_data["used_invites"]),
+        count=count
+    )
     
-    # Создаем данные приглашения
-    invite_data = {
-        "code": invite_code,
-        "admin_id": admin_id,
-        "role": role,
-        "note": note,
-        "created_at": datetime.now().isoformat(),
-        "expires_at": (datetime.now() + timedelta(hours=expires_hours)).isoformat(),
-        "used": False,
-        "max_uses": 1  # Один код = один пользователь
-    }
+    created_at = datetime.now()
+    expires_at = (created_at + timedelta(hours=expires_hours)).isoformat()
+    created = []
+    for offset in range(count):
+        # Генерируем уникальный код
+        invite_code = generate_invite_code()
+        while invite_code in invites_data["invites"] or invite_code in invites_data["used_invites"]:
+            invite_code = generate_invite_code()
+        
+        # Создаем данные приглашения
+        invite_data = {
+            "code": invite_code,
+            "number": first_number + offset,
+            "admin_id": admin_id,
+            "role": role,
+            "note": note,
+            "created_at": created_at.isoformat(),
+            "expires_at": expires_at,
+            "used": False,
+            "max_uses": 1  # Один код = один пользователь
+        }
+        
+        invites_data["invites"][invite_code] = invite_data
+        _track_invite_expiry(invite_code, invite_data)
+        created.append(invite_data)
     
-    invites_data["invites"][invite_code] = invite_data
     save_invites_data(invites_data)
-    
-    return {"success": True, "invite_code": invite_code, "data": invite_data}
+    return created
 
-def generate_qr_code(invite_code, format='PNG'):
+
+def create_invites_batch(admin_id, role, count, expires_hours=168, note=""):
     """
-    Генерировать QR код для приглашения
-    :param invite_code: Код приглашения
-    :param format: Формат изображения ('PNG', 'JPEG')
-    :return: Base64 encoded изображение или путь к файлу
+    Создать пакет приглашений одной записью файла
+    :param admin_id: ID администратора
+    :param role: Роль ('initiator' или 'responder')
+    :param count: Количество приглашений (не больше MAX_BATCH_INVITES)
+    :param expires_hours: Количество часов до истечения
+    :param note: Заметка для всех приглашений пакета
+    :return: dict со списком созданных приглашений
     """
-    # Получаем информацию о приглашении для включения роли
-    invites_data = load_invites_data()
-    invite_info = invites_data.get("invites", {}).get(invite_code)
-    role_suffix = f"_{invite_info.get('role', '')}" if invite_info else ""
+    allowed_roles = ['initiator', 'responder']
+    if role not in allowed_roles:
+        return {"success": False, "error": f"QR коды могут создавать только роли: {', '.join(allowed_roles)}"}
+    if not 1 <= count <= MAX_BATCH_INVITES:
+        return {"success": False, "error": f"Количество приглашений должно быть от 1 до {MAX_BATCH_INVITES}"}
+    
+    with _invites_lock:
+        created = _create_invites(admin_id, role, count, expires_hours, note)
+    return {"success": True, "invites": created}
+
+
+def get_invite_url(invite_code, role=None):
+    """URL приглашения для QR кода (роль берётся из приглашения, если не указана)"""
+    if role is None:
+        invite_info = load_invites_data().get("invites", {}).get(invite_code)
+        role = invite_info.get('role', '') if invite_info else None
+    role_suffix = f"_{role}" if role else ""
     
     # URL для сканирования (используем имя бота из конфига)
     from config.config import BOT_USERNAME
-    invite_url = f"https://t.me/{BOT_USERNAME}?start=invite_{invite_code}{role_suffix}"
-    
-    # Создаем QR код
+    return f"https://t.me/{BOT_USERNAME}?start=invite_{invite_code}{role_suffix}"
+
+
+def render_qr_image(data, format='PNG'):
+    """
+    Отрисовать QR код в байты изображения (без файлов и base64)
+    Функция верхнего уровня — выполняется и в процессах пула отрисовки.
+    """
+    import qrcode  # тяжёлая зависимость (PIL) — загружаем только при генерации QR
+
     qr = qrcode.QRCode(
         version=1,
         error_correction=qrcode.constants.ERROR_CORRECT_L,
         box_size=10,
         border=4,
     )
-    qr.add_data(invite_url)
+    qr.add_data(data)
     qr.make(fit=True)
     
-    # Создаем изображение
     img = qr.make_image(fill_color="black", back_color="white")
-    
-    # Сохраняем в память как base64
     buffer = BytesIO()
     img.save(buffer, format=format)
-    img_str = base64.b64encode(buffer.getvalue()).decode()
-    
-    # Также сохраняем файл для возможного использования
-    qr_filename = f"invite_{invite_code}.png"
-    qr_filepath = os.path.join(PHOTOS_DIR, "qr_codes", qr_filename)
-    
-    # Создаем папку если не существует
-    os.makedirs(os.path.join(PHOTOS_DIR, "qr_codes"), exist_ok=True)
-    
-    # Сохраняем файл
-    with open(qr_filepath, 'wb') as f:
-        f.write(base64.b64decode(img_str))
-    
+    return buffer.getvalue()
+
+
+def _qr_filepath(invite_code, format='PNG'):
+    extension = 'png' if format.upper() == 'PNG' else format.lower()
+    return os.path.join(QR_CODES_DIR, f"invite_{invite_code}.{extension}")
+
+
+def _qr_cache_put(invite_code, format, image_bytes) -> None:
+    key = (invite_code, format.upper())
+    with _qr_cache_lock:
+        _qr_cache[key] = image_bytes
+        _qr_cache.move_to_end(key)
+        while len(_qr_cache) > QR_CACHE_MAX_ENTRIES:
+            _qr_cache.popitem(last=False)
+
+
+def _store_qr_image(invite_code, format, image_bytes) -> str:
+    """Положить QR в кэш памяти и в папку qr_codes; возвращает путь к файлу"""
+    _qr_cache_put(invite_code, format, image_bytes)
+    qr_filepath = _qr_filepath(invite_code, format)
+    os.makedirs(QR_CODES_DIR, exist_ok=True)
+    tmp_path = f"{qr_filepath}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(image_bytes)
+    os.replace(tmp_path, qr_filepath)
+    return qr_filepath
+
+
+def _is_invite_pending(invite_code) -> bool:
+    """Приглашение ещё не использовано и не удалено (для него можно выдавать QR)"""
+    with _invites_lock:
+        invite_data = load_invites_data()["invites"].get(invite_code)
+        return invite_data is not None and not invite_data.get("used")
+
+
+def get_qr_image(invite_code, format='PNG'):
+    """
+    QR код приглашения: из памяти, затем из папки qr_codes, иначе отрисовка
+    :return: байты изображения или None, если приглашение использовано, удалено или не существует
+    """
+    # Иначе запрос после invalidate_qr_cache отрисовал бы и снова закэшировал QR
+    if not _is_invite_pending(invite_code):
+        return None
+    
+    key = (invite_code, format.upper())
+    with _qr_cache_lock:
+        image_bytes = _qr_cache.get(key)
+        if image_bytes is not None:
+            _qr_cache.move_to_end(key)
+            return image_bytes
+    
+    qr_filepath = _qr_filepath(invite_code, format)
+    try:
+        with open(qr_filepath, 'rb') as f:
+            image_bytes = f.read()
+    except OSError:
+        image_bytes = None
+    if image_bytes:
+        _qr_cache_put(invite_code, format, image_bytes)
+        return image_bytes
+    
+    image_bytes = render_qr_image(get_invite_url(invite_code), format)
+    # Приглашение могло быть использовано или удалено, пока QR отрисовывался
+    with _invites_lock:
+        if not _is_invite_pending(invite_code):
+            return None
+        _store_qr_image(invite_code, format, image_bytes)
+    return image_bytes
+
+
+def invalidate_qr_cache(invite_code) -> None:
+    """Удалить QR приглашения из кэша памяти и файлы из qr_codes (все форматы)"""
+    with _qr_cache_lock:
+        for format in QR_CACHE_FORMATS:
+            _qr_cache.pop((invite_code, format), None)
+    for format in QR_CACHE_FORMATS:
+        qr_filepath = _qr_filepath(invite_code, format)
+        try:
+            os.remove(qr_filepath)
+        except OSError:
+            pass
+
+
+def generate_qr_code(invite_code, format='PNG'):
+    """
+    Генерировать QR код для приглашения (повторные вызовы берут готовое изображение из кэша)
+    :param invite_code: Код приглашения
+    :param format: Формат изображения ('PNG', 'JPEG')
+    :return: Base64 encoded изображение или путь к файлу; None, если приглашение
+             использовано, удалено или не существует
+    """
+    invite_url = get_invite_url(invite_code)
+    image_bytes = get_qr_image(invite_code, format)
+    if image_bytes is None:
+        return None
+    qr_filepath = _qr_filepath(invite_code, format)
+    qr_filename = os.path.basename(qr_filepath)
+    
+    img_str = base64.b64encode(image_bytes).decode()
     return {
         "base64": f"data:image/{format.lower()};base64,{img_str}",
         "filepath": qr_filepath,
@@ -130,29 +379,90 @@ def generate_qr_code(invite_code, format='PNG'):
         "url": invite_url
     }
 
+
+def render_invite_qr_codes(invites, format='PNG'):
+    """
+    Отрисовать QR коды пакета приглашений (большие пакеты — параллельно в процессах)
+    :param invites: Список данных приглашений (code, role)
+    :return: dict {invite_code: байты изображения}
+    """
+    codes = [invite["code"] for invite in invites]
+    urls = [get_invite_url(invite["code"], invite.get("role")) for invite in invites]
+    formats = [format] * len(urls)
+    
+    images = None
+    if len(urls) >= QR_RENDER_PARALLEL_THRESHOLD and QR_RENDER_MAX_WORKERS > 1:
+        try:
+            import multiprocessing
+            # spawn: процесс бота многопоточный, fork в нём небезопасен
+            context = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(max_workers=QR_RENDER_MAX_WORKERS, mp_context=context) as pool:
+                chunksize = max(1, len(urls) // (QR_RENDER_MAX_WORKERS * 4))
+                images = list(pool.map(render_qr_image, urls, formats, chunksize=chunksize))
+        except Exception as e:
+            print(f"⚠️ Параллельная отрисовка QR недоступна, рисуем последовательно: {e}")
+            images = None
+    if images is None:
+        images = [render_qr_image(url, format) for url in urls]
+    for invite_code, image_bytes in zip(codes, images):
+        _store_qr_image(invite_code, format, image_bytes)
+    return dict(zip(codes, images))
+
+
+def create_invite_sheet(admin_id, role, count, expires_hours=168, note="", filename=None):
+    """
+    Создать пакет приглашений и печатный PDF лист с их QR кодами
+    :param filename: Путь к PDF (по умолчанию data/photos/qr_codes/invites_<дата>.pdf)
+    :return: dict с приглашениями и путём к PDF
+    """
+    result = create_invites_batch(admin_id, role, count, expires_hours, note)
+    if not result["success"]:
+        return result
+    invites = result["invites"]
+    
+    images = render_invite_qr_codes(invites)
+    
+    if filename is None:
+        os.makedirs(QR_CODES_DIR, exist_ok=True)
+        filename = os.path.join(
+            QR_CODES_DIR,
+            f"invites_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{invites[0]['number']}.pdf"
+        )
+    
+    from bot.pdf_generator import create_invite_qr_sheet_pdf
+    entries = [dict(invite, role_name=ROLES.get(invite["role"], invite["role"]),
+                    qr_image=images[invite["code"]]) for invite in invites]
+    if not create_invite_qr_sheet_pdf(entries, filename):
+        return {"success": False, "error": "Не удалось создать PDF лист", "invites": invites}
+    
+    return {"success": True, "invites": invites, "pdf_path": filename}
+
 def validate_invite(invite_code):
     """
     Валидировать приглашение
     :param invite_code: Код приглашения
     :return: dict с результатом валидации
     """
-    invites_data = load_invites_data()
-    
-    if invite_code not in invites_data["invites"]:
-        return {"valid": False, "error": "Приглашение не найдено"}
-    
-    invite_data = invites_data["invites"][invite_code]
-    
-    # Проверяем что приглашение не использовано
-    if invite_data["used"]:
-        return {"valid": False, "error": "Приглашение уже использовано"}
-    
-    # Проверяем срок действия
-    expires_at = datetime.fromisoformat(invite_data["expires_at"])
-    if datetime.now() > expires_at:
-        return {"valid": False, "error": "Срок действия приглашения истек"}
-    
-    return {"valid": True, "data": invite_data}
+    with _invites_lock:
+        invites_data = load_invites_data()
+        invite_data = invites_data["invites"].get(invite_code)
+        
+        if invite_data is None:
+            if invite_code in invites_data["used_invites"]:
+                if invites_data["used_invites"][invite_code].get("expired"):
+                    return {"valid": False, "error": "Срок действия приглашения истек"}
+                return {"valid": False, "error": "Приглашение уже использовано"}
+            return {"valid": False, "error": "Приглашение не найдено"}
+        
+        # Проверяем что приглашение не использовано
+        if invite_data["used"]:
+            return {"valid": False, "error": "Приглашение уже использовано"}
+        
+        # Проверяем срок действия
+        if datetime.now().timestamp() > _invite_expiry.get(invite_code, 0.0):
+            return {"valid": False, "error": "Срок действия приглашения истек"}
+        
+        return {"valid": True, "data": dict(invite_data)}
 
 def use_invite(invite_code, telegram_id, username, first_name, last_name):
     """
@@ -184,7 +494,21 @@ def use_invite(invite_code, telegram_id, username, first_name, last_name):
     set_user_role(telegram_id, role)
     
     # Отмечаем приглашение как использованное
+    with _invites_lock:
+        _mark_invite_used(invite_code, telegram_id, username, first_name, last_name)
+    
+    return {
+        "success": True,
+        "message": f"Добро пожаловать! Вам назначена роль: {ROLES[role]}",
+        "role": role,
+        "role_name": ROLES[role]
+    }
+
+
+def _mark_invite_used(invite_code, telegram_id, username, first_name, last_name):
     invites_data = load_invites_data()
+    if invite_code not in invites_data["invites"]:
+        return
     invites_data["invites"][invite_code]["used"] = True
     invites_data["invites"][invite_code]["used_at"] = datetime.now().isoformat()
     invites_data["invites"][invite_code]["used_by"] = {
@@ -197,15 +521,10 @@ def use_invite(invite_code, telegram_id, username, first_name, last_name):
     # Перемещаем в использованные приглашения
     invites_data["used_invites"][invite_code] = invites_data["invites"][invite_code]
     del invites_data["invites"][invite_code]
+    _invite_expiry.pop(invite_code, None)
     
     save_invites_data(invites_data)
-    
-    return {
-        "success": True,
-        "message": f"Добро пожаловать! Вам назначена роль: {ROLES[role]}",
-        "role": role,
-        "role_name": ROLES[role]
-    }
+    invalidate_qr_cache(invite_code)
 
 def get_active_invites(admin_id=None):
     """
@@ -213,39 +532,49 @@ def get_active_invites(admin_id=None):
     :param admin_id: ID администратора (если указан, только его приглашения)
     :return: список активных приглашений
     """
-    invites_data = load_invites_data()
     active_invites = []
     
-    now = datetime.now()
-    
-    for code, invite_data in invites_data["invites"].items():
-        # Пропускаем использованные
-        if invite_data["used"]:
-            continue
-            
-        # Пропускаем истекшие
-        expires_at = datetime.fromisoformat(invite_data["expires_at"])
-        if now > expires_at:
-            continue
-            
-        # Фильтруем по админу если указан
-        if admin_id and invite_data["admin_id"] != admin_id:
-            continue
-            
-        active_invites.append(invite_data)
+    now = datetime.now().timestamp()
+    
+    # Фоновая очистка меняет общий словарь из другого потока — читаем под блокировкой
+    # и отдаём копии записей
+    with _invites_lock:
+        invites_data = load_invites_data()
+        for code, invite_data in invites_data["invites"].items():
+            # Пропускаем использованные
+            if invite_data["used"]:
+                continue
+                
+            # Пропускаем истекшие
+            if now > _invite_expiry.get(code, 0.0):
+                continue
+                
+            # Фильтруем по админу если указан
+            if admin_id and invite_data["admin_id"] != admin_id:
+                continue
+                
+            active_invites.append(dict(invite_data))
     
     return active_invites
 
-def get_used_invites(admin_id=None):
+def get_used_invites(admin_id=None, include_archived=False):
     """
     Получить использованные приглашения
     :param admin_id: ID администратора (если указан, только его приглашения)
+    :param include_archived: Добавить приглашения из архивного файла
     :return: список использованных приглашений
     """
-    invites_data = load_invites_data()
     used_invites = []
     
-    for code, invite_data in invites_data["used_invites"].items():
+    sources = []
+    if include_archived:
+        sources.append(_read_json(INVITES_ARCHIVE_FILE, ("invites",))["invites"])
+    # Снимок под блокировкой: фоновая очистка переносит записи из другого потока
+    with _invites_lock:
+        sources.append({code: dict(invite_data)
+                        for code, invite_data in load_invites_data()["used_invites"].items()})
+    
+    for code, invite_data in (item for source in sources for item in source.items()):
         # Фильтруем по админу если указан
         if admin_id and invite_data["admin_id"] != admin_id:
             continue
@@ -261,6 +590,11 @@ def delete_invite(invite_code, admin_id):
     :param admin_id: ID администратора
     :return: dict с результатом
     """
+    with _invites_lock:
+        return _delete_invite(invite_code, admin_id)
+
+
+def _delete_invite(invite_code, admin_id):
     invites_data = load_invites_data()
     
     if invite_code not in invites_data["invites"]:
@@ -274,83 +608,181 @@ def delete_invite(invite_code, admin_id):
     
     # Удаляем приглашение
     del invites_data["invites"][invite_code]
+    _invite_expiry.pop(invite_code, None)
     save_invites_data(invites_data)
     
-    # Удаляем QR код файл если существует
-    qr_filename = f"invite_{invite_code}.png"
-    qr_filepath = os.path.join(PHOTOS_DIR, "qr_codes", qr_filename)
-    if os.path.exists(qr_filepath):
-        os.remove(qr_filepath)
+    # Удаляем QR код из кэша и файлы
+    invalidate_qr_cache(invite_code)
     
     return {"success": True, "message": "Приглашение удалено"}
 
 def cleanup_expired_invites():
-    """Очистить истекшие приглашения"""
-    invites_data = load_invites_data()
-    
-    now = datetime.now()
-    expired_codes = []
-    
-    for code, invite_data in invites_data["invites"].items():
-        expires_at = datetime.fromisoformat(invite_data["expires_at"])
-        if now > expires_at:
+    """
+    Очистить истекшие приглашения
+    Из кучи сроков извлекаются только наступившие — остальные коды не проверяются.
+    """
+    with _invites_lock:
+        invites_data = load_invites_data()
+        
+        now = datetime.now().timestamp()
+        expired_codes = []
+        
+        while _invite_expiry_heap and _invite_expiry_heap[0][0] < now:
+            expires_at, code = heapq.heappop(_invite_expiry_heap)
+            # Устаревшая запись кучи: приглашение уже использовано или удалено
+            if _invite_expiry.get(code) != expires_at or code not in invites_data["invites"]:
+                continue
             expired_codes.append(code)
+        
+        # Перемещаем истекшие в отдельную категорию для истории
+        for code in expired_codes:
+            invite_data = invites_data["invites"][code]
+            invite_data["expired"] = True
+            invites_data["used_invites"][code] = invite_data
+            del invites_data["invites"][code]
+            _invite_expiry.pop(code, None)
+        
+        if expired_codes:
+            save_invites_data(invites_data)
     
-    # Перемещаем истекшие в отдельную категорию для истории
     for code in expired_codes:
-        invite_data = invites_data["invites"][code]
-        invite_data["expired"] = True
-        invites_data["used_invites"][code] = invite_data
-        del invites_data["invites"][code]
-    
-    if expired_codes:
-        save_invites_data(invites_data)
+        invalidate_qr_cache(code)
     
     return len(expired_codes)
 
+
+def _archived_at(invite_data) -> Optional[datetime]:
+    """Момент, с которого приглашение стало историей (использовано или истекло)"""
+    for key in ("used_at", "expires_at"):
+        try:
+            return datetime.fromisoformat(invite_data[key])
+        except (KeyError, TypeError, ValueError):
+            continue
+    return None
+
+
+def compact_used_invites(older_than_days=INVITE_ARCHIVE_AFTER_DAYS):
+    """
+    Перенести старые использованные и истекшие приглашения в архивный файл
+    Для статистики в архиве ведутся счётчики по администраторам, поэтому
+    get_invite_stats не читает архивные записи.
+    :return: количество перенесённых приглашений
+    """
+    cutoff = datetime.now() - timedelta(days=older_than_days)
+    with _invites_lock:
+        invites_data = load_invites_data()
+        moved = {}
+        for code, invite_data in invites_data["used_invites"].items():
+            archived_at = _archived_at(invite_data)
+            if archived_at is not None and archived_at < cutoff:
+                moved[code] = invite_data
+        if not moved:
+            return 0
+
+        archive = _read_json(INVITES_ARCHIVE_FILE, ("invites", "stats"))
+        for code, invite_data in moved.items():
+            archive["invites"][code] = invite_data
+            counters = archive["stats"].setdefault(str(invite_data.get("admin_id")), {
+                "total_created": 0, "used_invites": 0, "expired_invites": 0
+            })
+            if not invite_data.get("used"):
+                counters["total_created"] += 1
+            if invite_data.get("expired"):
+                counters["expired_invites"] += 1
+            else:
+                counters["used_invites"] += 1
+        # Сначала архив, затем основной файл: при сбое запись окажется в обоих, но не потеряется
+        _write_json_atomic(INVITES_ARCHIVE_FILE, archive)
+
+        for code in moved:
+            del invites_data["used_invites"][code]
+        save_invites_data(invites_data)
+        return len(moved)
+
+
+def _get_archived_stats(admin_id=None) -> Dict[str, int]:
+    totals = {"total_created": 0, "used_invites": 0, "expired_invites": 0}
+    if not os.path.exists(INVITES_ARCHIVE_FILE):
+        return totals
+    stats = _read_json(INVITES_ARCHIVE_FILE, ("stats",))["stats"]
+    for stats_admin_id, counters in stats.items():
+        if admin_id and stats_admin_id != str(admin_id):
+            continue
+        for key in totals:
+            totals[key] += counters.get(key, 0)
+    return totals
+
+
+async def start_invite_sweeper_job(application):
+    """Периодически убирает истекшие приглашения и коды привязки, раз в сутки переносит старые в архив."""
+    from bot.account_linking import cleanup_expired_codes
+
+    print("🎟️ Задача очистки приглашений запущена.")
+    last_compaction = 0.0
+    while True:
+        try:
+            expired = await asyncio.to_thread(cleanup_expired_invites)
+            expired_codes = await asyncio.to_thread(cleanup_expired_codes)
+            if expired or expired_codes:
+                print(f"🎟️ Истекло приглашений: {expired}, кодов привязки: {expired_codes}")
+
+            now = datetime.now().timestamp()
+            if now - last_compaction >= INVITE_COMPACTION_INTERVAL_SECONDS:
+                last_compaction = now
+                moved = await asyncio.to_thread(compact_used_invites)
+                if moved:
+                    print(f"🎟️ Перенесено приглашений в архив: {moved}")
+        except asyncio.CancelledError:
+            print("⏹️ Задача очистки приглашений остановлена.")
+            break
+        except Exception as e:
+            print(f"❌ Ошибка в задаче очистки приглашений: {e}")
+        await asyncio.sleep(INVITE_SWEEP_INTERVAL_SECONDS)
+
 def get_invite_stats(admin_id=None):
     """
     Получить статистику приглашений
     :param admin_id: ID администратора (если указан, только его статистика)
     :return: dict со статистикой
     """
-    invites_data = load_invites_data()
-    
-    total_created = 0
+    archived = _get_archived_stats(admin_id)
+    total_created = archived["total_created"]
     active_invites = 0
-    used_invites = 0
-    expired_invites = 0
-    
-    now = datetime.now()
-    
-    # Считаем активные приглашения
-    for code, invite_data in invites_data["invites"].items():
-        if admin_id and invite_data["admin_id"] != admin_id:
-            continue
+    used_invites = archived["used_invites"]
+    expired_invites = archived["expired_invites"]
+    
+    now = datetime.now().timestamp()
+    
+    # Фоновая очистка меняет общий словарь из другого потока — считаем под блокировкой
+    with _invites_lock:
+        invites_data = load_invites_data()
+        # Считаем активные приглашения
+        for code, invite_data in invites_data["invites"].items():
+            if admin_id and invite_data["admin_id"] != admin_id:
+                continue
             
-        total_created += 1
+            total_created += 1
         
-        if invite_data["used"]:
-            continue
+            if invite_data["used"]:
+                continue
             
-        expires_at = datetime.fromisoformat(invite_data["expires_at"])
-        if now > expires_at:
-            expired_invites += 1
-        else:
-            active_invites += 1
-    
-    # Считаем использованные приглашения
-    for code, invite_data in invites_data["used_invites"].items():
-        if admin_id and invite_data["admin_id"] != admin_id:
-            continue
+            if now > _invite_expiry.get(code, 0.0):
+                expired_invites += 1
+            else:
+                active_invites += 1
+    
+        # Считаем использованные приглашения
+        for code, invite_data in invites_data["used_invites"].items():
+            if admin_id and invite_data["admin_id"] != admin_id:
+                continue
             
-        if not invite_data.get("used"):
-            total_created += 1
+            if not invite_data.get("used"):
+                total_created += 1
             
-        if invite_data.get("expired"):
-            expired_invites += 1
-        else:
-            used_invites += 1
+            if invite_data.get("expired"):
+                expired_invites += 1
+            else:
+                used_invites += 1
     
     return {
         "total_created": total_created,
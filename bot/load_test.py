@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест обработки обновлений
+Обновления проходят через настоящий Application.process_update с тем же
+PerUserUpdateProcessor, что и в боте; запросы к Telegram API перехватывает
+заглушка (_StubRequest), поэтому тест не требует сети и токена.
+
+Несколько пользователей запускают тяжёлые выгрузки — реальную генерацию Excel
+(write_export_excel) и многостраничного PDF (create_multi_dse_pdf_report) в пуле
+потоков с отправкой документа, остальные нажимают кнопку главного меню, которую
+обрабатывает настоящий button_handler. Сравнивается задержка button_handler
+(p50/p99) при последовательной обработке (как было) и при PerUserUpdateProcessor,
+а также проверяется, что обновления одного пользователя обрабатываются по порядку.
+
+Запуск: python bot/load_test.py [--heavy-users 4] [--light-users 50] [--presses 20]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+# Добавляем корневую директорию проекта в sys.path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from telegram import Update
+from telegram.ext import ApplicationBuilder, BaseRateLimiter, CallbackQueryHandler
+from telegram.request import BaseRequest
+
+from bot.update_processor import PerUserUpdateProcessor, MAX_CONCURRENT_UPDATES
+from bot.commands import button_handler, write_export_excel
+from bot.pdf_generator import create_multi_dse_pdf_report
+
+# Кнопка, которую нажимают лёгкие пользователи (обрабатывается button_handler)
+LIGHT_CALLBACK_DATA = 'back_to_main'
+# Кнопка тяжёлой выгрузки (обрабатывается отдельным обработчиком теста)
+HEAVY_CALLBACK_DATA = 'load_test_export'
+
+# ID пользователей теста не пересекаются с реальными Telegram ID
+USER_ID_BASE = 9_000_000_000
+
+
+class _StubRequest(BaseRequest):
+    """Заглушка HTTP запросов к Telegram API: отвечает сразу, с задержкой сети api_latency"""
+
+    def __init__(self, api_latency: float = 0.0):
+        self.api_latency = api_latency
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=BaseRequest.DEFAULT_NONE,
+                         write_timeout=BaseRequest.DEFAULT_NONE, connect_timeout=BaseRequest.DEFAULT_NONE,
+                         pool_timeout=BaseRequest.DEFAULT_NONE):
+        if self.api_latency:
+            await asyncio.sleep(self.api_latency)
+
+        endpoint = url.rsplit('/', 1)[-1]
+        parameters = request_data.parameters if request_data else {}
+        if endpoint == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'LoadTest', 'username': 'load_test_bot'}
+        elif endpoint.startswith(('send', 'edit')):
+            chat_id = int(parameters.get('chat_id') or 1)
+            result = {'message_id': 1, 'date': int(time.time()),
+                      'chat': {'id': chat_id, 'type': 'private'}, 'text': ''}
+        else:
+            result = True
+        return 200, json.dumps({'ok': True, 'result': result}).encode('utf-8')
+
+
+class _PassThroughRateLimiter(BaseRateLimiter):
+    """
+    Пропускает запросы без ограничений: обработчики передают rate_limit_args,
+    а лимиты Telegram (SendScheduler) в этом тесте не измеряются
+    """
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        return await callback(*args, **kwargs)
+
+
+def _percentile(values, percent: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _synthetic_records(count: int) -> list:
+    """Записи ДСЕ для выгрузки (без фото — измеряется генерация документов, а не диск)"""
+    rng = random.Random(count)
+    records = []
+    for i in range(count):
+        records.append({
+            'dse': f"ДСЕ-{rng.randint(1000, 9999)}",
+            'dse_name': f"Деталь {i}",
+            'problem_type': 'Замечание по обработке',
+            'rc': '11102',
+            'machine_number': str(rng.randint(1, 40)),
+            'installer_fio': 'Иванов И.И.',
+            'programmer_name': 'Петров П.П.',
+            'description': "Описание проблемы. " * rng.randint(5, 30),
+            'datetime': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'user_id': str(USER_ID_BASE),
+        })
+    return records
+
+
+def _callback_update(update_id: int, user_id: int, data: str, bot) -> Update:
+    """Нажатие inline кнопки в личном чате пользователя"""
+    return Update.de_json({
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f"User{user_id}"},
+            'chat_instance': str(user_id),
+            'data': data,
+            'message': {
+                'message_id': 1,
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'text': 'menu',
+            },
+        },
+    }, bot)
+
+
+async def run_scenario(max_concurrent: int, heavy_users: int, light_users: int,
+                       presses: int, records_count: int, api_latency: float) -> dict:
+    application = (
+        ApplicationBuilder()
+        .token('1:LOAD_TEST')
+        .request(_StubRequest(api_latency))
+        .get_updates_request(_StubRequest())
+        .rate_limiter(_PassThroughRateLimiter())
+        .concurrent_updates(PerUserUpdateProcessor(max_concurrent))
+        .build()
+    )
+
+    records = _synthetic_records(records_count)
+    submitted = {}
+    latencies = []
+    heavy_durations = []
+    order = {}
+
+    async def heavy_export(update, context):
+        """Выгрузка: Excel и PDF генерируются в пуле потоков, как в обработчиках бота"""
+        started = time.perf_counter()
+        with tempfile.TemporaryDirectory(prefix='load_test_') as tmp_dir:
+            excel_file = os.path.join(tmp_dir, 'export.xlsx')
+            pdf_file = os.path.join(tmp_dir, 'export.pdf')
+            await asyncio.to_thread(write_export_excel, records, excel_file)
+            await asyncio.to_thread(create_multi_dse_pdf_report, records, pdf_file,
+                                    {'include_photos': False})
+            for path in (excel_file, pdf_file):
+                with open(path, 'rb') as f:
+                    await context.bot.send_document(chat_id=update.effective_chat.id, document=f,
+                                                    filename=os.path.basename(path))
+        heavy_durations.append(time.perf_counter() - started)
+
+    async def timed_button_handler(update, context):
+        await button_handler(update, context)
+        latencies.append(time.perf_counter() - submitted[update.update_id])
+        order.setdefault(update.effective_user.id, []).append(update.update_id)
+
+    application.add_handler(CallbackQueryHandler(heavy_export, pattern=f'^{HEAVY_CALLBACK_DATA}$'))
+    application.add_handler(CallbackQueryHandler(timed_button_handler))
+
+    update_ids = iter(range(1, 10 ** 9))
+    tasks = []
+
+    def submit(user_id: int, data: str):
+        # Application создаёт задачу на каждое обновление в порядке поступления
+        update = _callback_update(next(update_ids), user_id, data, application.bot)
+        submitted[update.update_id] = time.perf_counter()
+        tasks.append(asyncio.create_task(
+            application.update_processor.process_update(update, application.process_update(update))))
+
+    async with application:
+        for user_id in range(USER_ID_BASE, USER_ID_BASE + heavy_users):
+            submit(user_id, HEAVY_CALLBACK_DATA)
+
+        rng = random.Random(42)
+        light_ids = range(USER_ID_BASE + heavy_users, USER_ID_BASE + heavy_users + light_users)
+        for _ in range(presses):
+            for user_id in light_ids:
+                submit(user_id, LIGHT_CALLBACK_DATA)
+            await asyncio.sleep(rng.uniform(0.005, 0.02))
+
+        await asyncio.gather(*tasks)
+
+    ordered = all(ids == sorted(ids) for ids in order.values())
+    return {
+        'p50': _percentile(latencies, 50),
+        'p99': _percentile(latencies, 99),
+        'max': max(latencies),
+        'count': len(latencies),
+        'heavy': max(heavy_durations) if heavy_durations else 0.0,
+        'ordered': ordered,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Нагрузочный тест обработки обновлений")
+    parser.add_argument('--heavy-users', type=int, default=4)
+    parser.add_argument('--light-users', type=int, default=50)
+    parser.add_argument('--presses', type=int, default=20)
+    parser.add_argument('--records', type=int, default=300,
+                        help="Записей ДСЕ в каждой тяжёлой выгрузке")
+    parser.add_argument('--api-latency', type=float, default=0.02,
+                        help="Имитируемая задержка ответа Telegram API, секунды")
+    parser.add_argument('--skip-sequential', action='store_true',
+                        help="Не запускать последовательный режим (он заметно дольше)")
+    args = parser.parse_args()
+
+    scenarios = [('Параллельно (по пользователям)', MAX_CONCURRENT_UPDATES)]
+    if not args.skip_sequential:
+        scenarios.insert(0, ('Последовательно', 1))
+
+    print(f"Тяжёлых выгрузок: {args.heavy_users} × {args.records} записей (Excel + PDF), "
+          f"нажатий: {args.light_users} × {args.presses}")
+    for title, limit in scenarios:
+        result = asyncio.run(run_scenario(limit, args.heavy_users, args.light_users, args.presses,
+                                          args.records, args.api_latency))
+        print(f"{title:32} button_handler p50={result['p50'] * 1000:8.1f} мс  "
+              f"p99={result['p99'] * 1000:8.1f} мс  max={result['max'] * 1000:8.1f} мс  "
+              f"выгрузка={result['heavy']:.1f} с  "
+              f"порядок {'сохранён' if result['ordered'] else 'НАРУШЕН'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Notification Client - общий клиент Telegram для внеполосных уведомлений
+Один экземпляр Bot (и один пул HTTP соединений) на процесс. Уведомления можно
+отправлять из потока бота и из потока веб-интерфейса без создания нового
+Application, потока или цикла событий на каждый вызов.
+"""
+import asyncio
+import os
+import sys
+import threading
+from concurrent.futures import Future
+
+# Добавляем корневую директорию проекта в sys.path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from bot.send_scheduler import PRIORITY_NOTIFICATION
+
+_lock = threading.Lock()
+_bot = None
+_loop = None
+
+
+def attach_application(application) -> None:
+    """
+    Подключить клиент к уже запущенному Application (вызывается из post_init).
+    После этого уведомления отправляются через бот приложения в его цикле событий.
+    """
+    global _bot, _loop
+    with _lock:
+        _bot = application.bot
+        _loop = asyncio.get_running_loop()
+
+
+def _start_standalone() -> None:
+    """Создать собственный Bot и фоновый цикл событий (однократно, если бот не запущен в процессе)"""
+    global _bot, _loop
+    from telegram.ext import ExtBot
+    from config.config import BOT_TOKEN
+    from bot.send_scheduler import SendScheduler
+
+    loop = asyncio.new_event_loop()
+    bot = ExtBot(token=BOT_TOKEN, rate_limiter=SendScheduler())
+
+    def _run_loop():
+        asyncio.set_event_loop(loop)
+        loop.run_forever()
+
+    thread = threading.Thread(target=_run_loop, name="notification-client", daemon=True)
+    thread.start()
+    asyncio.run_coroutine_threadsafe(bot.initialize(), loop).result()
+
+    _bot = bot
+    _loop = loop
+
+
+def _get_client():
+    """Вернуть (bot, loop), при необходимости запустив автономный клиент"""
+    with _lock:
+        if _bot is None or _loop is None or _loop.is_closed():
+            _start_standalone()
+        return _bot, _loop
+
+
+async def _send_many(bot, chat_ids, text: str, kwargs: dict) -> int:
+    sent = 0
+    kwargs.setdefault('rate_limit_args', PRIORITY_NOTIFICATION)
+    for chat_id in chat_ids:
+        try:
+            await bot.send_message(chat_id=int(chat_id), text=text, **kwargs)
+            sent += 1
+        except Exception as e:
+            print(f"⚠️ Не удалось отправить уведомление {chat_id}: {e}")
+    return sent
+
+
+def notify_many(chat_ids, text: str, **kwargs) -> Future:
+    """
+    Поставить отправку сообщения нескольким получателям в очередь.
+    Не блокирует вызывающий поток.
+
+    Args:
+        chat_ids: Список Telegram ID получателей
+        text: Текст сообщения
+        **kwargs: Дополнительные параметры send_message
+
+    Returns:
+        Future: Завершается количеством успешно отправленных сообщений
+    """
+    bot, loop = _get_client()
+    return asyncio.run_coroutine_threadsafe(_send_many(bot, list(chat_ids), text, kwargs), loop)
+
+
+def notify(chat_id, text: str, **kwargs) -> Future:
+    """Поставить отправку сообщения одному получателю в очередь"""
+    return notify_many([chat_id], text, **kwargs)
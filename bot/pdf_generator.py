@@ -4,25 +4,25 @@ PDF Generator для создания отчетов по заявкам ДСЕ
 Использует шаблон таблицы как на изображении пользователя
 """
 
-from reportlab.lib.pagesizes import A4
-from reportlab.lib import colors
-from reportlab.lib.units import mm, inch
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.platypus.flowables import Image
+import asyncio
 import os
+import sys
+import tempfile
 from datetime import datetime
 
-# Регистрируем поддержку UTF-8
-import sys
-import io
-sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+# reportlab импортируется внутри функций построения отчёта: модуль также содержит
+# обработчики меню экспорта, и их открытие не должно загружать библиотеку PDF
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from bot.send_scheduler import PRIORITY_BULK
 
 
 class DSEPDFGenerator:
     def __init__(self):
+        from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+        from reportlab.pdfbase import pdfmetrics
+        from reportlab.pdfbase.ttfonts import TTFont
+
         # Попробуем зарегистрировать русский шрифт
         try:
             # Попробуем разные пути к шрифтам
@@ -98,7 +98,12 @@ class DSEPDFGenerator:
         :return: True если успешно, False если ошибка
         """
         try:
-            from reportlab.lib.pagesizes import landscape
+            from reportlab.lib import colors
+            from reportlab.lib.pagesizes import A4, landscape
+            from reportlab.lib.styles import ParagraphStyle
+            from reportlab.lib.units import mm
+            from reportlab.pdfbase import pdfmetrics
+            from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
             
             # Создаем документ в альбомной ориентации
             doc = SimpleDocTemplate(
@@ -287,19 +292,50 @@ def create_dse_pdf_report(record_data, filename=None):
     Удобная функция для создания PDF отчета
     
     :param record_data: Данные записи
-    :param filename: Имя файла (опционально)
+    :param filename: Имя файла (опционально; по умолчанию — уникальный временный файл,
+                     который вызывающий код удаляет после отправки)
     :return: Имя созданного файла или None при ошибке
     """
-    if not filename:
+    is_temp = not filename
+    if is_temp:
         dse = record_data.get('dse', 'unknown').replace('/', '_')
         date_str = record_data.get('datetime', '').split()[0].replace('-', '') if record_data.get('datetime') else 'unknown'
-        filename = f"dse_report_{dse}_{date_str}.pdf"
+        # Одновременные отчёты по одной ДСЕ не должны писать в один и тот же файл
+        fd, filename = tempfile.mkstemp(prefix=f"dse_report_{dse}_{date_str}_", suffix='.pdf')
+        os.close(fd)
     
     generator = DSEPDFGenerator()
     
     if generator.create_dse_report(record_data, filename):
         return filename
     else:
+        if is_temp and os.path.exists(filename):
+            os.remove(filename)
+        return None
+
+
+def _photo_flowable(record_data, max_width, max_height):
+    """
+    Фото заявки для вставки в PDF (копия 'pdf' из хранилища фото, а не оригинал)
+
+    Оригинал встраивается, только если он не больше копии 'pdf'; если уменьшенную
+    копию создать не удалось, фото пропускается, чтобы не раздувать PDF.
+
+    :return: Image flowable или None, если фото нет
+    """
+    from reportlab.lib.utils import ImageReader
+    from reportlab.platypus import Image as RLImage
+    from bot.photo_store import get_record_photo_path
+
+    photo_path = get_record_photo_path(record_data, 'pdf', allow_original=False)
+    if not photo_path:
+        return None
+    try:
+        width, height = ImageReader(photo_path).getSize()
+        scale = min(max_width / width, max_height / height, 1.0)
+        return RLImage(photo_path, width=width * scale, height=height * scale)
+    except Exception as e:
+        print(f"Не удалось добавить фото в PDF: {e}")
         return None
 
 
@@ -316,8 +352,11 @@ def create_single_dse_pdf_report(record_data, filename, options=None):
         options = {}
     
     try:
+        from reportlab.lib import colors
         from reportlab.lib.pagesizes import A4, A3, LETTER, landscape, portrait
-        from reportlab.platypus import PageBreak, Image as RLImage
+        from reportlab.lib.styles import ParagraphStyle
+        from reportlab.lib.units import mm
+        from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
         
         print(f"Creating single DSE PDF: {filename} for {record_data.get('dse', 'N/A')}")
         
@@ -408,6 +447,13 @@ def create_single_dse_pdf_report(record_data, filename, options=None):
             story.append(desc_para)
             story.append(Spacer(1, 10*mm))
         
+        # Фото
+        if options.get('include_photos', True):
+            photo = _photo_flowable(record_data, 170*mm, 120*mm)
+            if photo is not None:
+                story.append(photo)
+                story.append(Spacer(1, 10*mm))
+        
         # Футер с информацией о создании
         if options.get('include_timestamp', True):
             footer_style = ParagraphStyle(
@@ -455,8 +501,12 @@ def create_multi_dse_pdf_report(records_list, filename, options=None):
         options = {}
     
     try:
+        from reportlab.lib import colors
         from reportlab.lib.pagesizes import A4, A3, LETTER, landscape, portrait
-        from reportlab.platypus import PageBreak, Image as RLImage
+        from reportlab.lib.styles import ParagraphStyle
+        from reportlab.lib.units import mm
+        from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+        from reportlab.platypus import PageBreak
         
         print(f"Creating multi-DSE PDF: {filename} with {len(records_list)} records")
         
@@ -597,6 +647,14 @@ def create_multi_dse_pdf_report(records_list, filename, options=None):
                 story.append(desc_para)
                 story.append(Spacer(1, 8*mm))
             
+            # Фото
+            # Фото в сводном отчёте (выгрузка всех записей, дайджест) — только по запросу
+            if options.get('include_photos', False):
+                photo = _photo_flowable(record_data, 170*mm, 100*mm)
+                if photo is not None:
+                    story.append(photo)
+                    story.append(Spacer(1, 8*mm))
+            
             # Разделитель между записями
             if i < len(records_list):
                 story.append(Spacer(1, 10*mm))
@@ -621,6 +679,71 @@ def create_multi_dse_pdf_report(records_list, filename, options=None):
         return False
 
 
+def create_invite_qr_sheet_pdf(entries, filename, columns=3, rows=4):
+    """
+    Печатный лист QR кодов приглашений (сетка columns x rows на странице A4)
+    
+    :param entries: Список приглашений: qr_image (байты PNG), code, number, role_name, expires_at
+    :param filename: Путь к выходному файлу
+    :return: True если успешно, False если ошибка
+    """
+    try:
+        from io import BytesIO
+        from reportlab.lib.pagesizes import A4
+        from reportlab.lib.units import mm
+        from reportlab.lib.utils import ImageReader
+        from reportlab.pdfgen import canvas
+        
+        generator = DSEPDFGenerator()
+        page_width, page_height = A4
+        margin = 12*mm
+        cell_width = (page_width - 2 * margin) / columns
+        cell_height = (page_height - 2 * margin) / rows
+        caption_height = 16*mm
+        qr_size = min(cell_width, cell_height - caption_height) - 6*mm
+        per_page = columns * rows
+        
+        pdf = canvas.Canvas(filename, pagesize=A4)
+        pdf.setTitle("Приглашения")
+        for index, entry in enumerate(entries):
+            if index and index % per_page == 0:
+                pdf.showPage()
+            position = index % per_page
+            column, row = position % columns, position // columns
+            left = margin + column * cell_width
+            top = page_height - margin - row * cell_height
+            
+            # Линии отреза
+            pdf.setStrokeColorRGB(0.8, 0.8, 0.8)
+            pdf.setDash(2, 2)
+            pdf.rect(left, top - cell_height, cell_width, cell_height)
+            pdf.setDash()
+            
+            pdf.drawImage(ImageReader(BytesIO(entry['qr_image'])),
+                          left + (cell_width - qr_size) / 2, top - 3*mm - qr_size,
+                          width=qr_size, height=qr_size)
+            
+            center = left + cell_width / 2
+            text_top = top - 3*mm - qr_size - 4*mm
+            pdf.setFont(generator.font_bold, 10)
+            pdf.drawCentredString(center, text_top, str(entry.get('code', '')))
+            pdf.setFont(generator.font_name, 8)
+            pdf.drawCentredString(center, text_top - 4*mm,
+                                  f"№ {entry.get('number', '')} · {entry.get('role_name', '')}")
+            expires = str(entry.get('expires_at', ''))[:16].replace('T', ' ')
+            pdf.drawCentredString(center, text_top - 8*mm, f"Действует до {expires}")
+        
+        pdf.save()
+        print(f"Invite QR sheet created: {filename} ({len(entries)} invites)")
+        return os.path.exists(filename) and os.path.getsize(filename) > 0
+        
+    except Exception as e:
+        print(f"Ошибка создания листа QR кодов: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
 async def show_pdf_export_menu(update, context):
     """
     Показать меню экспорта PDF
@@ -678,12 +801,13 @@ async def handle_pdf_export_all(update, context):
         for i, record in enumerate(records[:10], 1):  # Ограничение 10 файлов за раз
             try:
                 filename = f"dse_report_{record.get('dse', 'unknown').replace('/', '_')}_{datetime.now().strftime('%Y%m%d')}.pdf"
-                pdf_file = create_dse_pdf_report(record, filename)
+                pdf_file = await asyncio.to_thread(create_dse_pdf_report, record)
                 
                 if pdf_file and os.path.exists(pdf_file):
                     # Отправляем PDF файл
                     with open(pdf_file, 'rb') as f:
                         await context.bot.send_document(
+                            rate_limit_args=PRIORITY_BULK,
                             chat_id=query.message.chat_id,
                             document=f,
                             filename=filename,
@@ -907,11 +1031,12 @@ async def handle_pdf_export_selected(update, context):
             
             for i, record in enumerate(records[:10]):  # Максимум 10 записей на ДСЕ
                 try:
-                    filename = create_dse_pdf_report(record)
+                    filename = await asyncio.to_thread(create_dse_pdf_report, record)
                     
                     if filename and os.path.exists(filename):
                         with open(filename, 'rb') as pdf_file:
                             await context.bot.send_document(
+                                rate_limit_args=PRIORITY_BULK,
                                 chat_id=query.message.chat_id,
                                 document=pdf_file,
                                 filename=f"DSE_{record.get('dse', 'N/A')}_{record.get('num', i+1)}.pdf",
@@ -6,6 +6,7 @@
 import json
 import os
 import sys
+import threading
 from typing import Dict, List, Set, Optional
 
 # Добавляем корневую директорию проекта в sys.path
@@ -379,6 +380,7 @@ def set_custom_permission(user_id: str, permission: str, value: bool) -> bool:
     
     # Сохраняем
     save_users_data(users_data)
+    refresh_user_permissions(user_id, users_data[user_id])
     return True
 
 
@@ -483,3 +485,107 @@ def check_web_access(user_id: str) -> Dict[str, bool]:
         'terminal': has_permission(user_id, 'use_terminal'),
         'admin_panel': has_permission(user_id, 'admin'),
     }
+
+
+# === ИНДЕКС ПОЛЬЗОВАТЕЛЕЙ ПО ПРАВАМ ===
+# {permission: set(user_id)}. Строится один раз из users_data.json и точечно
+# обновляется при смене роли или индивидуальных прав. Если файл изменён извне
+# (например, веб-интерфейсом), индекс перестраивается по mtime.
+_permission_index: Dict[str, Set[str]] = {}
+_permission_index_mtime: Optional[float] = None
+_permission_index_lock = threading.Lock()
+
+
+def _users_file_mtime() -> Optional[float]:
+    try:
+        return os.path.getmtime(USERS_FILE)
+    except OSError:
+        return None
+
+
+def _evaluate_permission(user_id: str, user_data: Dict, permission: str) -> bool:
+    """
+    Вычислить право по уже загруженной записи пользователя (без чтения файлов).
+    Логика совпадает с has_permission.
+    """
+    if user_id in ADMIN_IDS or str(user_id) in [str(a) for a in ADMIN_IDS]:
+        return True
+
+    role = user_data.get('role', 'user')
+    if role == 'admin':
+        return True
+
+    custom_perms = user_data.get('custom_permissions') or {}
+    if permission in custom_perms:
+        return custom_perms[permission]
+
+    legacy_permissions = user_data.get('permissions', [])
+    if permission in legacy_permissions:
+        return True
+
+    if permission in {'approve_dse_requests', 'view_dse'}:
+        if custom_perms.get('dse_receiver') is True or 'dse_receiver' in legacy_permissions:
+            return True
+
+    if permission not in PERMISSIONS:
+        return False
+    return role in PERMISSIONS[permission]['roles']
+
+
+def _index_user(user_id: str, user_data: Dict) -> None:
+    """Обновить членство одного пользователя во всех множествах индекса"""
+    for permission in PERMISSIONS.keys():
+        members = _permission_index.setdefault(permission, set())
+        if _evaluate_permission(user_id, user_data, permission):
+            members.add(user_id)
+        else:
+            members.discard(user_id)
+
+
+def _rebuild_permission_index() -> None:
+    global _permission_index_mtime
+    from bot.user_manager import get_users_data
+
+    _permission_index.clear()
+    for user_id, user_data in get_users_data().items():
+        if isinstance(user_data, dict):
+            _index_user(str(user_id), user_data)
+    _permission_index_mtime = _users_file_mtime()
+
+
+def refresh_user_permissions(user_id: str, user_data: Optional[Dict] = None) -> None:
+    """
+    Пересчитать права пользователя в индексе после изменения роли или прав.
+
+    Args:
+        user_id: ID пользователя
+        user_data: Актуальная запись пользователя (None — пользователь удалён)
+    """
+    global _permission_index_mtime
+    user_id = str(user_id)
+    with _permission_index_lock:
+        if _permission_index_mtime is None:
+            # Индекс ещё не построен — построится при первом запросе
+            return
+        if user_data is None:
+            for members in _permission_index.values():
+                members.discard(user_id)
+        else:
+            _index_user(user_id, user_data)
+        _permission_index_mtime = _users_file_mtime()
+
+
+def get_users_with_permission(permission: str) -> Set[str]:
+    """
+    Получить множество ID пользователей, обладающих правом
+
+    Args:
+        permission: Название права
+
+    Returns:
+        Копия множества ID пользователей
+    """
+    with _permission_index_lock:
+        if _permission_index_mtime is None or _permission_index_mtime != _users_file_mtime():
+            _rebuild_permission_index()
+        return set(_permission_index.get(permission, set()))
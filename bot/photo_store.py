@@ -0,0 +1,495 @@
+"""
+Photo Store - хранилище фото по хешу содержимого
+- файл хранится один раз: data/photos/store/ab/cd/<sha256>.jpg (два уровня каталогов)
+- фото Telegram скачивается один раз: file_id -> хеш запоминается, повторные
+  обращения (вложение письма, веб-доступ, PDF) используют уже сохранённый файл
+- счётчик ссылок на каждое фото; сборщик мусора удаляет файлы, на которые
+  не ссылается ни одна заявка
+- уменьшенные копии (миниатюра, для PDF, для письма) создаются один раз при
+  получении фото в пуле потоков и лежат рядом с оригиналом: <sha256>_pdf.jpg
+- фото старых заявок (только photo_path, без photo_hash) переносятся в
+  хранилище при первом обращении, чтобы для них тоже были уменьшенные копии
+"""
+import asyncio
+import hashlib
+import json
+import os
+import sys
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Optional, Set
+
+# Добавляем корневую директорию проекта в sys.path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from config.config import DATA_DIR, DATA_FILE, PHOTOS_DIR, load_data, save_data
+
+PHOTO_STORE_DIR = os.path.join(PHOTOS_DIR, "store")
+PHOTO_INDEX_FILE = str(DATA_DIR / "photo_store.json")
+
+# Файлы без ссылок удаляются не раньше, чем через это время (заявка может ещё сохраняться)
+PHOTO_GC_GRACE_SECONDS = 24 * 3600
+
+# Интервал сборки мусора фоновой задачей (секунды)
+PHOTO_GC_INTERVAL_SECONDS = 24 * 3600
+
+# Уменьшенные копии: имя -> (длинная сторона в пикселях, качество JPEG)
+PHOTO_VARIANTS = {
+    'thumb': (320, 70),
+    'pdf': (1200, 80),
+    'email': (1600, 85),
+}
+
+# Потоки для создания уменьшенных копий
+PHOTO_VARIANT_MAX_WORKERS = 2
+
+_lock = threading.RLock()
+_index = None
+_variant_executor = None
+_variant_jobs: Dict[str, Future] = {}
+
+
+def _load_index() -> Dict:
+    """Индекс хранилища (кэшируется в памяти)"""
+    global _index
+    if _index is None:
+        data = load_data(PHOTO_INDEX_FILE)
+        if not isinstance(data, dict):
+            data = {}
+        data.setdefault('photos', {})
+        data.setdefault('file_ids', {})
+        data.setdefault('legacy_paths', {})
+        _index = data
+    return _index
+
+
+def _save_index() -> None:
+    save_data(_index, PHOTO_INDEX_FILE)
+
+
+def photo_path_for_hash(photo_hash: str, suffix: str = '') -> str:
+    """Путь к файлу фото (suffix — для производных файлов, например '_thumb')"""
+    return os.path.join(PHOTO_STORE_DIR, photo_hash[:2], photo_hash[2:4], f"{photo_hash}{suffix}.jpg")
+
+
+def store_photo_bytes(content: bytes, file_id: Optional[str] = None) -> Dict:
+    """
+    Сохранить фото в хранилище (если такого содержимого ещё нет)
+
+    Args:
+        content: Содержимое файла
+        file_id: Telegram file_id, под которым фото получено
+
+    Returns:
+        dict: {'hash': ..., 'path': ...}
+    """
+    photo_hash = hashlib.sha256(content).hexdigest()
+    path = photo_path_for_hash(photo_hash)
+
+    with _lock:
+        index = _load_index()
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+
+        info = index['photos'].setdefault(photo_hash, {
+            'refs': 0,
+            'size': len(content),
+            'created_at': datetime.now().isoformat()
+        })
+        if file_id:
+            index['file_ids'][file_id] = photo_hash
+        _save_index()
+        return {'hash': photo_hash, 'path': path, 'refs': info['refs']}
+
+
+def get_photo_by_file_id(file_id: str) -> Optional[Dict]:
+    """Уже сохранённое фото по Telegram file_id (None — ещё не скачивалось)"""
+    with _lock:
+        photo_hash = _load_index()['file_ids'].get(file_id)
+    if not photo_hash:
+        return None
+    path = photo_path_for_hash(photo_hash)
+    if not os.path.exists(path):
+        return None
+    return {'hash': photo_hash, 'path': path}
+
+
+async def ingest_telegram_photo(bot, file_id: str) -> Optional[Dict]:
+    """
+    Получить фото Telegram из хранилища, скачав его только при первом обращении
+
+    Returns:
+        dict: {'hash': ..., 'path': ...} или None при ошибке скачивания
+    """
+    existing = get_photo_by_file_id(file_id)
+    if existing:
+        return existing
+    try:
+        file = await bot.get_file(file_id)
+        content = bytes(await file.download_as_bytearray())
+    except Exception as e:
+        print(f"❌ Не удалось скачать фото {file_id}: {e}")
+        return None
+    stored = await asyncio.to_thread(store_photo_bytes, content, file_id)
+    schedule_photo_variants(stored['hash'])
+    return stored
+
+
+def read_photo_bytes(photo_hash: str) -> Optional[bytes]:
+    """Прочитать содержимое фото по хешу"""
+    path = photo_path_for_hash(photo_hash)
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def _get_variant_executor() -> ThreadPoolExecutor:
+    global _variant_executor
+    if _variant_executor is None:
+        _variant_executor = ThreadPoolExecutor(max_workers=PHOTO_VARIANT_MAX_WORKERS,
+                                               thread_name_prefix="photo-variants")
+    return _variant_executor
+
+
+def generate_photo_variants(photo_hash: str) -> Dict[str, str]:
+    """
+    Создать недостающие уменьшенные копии фото (синхронно, вызывается в пуле потоков)
+
+    Копия не создаётся, если оригинал не больше её размера — тогда используется оригинал.
+    После обработки в записи индекса ставится отметка variants_ready, чтобы
+    get_photo_variant_path не ставил работу в очередь повторно.
+
+    Returns:
+        dict: {имя варианта: путь} для созданных или уже существующих копий
+    """
+    from PIL import Image
+
+    source = photo_path_for_hash(photo_hash)
+    result = {}
+    missing = {}
+    for name, spec in PHOTO_VARIANTS.items():
+        path = photo_path_for_hash(photo_hash, f"_{name}")
+        if os.path.exists(path):
+            result[name] = path
+        else:
+            missing[name] = spec
+    if not os.path.exists(source):
+        return result
+    if not missing:
+        _mark_variants_ready(photo_hash)
+        return result
+
+    with Image.open(source) as image:
+        # Для JPEG декодер сразу отдаёт копию нужного масштаба — полное декодирование не требуется
+        largest = max(size for size, _quality in missing.values())
+        image.draft('RGB', (largest, largest))
+        image = image.convert('RGB')
+        # От большего к меньшему: каждая копия уменьшается из предыдущей
+        for name, (size, quality) in sorted(missing.items(), key=lambda item: -item[1][0]):
+            if max(image.size) <= size:
+                continue
+            image.thumbnail((size, size), Image.LANCZOS)
+            path = photo_path_for_hash(photo_hash, f"_{name}")
+            tmp_path = f"{path}.tmp"
+            image.save(tmp_path, 'JPEG', quality=quality, optimize=True)
+            os.replace(tmp_path, path)
+            result[name] = path
+    _mark_variants_ready(photo_hash)
+    return result
+
+
+def _mark_variants_ready(photo_hash: str) -> None:
+    """Отметить в индексе, что все нужные копии созданы (недостающие не нужны — оригинал меньше)"""
+    with _lock:
+        info = _load_index()['photos'].get(photo_hash)
+        if info is not None and not info.get('variants_ready'):
+            info['variants_ready'] = True
+            _save_index()
+
+
+def schedule_photo_variants(photo_hash: str) -> Future:
+    """Поставить создание уменьшенных копий в очередь пула (повторный вызов не дублирует работу)"""
+    with _lock:
+        job = _variant_jobs.get(photo_hash)
+        if job is None:
+            job = _get_variant_executor().submit(generate_photo_variants, photo_hash)
+            _variant_jobs[photo_hash] = job
+            job.add_done_callback(lambda _job: _variant_jobs.pop(photo_hash, None))
+        return job
+
+
+def get_photo_variant_path(photo_hash: str, variant: str, wait: bool = True,
+                           allow_original: bool = True) -> Optional[str]:
+    """
+    Путь к наименьшей подходящей копии фото
+
+    Если копия ещё создаётся — дожидается её (wait=True). Если копии нет
+    (оригинал и так меньше, PIL недоступен, ошибка) — возвращает оригинал;
+    для уже обработанного фото (variants_ready) — сразу, без очереди.
+
+    Args:
+        photo_hash: Хеш фото
+        variant: 'thumb', 'pdf' или 'email'
+        wait: Ждать ли создания копии
+        allow_original: False — вернуть оригинал, только если он не больше копии
+            (variants_ready), а не когда копию создать не удалось
+
+    Returns:
+        str: Путь к файлу или None, если фото нет в хранилище (или нет копии при allow_original=False)
+    """
+    path = photo_path_for_hash(photo_hash, f"_{variant}")
+    if os.path.exists(path):
+        return path
+    original = photo_path_for_hash(photo_hash)
+    if not os.path.exists(original):
+        return None
+    with _lock:
+        info = _load_index()['photos'].get(photo_hash)
+        variants_ready = bool(info and info.get('variants_ready'))
+    if wait and variant in PHOTO_VARIANTS and not variants_ready:
+        try:
+            schedule_photo_variants(photo_hash).result()
+        except Exception as e:
+            print(f"⚠️ Не удалось создать копии фото {photo_hash[:12]}: {e}")
+        if os.path.exists(path):
+            return path
+        with _lock:
+            info = _load_index()['photos'].get(photo_hash)
+            variants_ready = bool(info and info.get('variants_ready'))
+    if not allow_original and not variants_ready:
+        return None
+    return original
+
+
+def ingest_legacy_photo(photo_path: str) -> Optional[str]:
+    """
+    Перенести фото старой заявки (только photo_path) в хранилище
+
+    Соответствие путь -> хеш запоминается в индексе вместе с mtime файла,
+    поэтому файл читается и хешируется только при первом обращении или после
+    изменения. Исходный файл не удаляется.
+
+    Returns:
+        str: Хеш фото или None, если файл не прочитать
+    """
+    try:
+        mtime = os.path.getmtime(photo_path)
+    except OSError:
+        return None
+    with _lock:
+        known = _load_index()['legacy_paths'].get(photo_path)
+    if known and known.get('mtime') == mtime and os.path.exists(photo_path_for_hash(known['hash'])):
+        return known['hash']
+
+    try:
+        with open(photo_path, 'rb') as f:
+            content = f.read()
+    except OSError as e:
+        print(f"⚠️ Не удалось прочитать фото {photo_path}: {e}")
+        return None
+    stored = store_photo_bytes(content)
+    with _lock:
+        _load_index()['legacy_paths'][photo_path] = {'hash': stored['hash'], 'mtime': mtime}
+        _save_index()
+    schedule_photo_variants(stored['hash'])
+    return stored['hash']
+
+
+def get_record_photo_path(record: dict, variant: str, allow_original: bool = True) -> Optional[str]:
+    """
+    Путь к фото заявки нужного размера
+
+    Фото старых записей без photo_hash переносится в хранилище при первом
+    обращении (ingest_legacy_photo), чтобы использовать уменьшенную копию.
+    allow_original — как в get_photo_variant_path.
+    """
+    photo_hash = record.get('photo_hash')
+    if not photo_hash:
+        photo_path = record.get('photo_path')
+        if not photo_path or not os.path.exists(photo_path):
+            return None
+        photo_hash = ingest_legacy_photo(photo_path)
+        if not photo_hash:
+            return photo_path if allow_original else None
+    return get_photo_variant_path(photo_hash, variant, allow_original=allow_original)
+
+
+def add_reference(photo_hash: Optional[str]) -> int:
+    """Увеличить счётчик ссылок (заявка начала ссылаться на фото)"""
+    if not photo_hash:
+        return 0
+    with _lock:
+        info = _load_index()['photos'].get(photo_hash)
+        if info is None:
+            return 0
+        info['refs'] = info.get('refs', 0) + 1
+        info.pop('unreferenced_since', None)
+        _save_index()
+        return info['refs']
+
+
+def release_reference(photo_hash: Optional[str]) -> int:
+    """Уменьшить счётчик ссылок (заявка удалена)"""
+    if not photo_hash:
+        return 0
+    with _lock:
+        info = _load_index()['photos'].get(photo_hash)
+        if info is None:
+            return 0
+        info['refs'] = max(0, info.get('refs', 0) - 1)
+        if info['refs'] == 0:
+            info['unreferenced_since'] = datetime.now().isoformat()
+        _save_index()
+        return info['refs']
+
+
+def _referenced_hashes(legacy_paths: Dict[str, Dict]) -> Optional[Dict[str, int]]:
+    """
+    Пересчитать ссылки по всем заявкам (записи пользователей, ожидающие, архив)
+
+    Старые заявки без photo_hash ссылаются на перенесённое фото через photo_path
+    (legacy_paths из индекса).
+
+    Returns:
+        dict: {хеш: число ссылок} или None, если файл заявок не удалось прочитать —
+              тогда ссылки неизвестны и удалять ничего нельзя
+    """
+    counts: Dict[str, int] = {}
+    # load_data() при ошибке возвращает {}, что здесь означало бы "ссылок нет"
+    try:
+        with open(DATA_FILE, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"⚠️ Не удалось прочитать {DATA_FILE}: {e}")
+        return None
+    if not isinstance(data, dict):
+        print(f"⚠️ Неверный формат {DATA_FILE}")
+        return None
+
+    def count(record):
+        if not isinstance(record, dict):
+            return
+        photo_hash = record.get('photo_hash')
+        if not photo_hash and record.get('photo_path') in legacy_paths:
+            photo_hash = legacy_paths[record['photo_path']].get('hash')
+        if photo_hash:
+            counts[photo_hash] = counts.get(photo_hash, 0) + 1
+
+    for key, value in data.items():
+        if isinstance(value, list):
+            for record in value:
+                count(record)
+        elif key in ('pending_dse_requests', 'archived_dse_requests') and isinstance(value, dict):
+            for record in value.values():
+                count(record)
+    return counts
+
+
+def collect_garbage(grace_seconds: float = PHOTO_GC_GRACE_SECONDS) -> Dict[str, int]:
+    """
+    Удалить фото, на которые не ссылается ни одна заявка, и файлы вне индекса
+
+    Счётчики ссылок пересчитываются по данным заявок, поэтому расхождения
+    (например, после ручного редактирования bot_data.json) исправляются здесь.
+
+    Returns:
+        dict: {'removed': удалено фото, 'orphans': удалено файлов вне индекса, 'freed': байт}
+    """
+    with _lock:
+        legacy_paths = dict(_load_index()['legacy_paths'])
+    referenced = _referenced_hashes(legacy_paths)
+    if referenced is None:
+        print("⚠️ Сборка мусора в хранилище фото пропущена: данные заявок недоступны")
+        return {'removed': 0, 'orphans': 0, 'freed': 0}
+    now = datetime.now()
+    removed = orphans = freed = 0
+
+    with _lock:
+        index = _load_index()
+        photos = index['photos']
+        for photo_hash, info in list(photos.items()):
+            info['refs'] = referenced.get(photo_hash, 0)
+            if info['refs']:
+                info.pop('unreferenced_since', None)
+                continue
+            since = info.setdefault('unreferenced_since', now.isoformat())
+            try:
+                age = (now - datetime.fromisoformat(since)).total_seconds()
+            except ValueError:
+                age = grace_seconds
+            if age < grace_seconds:
+                continue
+            freed += _remove_photo_files(photo_hash)
+            del photos[photo_hash]
+            removed += 1
+
+        if removed:
+            index['file_ids'] = {fid: h for fid, h in index['file_ids'].items() if h in photos}
+            index['legacy_paths'] = {path: entry for path, entry in index['legacy_paths'].items()
+                                     if entry.get('hash') in photos}
+        known: Set[str] = set(photos)
+        _save_index()
+
+    # Файлы, которых нет в индексе (прерванная запись, удалённый индекс)
+    if os.path.isdir(PHOTO_STORE_DIR):
+        cutoff = now.timestamp() - grace_seconds
+        for root, _dirs, files in os.walk(PHOTO_STORE_DIR):
+            for name in files:
+                if name.endswith('.tmp'):
+                    # Недописанная копия (прерванная запись): свежие ещё могут дописываться
+                    pass
+                elif not name.endswith('.jpg'):
+                    continue
+                elif name.split('_', 1)[0].split('.', 1)[0] in known:
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        freed += os.path.getsize(path)
+                        os.remove(path)
+                        orphans += 1
+                except OSError:
+                    pass
+
+    return {'removed': removed, 'orphans': orphans, 'freed': freed}
+
+
+def _remove_photo_files(photo_hash: str) -> int:
+    """Удалить файл фото и его производные; возвращает освобождённый объём"""
+    freed = 0
+    directory = os.path.dirname(photo_path_for_hash(photo_hash))
+    if not os.path.isdir(directory):
+        return 0
+    for name in os.listdir(directory):
+        if name.startswith(photo_hash):
+            path = os.path.join(directory, name)
+            try:
+                freed += os.path.getsize(path)
+                os.remove(path)
+            except OSError:
+                pass
+    return freed
+
+
+async def start_photo_gc_job(application):
+    """Периодически удаляет фото без ссылок."""
+    print("🖼️ Задача очистки хранилища фото запущена.")
+    while True:
+        try:
+            result = await asyncio.to_thread(collect_garbage)
+            if result['removed'] or result['orphans']:
+                print(f"🖼️ Удалено фото: {result['removed']}, файлов вне индекса: {result['orphans']}, "
+                      f"освобождено {result['freed'] / 1024 / 1024:.1f} МБ")
+        except asyncio.CancelledError:
+            print("⏹️ Задача очистки хранилища фото остановлена.")
+            break
+        except Exception as e:
+            print(f"❌ Ошибка в задаче очистки хранилища фото: {e}")
+        await asyncio.sleep(PHOTO_GC_INTERVAL_SECONDS)
@@ -0,0 +1,90 @@
+"""
+QR Scanner - распознавание QR кодов на фото без блокировки бота
+Фото скачивается в память через HTTP клиент бота, распознавание идёт в пуле
+потоков: изображение переводится в оттенки серого и проверяется от малого
+размера к полному — большинство QR находится уже на уменьшенной копии.
+"""
+import asyncio
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import Optional
+
+# Добавляем корневую директорию проекта в sys.path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# Размеры (по длинной стороне) для последовательных попыток; None — исходный размер
+QR_SCAN_SIZES = (640, 1280, None)
+
+# Потоки для распознавания (zbar отпускает GIL на время декодирования)
+QR_SCAN_MAX_WORKERS = 2
+
+_executor = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=QR_SCAN_MAX_WORKERS, thread_name_prefix="qr-scan")
+    return _executor
+
+
+def decode_qr_bytes(image_bytes: bytes) -> Optional[str]:
+    """
+    Найти QR код на изображении (синхронно, вызывается в пуле потоков)
+
+    Args:
+        image_bytes: Содержимое файла изображения
+
+    Returns:
+        str: Данные первого найденного QR кода или None
+    """
+    from PIL import Image
+    from pyzbar import pyzbar
+    from pyzbar.pyzbar import ZBarSymbol
+
+    image = Image.open(BytesIO(image_bytes))
+    original_size = image.size
+    # Для JPEG декодер сразу отдаёт уменьшенную серую копию — это дешевле полного декодирования
+    image.draft('L', (QR_SCAN_SIZES[-2], QR_SCAN_SIZES[-2]))
+    gray = image.convert('L')
+
+    tried = set()
+    for size in QR_SCAN_SIZES:
+        candidate = gray
+        if size is not None and max(gray.size) > size:
+            candidate = gray.copy()
+            candidate.thumbnail((size, size))
+        if candidate.size in tried:
+            continue
+        tried.add(candidate.size)
+
+        decoded = pyzbar.decode(candidate, symbols=[ZBarSymbol.QRCODE])
+        if decoded:
+            return decoded[0].data.decode('utf-8')
+
+    # Черновое декодирование могло потерять детали мелкого кода — последняя попытка на оригинале
+    if gray.size != original_size:
+        full = Image.open(BytesIO(image_bytes)).convert('L')
+        decoded = pyzbar.decode(full, symbols=[ZBarSymbol.QRCODE])
+        if decoded:
+            return decoded[0].data.decode('utf-8')
+    return None
+
+
+async def scan_qr_from_photo(bot, photo) -> Optional[str]:
+    """
+    Скачать фото Telegram в память и распознать QR код в пуле потоков
+
+    Args:
+        bot: Экземпляр бота (используется его HTTP клиент)
+        photo: PhotoSize из сообщения
+
+    Returns:
+        str: Данные QR кода или None
+    """
+    file = await bot.get_file(photo.file_id)
+    image_bytes = bytes(await file.download_as_bytearray())
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), decode_qr_bytes, image_bytes)
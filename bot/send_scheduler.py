@@ -0,0 +1,233 @@
+"""
+Send Scheduler - единый планировщик исходящих запросов к Telegram
+Подключается к боту как rate limiter (ApplicationBuilder().rate_limiter(...)),
+поэтому через него проходят все отправки: ответы в обработчиках, пересылка
+сообщений чата, уведомления наблюдателя, подписки, сводки и PDF экспорт.
+
+- общий token bucket (лимит Telegram ~30 сообщений/с на бота)
+- token bucket на каждый чат (1 сообщение/с, для групп 20 в минуту)
+- классы приоритета: пересылка чата > ответы пользователю > уведомления > массовые PDF
+- автоматическая обработка RetryAfter: пауза и повтор запроса
+
+Приоритет передаётся через rate_limit_args метода бота, например:
+    await context.bot.send_document(..., rate_limit_args=PRIORITY_BULK)
+"""
+import asyncio
+import itertools
+from collections import deque
+import os
+import sys
+import time
+from datetime import timedelta
+from typing import Any, Dict, Optional
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+# Добавляем корневую директорию проекта в sys.path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# Классы приоритета (меньше — важнее)
+PRIORITY_CHAT = 0          # Пересылка сообщений в чате по ДСЕ
+PRIORITY_INTERACTIVE = 1   # Ответы на действия пользователя (по умолчанию)
+PRIORITY_NOTIFICATION = 2  # Уведомления наблюдателя, подписок, новых заявок
+PRIORITY_BULK = 3          # Массовая отправка PDF и отчётов
+
+# Лимиты
+GLOBAL_RATE_PER_SECOND = 25
+GLOBAL_BURST = 25
+CHAT_RATE_PER_SECOND = 1.0
+CHAT_BURST = 3
+GROUP_RATE_PER_SECOND = 20 / 60
+GROUP_BURST = 3
+MAX_RETRIES = 5
+
+# RetryAfter обычно относится к одному чату. Вся отправка притормаживается, только если
+# за GLOBAL_FLOOD_WINDOW_SECONDS его получили не меньше GLOBAL_FLOOD_MIN_CHATS разных чатов
+GLOBAL_FLOOD_WINDOW_SECONDS = 5.0
+GLOBAL_FLOOD_MIN_CHATS = 3
+
+# Неиспользуемые bucket'ы чатов удаляются, чтобы словарь не рос бесконечно
+CHAT_BUCKET_IDLE_SECONDS = 600
+
+# Методы API, которые ограничиваются (getUpdates, answerCallbackQuery и т.п. идут напрямую)
+LIMITED_ENDPOINT_PREFIXES = ('send', 'edit', 'copy', 'forward')
+
+
+class _TokenBucket:
+    """Token bucket с возможностью временной блокировки (после RetryAfter)."""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated', 'blocked_until')
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Сколько секунд ждать до появления токена (0 — токен есть)."""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+    def block(self, seconds: float) -> None:
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+
+def _retry_after_seconds(error: RetryAfter) -> float:
+    value = error.retry_after
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    return float(value)
+
+
+class SendScheduler(BaseRateLimiter[int]):
+    """Планировщик исходящих запросов с приоритетами и token bucket'ами."""
+
+    def __init__(self):
+        self._global = _TokenBucket(GLOBAL_RATE_PER_SECOND, GLOBAL_BURST)
+        self._chats: Dict[Any, _TokenBucket] = {}
+        self._flood_events = deque()  # (время, chat_id) недавних RetryAfter
+        self._waiters = []
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+
+    async def initialize(self) -> None:
+        self._wakeup = asyncio.Event()
+        self._dispatcher = asyncio.get_running_loop().create_task(self._dispatch())
+
+    async def shutdown(self) -> None:
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+            self._dispatcher = None
+        for _, _, _, future in self._waiters:
+            if not future.done():
+                future.cancel()
+        self._waiters.clear()
+
+    def _chat_bucket(self, chat_id) -> Optional[_TokenBucket]:
+        if chat_id is None:
+            return None
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            is_group = str(chat_id).startswith('-')
+            bucket = _TokenBucket(
+                GROUP_RATE_PER_SECOND if is_group else CHAT_RATE_PER_SECOND,
+                GROUP_BURST if is_group else CHAT_BURST
+            )
+            self._chats[chat_id] = bucket
+        return bucket
+
+    def _forget_idle_chats(self, now: float) -> None:
+        if len(self._chats) < 1000:
+            return
+        waiting = {chat_id for _, _, chat_id, _ in self._waiters}
+        for chat_id, bucket in list(self._chats.items()):
+            if (chat_id not in waiting and bucket.blocked_until <= now
+                    and now - bucket.updated > CHAT_BUCKET_IDLE_SECONDS):
+                del self._chats[chat_id]
+
+    async def _acquire(self, chat_id, priority: int) -> None:
+        """Дождаться разрешения на отправку с учётом приоритета и лимитов."""
+        if self._dispatcher is None:
+            await self.initialize()
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append((priority, next(self._seq), chat_id, future))
+        self._wakeup.set()
+        await future
+
+    async def _dispatch(self) -> None:
+        """Выдаёт разрешения ожидающим запросам в порядке приоритета."""
+        while True:
+            self._waiters = [w for w in self._waiters if not w[3].done()]
+            if not self._waiters:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            now = time.monotonic()
+            global_wait = self._global.wait_time(now)
+            if global_wait > 0:
+                await asyncio.sleep(global_wait)
+                continue
+
+            granted = None
+            min_wait = None
+            for waiter in sorted(self._waiters):
+                bucket = self._chat_bucket(waiter[2])
+                wait = bucket.wait_time(now) if bucket else 0.0
+                if wait <= 0:
+                    granted = waiter
+                    break
+                min_wait = wait if min_wait is None else min(min_wait, wait)
+
+            if granted is None:
+                # Все ожидающие чаты исчерпали лимит — ждём ближайший или новый запрос
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=min_wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self._waiters.remove(granted)
+            self._global.consume(now)
+            bucket = self._chat_bucket(granted[2])
+            if bucket:
+                bucket.consume(now)
+            granted[3].set_result(None)
+            self._forget_idle_chats(now)
+
+    def _is_global_flood(self, chat_id) -> bool:
+        """Похоже ли, что превышен общий лимит бота (RetryAfter сразу в нескольких чатах)."""
+        if chat_id is None:
+            return True
+        now = time.monotonic()
+        self._flood_events.append((now, chat_id))
+        while self._flood_events and now - self._flood_events[0][0] > GLOBAL_FLOOD_WINDOW_SECONDS:
+            self._flood_events.popleft()
+        return len({event_chat for _, event_chat in self._flood_events}) >= GLOBAL_FLOOD_MIN_CHATS
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        if not endpoint.startswith(LIMITED_ENDPOINT_PREFIXES):
+            return await callback(*args, **kwargs)
+
+        priority = PRIORITY_INTERACTIVE if rate_limit_args is None else int(rate_limit_args)
+        chat_id = data.get('chat_id')
+
+        for attempt in range(MAX_RETRIES + 1):
+            await self._acquire(chat_id, priority)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                delay = _retry_after_seconds(e)
+                print(f"⏳ Flood limit Telegram ({endpoint}, чат {chat_id}): пауза {delay:.0f} с")
+                # Ожидание относится к чату — остальные чаты продолжают получать сообщения.
+                # Общая пауза — только если лимит явно общий
+                bucket = self._chat_bucket(chat_id)
+                if bucket:
+                    bucket.block(delay)
+                if self._is_global_flood(chat_id):
+                    print(f"⏳ Flood limit сразу в нескольких чатах: пауза всей отправки {delay:.0f} с")
+                    self._global.block(delay)
+                if attempt == MAX_RETRIES:
+                    raise
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк времени запуска (python -X importtime)
+Импортирует модуль в отдельном процессе, суммирует время импорта по данным
+-X importtime и проверяет два условия:
+- общее время импорта не превышает бюджет (STARTUP_BUDGET_MS)
+- тяжёлые зависимости (pandas, reportlab, qrcode, pyzbar, ...) не загружаются при старте
+
+Запуск: python bot/startup_benchmark.py [--module bot.bot] [--budget 800] [--runs 5] [--top 15]
+Код возврата 1, если бюджет превышен или загружена тяжёлая зависимость.
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+PROJECT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Бюджет времени импорта модуля бота (мс, медиана нескольких запусков)
+STARTUP_BUDGET_MS = 800
+
+# Модули, которые должны загружаться только при первом использовании
+HEAVY_MODULES = ('pandas', 'reportlab', 'qrcode', 'pyzbar', 'PIL', 'openpyxl', 'numpy')
+
+_LINE_RE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)')
+
+
+def measure(module: str):
+    """
+    Один запуск интерпретатора с -X importtime.
+
+    Returns:
+        tuple: (общее время импорта module в мкс, {модуль: собственное время мкс})
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=PROJECT_DIR, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Не удалось импортировать {module}:\n{result.stderr[-2000:]}")
+
+    self_times = {}
+    total = None
+    for line in result.stderr.splitlines():
+        match = _LINE_RE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, name = match.groups()
+        self_times[name] = self_times.get(name, 0) + int(self_us)
+        if name == module and len(indent) == 1:
+            total = int(cumulative_us)
+    if total is None:
+        total = sum(self_times.values())
+    return total, self_times
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Бенчмарк времени запуска (-X importtime)")
+    parser.add_argument('--module', default='bot.bot')
+    parser.add_argument('--budget', type=float, default=STARTUP_BUDGET_MS, help="Бюджет, мс")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15, help="Сколько самых медленных модулей показать")
+    args = parser.parse_args()
+
+    totals = []
+    self_times = {}
+    for _ in range(max(1, args.runs)):
+        total, self_times = measure(args.module)
+        totals.append(total / 1000)
+
+    median_ms = statistics.median(totals)
+    print(f"Импорт {args.module}: медиана {median_ms:.1f} мс "
+          f"(min {min(totals):.1f}, max {max(totals):.1f}, запусков {len(totals)}), бюджет {args.budget:.0f} мс")
+
+    print(f"\nСамые медленные модули (собственное время, последний запуск):")
+    for name, us in sorted(self_times.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+        print(f"  {us / 1000:8.1f} мс  {name}")
+
+    heavy = sorted({name.split('.')[0] for name in self_times} & set(HEAVY_MODULES))
+    failed = False
+    if heavy:
+        print(f"\n❌ При запуске загружены тяжёлые зависимости: {', '.join(heavy)}")
+        failed = True
+    if median_ms > args.budget:
+        print(f"\n❌ Бюджет превышен: {median_ms:.1f} мс > {args.budget:.0f} мс")
+        failed = True
+    if not failed:
+        print("\n✅ Запуск укладывается в бюджет")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
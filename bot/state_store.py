@@ -0,0 +1,319 @@
+"""
+State Store - хранилище состояний диалогов с TTL
+Заменяет обычные словари user_states, admin_states, dse_view_states,
+registration_states, dse_chat_states и active_chats, сохраняя интерфейс dict:
+- запись удаляется, если к ней не обращались дольше TTL (у каждой записи свой срок)
+- число записей и примерный объём памяти ограничены, вытесняются давно неиспользуемые
+- при state_backend = "sqlite" (по умолчанию) состояния периодически сохраняются
+  в data/conversation_state.sqlite3 и восстанавливаются после перезапуска бота
+
+Вложенные словари изменяются "на месте" (user_states[uid]['dse'] = ...), поэтому
+любое обращение к записи помечает её изменённой, а сохранение выполняется
+пакетно фоновой задачей (start_state_maintenance_job) и при остановке бота.
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from typing import Any, Dict, List, Optional
+
+# Добавляем корневую директорию проекта в sys.path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from config.config import DATA_DIR
+
+STATE_DB_FILE = str(DATA_DIR / "conversation_state.sqlite3")
+
+# TTL по умолчанию (секунды с последнего обращения)
+DEFAULT_STATE_TTL_SECONDS = 24 * 3600
+
+# Интервал очистки и сохранения фоновой задачей (секунды)
+STATE_MAINTENANCE_INTERVAL_SECONDS = 60
+
+_stores: List['StateStore'] = []
+_db_lock = threading.Lock()
+_db_connection = None
+
+
+def _get_backend() -> str:
+    from config.settings import get_state_backend
+    return get_state_backend()
+
+
+def _get_db() -> sqlite3.Connection:
+    """Общее соединение SQLite (создаётся при первом обращении)"""
+    global _db_connection
+    if _db_connection is None:
+        os.makedirs(os.path.dirname(STATE_DB_FILE), exist_ok=True)
+        connection = sqlite3.connect(STATE_DB_FILE, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS states ("
+            " store TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,"
+            " expires_at REAL NOT NULL, ttl REAL, PRIMARY KEY (store, key))"
+        )
+        connection.commit()
+        _db_connection = connection
+    return _db_connection
+
+
+def _approx_size(value: Any) -> int:
+    """Примерный объём записи в байтах (по JSON представлению)"""
+    try:
+        return len(json.dumps(value, ensure_ascii=False, default=str))
+    except (TypeError, ValueError):
+        return sys.getsizeof(value)
+
+
+class StateStore(MutableMapping):
+    """
+    Словарь состояний с TTL, ограничением размера и необязательным сохранением в SQLite.
+
+    Args:
+        name: Имя хранилища (ключ в базе)
+        ttl: Время жизни записи без обращений, секунды
+        max_entries: Максимум записей (вытесняются давно неиспользуемые)
+        max_bytes: Примерный предел объёма (проверяется при очистке)
+        persistent: Сохранять ли записи между перезапусками (если backend = sqlite)
+    """
+
+    def __init__(self, name: str, ttl: float = DEFAULT_STATE_TTL_SECONDS, max_entries: int = 10000,
+                 max_bytes: Optional[int] = None, persistent: bool = True):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.persistent = persistent
+        # key -> [value, expires_at, ttl записи]; порядок — от давно неиспользуемых к свежим
+        self._data: 'OrderedDict[str, list]' = OrderedDict()
+        self._dirty = set()
+        self._deleted = set()
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._backed = None
+        _stores.append(self)
+
+    # === Сохранение ===
+
+    def _is_backed(self) -> bool:
+        if self._backed is None:
+            self._backed = self.persistent and _get_backend() == 'sqlite'
+        return self._backed
+
+    def _ensure_loaded(self) -> None:
+        """Восстановить записи из базы при первом обращении (не при импорте модуля)"""
+        if self._loaded:
+            return
+        self._loaded = True
+        if not self._is_backed():
+            return
+        try:
+            with _db_lock:
+                rows = _get_db().execute(
+                    "SELECT key, value, expires_at, ttl FROM states WHERE store = ? AND expires_at > ?"
+                    " ORDER BY expires_at",
+                    (self.name, time.time())
+                ).fetchall()
+            for key, value, expires_at, ttl in rows:
+                self._data[key] = [json.loads(value), expires_at, ttl]
+            if rows:
+                print(f"♻️ Восстановлено состояний '{self.name}': {len(rows)}")
+        except Exception as e:
+            print(f"⚠️ Ошибка загрузки состояний '{self.name}': {e}")
+
+    def flush(self) -> int:
+        """
+        Записать изменённые и удалённые записи в базу
+
+        Returns:
+            int: Количество записанных изменений
+        """
+        if not self._loaded or not self._is_backed():
+            return 0
+        with self._lock:
+            dirty = [(key, self._data[key]) for key in self._dirty if key in self._data]
+            deleted = list(self._deleted)
+            self._dirty.clear()
+            self._deleted.clear()
+            rows = []
+            for key, (value, expires_at, ttl) in dirty:
+                rows.append((self.name, key, json.dumps(value, ensure_ascii=False, default=str),
+                             expires_at, ttl))
+        if not rows and not deleted:
+            return 0
+        try:
+            with _db_lock:
+                db = _get_db()
+                db.executemany("DELETE FROM states WHERE store = ? AND key = ?",
+                               [(self.name, key) for key in deleted])
+                db.executemany("INSERT OR REPLACE INTO states (store, key, value, expires_at, ttl)"
+                               " VALUES (?, ?, ?, ?, ?)", rows)
+                db.commit()
+        except Exception as e:
+            print(f"⚠️ Ошибка сохранения состояний '{self.name}': {e}")
+        return len(rows) + len(deleted)
+
+    # === Интерфейс dict ===
+
+    def _expired(self, entry: list, now: float) -> bool:
+        return entry[1] <= now
+
+    def _touch(self, key: str, entry: list, now: float) -> None:
+        entry[1] = now + (entry[2] if entry[2] is not None else self.ttl)
+        self._data.move_to_end(key)
+        self._dirty.add(key)
+
+    def _drop(self, key: str) -> None:
+        del self._data[key]
+        self._dirty.discard(key)
+        self._deleted.add(key)
+
+    def __getitem__(self, key):
+        key = str(key)
+        with self._lock:
+            self._ensure_loaded()
+            entry = self._data.get(key)
+            if entry is None:
+                raise KeyError(key)
+            now = time.time()
+            if self._expired(entry, now):
+                self._drop(key)
+                raise KeyError(key)
+            self._touch(key, entry, now)
+            return entry[0]
+
+    def __setitem__(self, key, value) -> None:
+        self.put(key, value)
+
+    def put(self, key, value, ttl: Optional[float] = None) -> None:
+        """Записать значение с собственным TTL (None — TTL хранилища)"""
+        key = str(key)
+        with self._lock:
+            self._ensure_loaded()
+            entry = [value, 0.0, ttl]
+            self._data[key] = entry
+            self._deleted.discard(key)
+            self._touch(key, entry, time.time())
+            while len(self._data) > self.max_entries:
+                oldest = next(iter(self._data))
+                self._drop(oldest)
+
+    def __delitem__(self, key) -> None:
+        key = str(key)
+        with self._lock:
+            self._ensure_loaded()
+            if key not in self._data:
+                raise KeyError(key)
+            self._drop(key)
+
+    def __contains__(self, key) -> bool:
+        key = str(key)
+        with self._lock:
+            self._ensure_loaded()
+            entry = self._data.get(key)
+            if entry is None:
+                return False
+            if self._expired(entry, time.time()):
+                self._drop(key)
+                return False
+            return True
+
+    def __iter__(self):
+        with self._lock:
+            self.sweep()
+            return iter(list(self._data.keys()))
+
+    def __len__(self) -> int:
+        with self._lock:
+            self.sweep()
+            return len(self._data)
+
+    def __repr__(self) -> str:
+        return f"StateStore({self.name!r}, entries={len(self._data)})"
+
+    # === Очистка и учёт памяти ===
+
+    def sweep(self) -> int:
+        """
+        Удалить просроченные записи и вытеснить старые сверх max_bytes
+
+        Returns:
+            int: Количество удалённых записей
+        """
+        with self._lock:
+            self._ensure_loaded()
+            now = time.time()
+            removed = 0
+            for key in [k for k, entry in self._data.items() if self._expired(entry, now)]:
+                self._drop(key)
+                removed += 1
+            if self.max_bytes is not None:
+                total = self.memory_usage()
+                while self._data and total > self.max_bytes:
+                    oldest = next(iter(self._data))
+                    total -= _approx_size(self._data[oldest][0])
+                    self._drop(oldest)
+                    removed += 1
+            return removed
+
+    def memory_usage(self) -> int:
+        """Примерный объём всех записей в байтах"""
+        with self._lock:
+            return sum(_approx_size(entry[0]) for entry in self._data.values())
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'name': self.name,
+                'entries': len(self._data),
+                'bytes': self.memory_usage(),
+                'ttl': self.ttl,
+                'persistent': bool(self._loaded and self._is_backed()),
+            }
+
+
+def sweep_all_states() -> int:
+    """Очистить все хранилища; возвращает число удалённых записей"""
+    return sum(store.sweep() for store in _stores)
+
+
+def flush_all_states() -> int:
+    """Сохранить изменения всех хранилищ; возвращает число записанных изменений"""
+    written = 0
+    for store in _stores:
+        written += store.flush()
+    if _db_connection is not None:
+        with _db_lock:
+            # Просроченные записи хранилищ, к которым давно не обращались
+            _db_connection.execute("DELETE FROM states WHERE expires_at <= ?", (time.time(),))
+            _db_connection.commit()
+    return written
+
+
+def get_state_stats() -> List[Dict[str, Any]]:
+    """Статистика по всем хранилищам (записи, примерный объём)"""
+    return [store.stats() for store in _stores]
+
+
+async def start_state_maintenance_job(application):
+    """Периодически удаляет просроченные состояния и сохраняет изменения."""
+    print("🗂️ Задача обслуживания состояний диалогов запущена.")
+    while True:
+        try:
+            await asyncio.sleep(STATE_MAINTENANCE_INTERVAL_SECONDS)
+            removed = sweep_all_states()
+            # Сериализация идёт в потоке бота: вложенные словари меняются обработчиками
+            flush_all_states()
+            if removed:
+                print(f"🗂️ Удалено просроченных состояний: {removed}")
+        except asyncio.CancelledError:
+            flush_all_states()
+            print("⏹️ Задача обслуживания состояний остановлена.")
+            break
+        except Exception as e:
+            print(f"❌ Ошибка в задаче обслуживания состояний: {e}")
@@ -4,15 +4,17 @@
 Позволяет пользователям подписаться на автоматическое получение PDF всех новых заявок
 """
 
+import copy
 import json
 import os
 import sys
+import threading
 from datetime import datetime
 
 # Добавляем корневую директорию проекта в sys.path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from config.config import DATA_DIR
+from config.config import DATA_DIR, RC_TYPES, PROBLEM_TYPES
 
 SUBSCRIPTIONS_FILE = str(DATA_DIR / "subscriptions.json")
 
@@ -23,6 +25,14 @@ DELIVERY_TYPES = {
     'both': 'Telegram и Email'
 }
 
+# Фильтры подписки: пустой список означает "любое значение"
+FILTER_FIELDS = {
+    'rc': 'РЦ',
+    'problem_type': 'Тип проблемы',
+    'dse_prefix': 'Префикс ДСЕ',
+    'machine_number': 'Номер станка'
+}
+
 
 def load_subscriptions():
     """Загрузить все подписки"""
@@ -40,12 +50,82 @@ def save_subscriptions(data):
     try:
         with open(SUBSCRIPTIONS_FILE, 'w', encoding='utf-8') as f:
             json.dump(data, f, ensure_ascii=False, indent=2)
+        _refresh_registry(data)
         return True
     except Exception as e:
         print(f"Ошибка сохранения подписок: {e}")
         return False
 
 
+# === КЭШ ПОДПИСОК ===
+# Реестр в памяти: подписки, активные подписки, готовые списки получателей
+# Telegram/Email, статистика и индекс фильтров. Пересобирается при каждом
+# сохранении и при изменении файла извне (по mtime).
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def _subscriptions_mtime():
+    try:
+        return os.path.getmtime(SUBSCRIPTIONS_FILE)
+    except OSError:
+        return None
+
+
+def _build_registry(subscriptions):
+    active = {
+        user_id: data
+        for user_id, data in subscriptions.items()
+        if data.get('active', False)
+    }
+    telegram = [
+        user_id
+        for user_id, data in active.items()
+        if data.get('delivery_type') in ['telegram', 'both']
+    ]
+    email = [
+        {'user_id': user_id, 'email': data.get('email')}
+        for user_id, data in active.items()
+        if data.get('delivery_type') in ['email', 'both'] and data.get('email')
+    ]
+    return {
+        'subscriptions': subscriptions,
+        'active': active,
+        'telegram': telegram,
+        'email': email,
+        'stats': {
+            'total': len(subscriptions),
+            'active': len(active),
+            'inactive': len(subscriptions) - len(active),
+            'telegram': len(telegram),
+            'email': len([
+                s for s in active.values()
+                if s.get('delivery_type') in ['email', 'both']
+            ])
+        },
+        'filter_index': _build_filter_index(active),
+        'mtime': _subscriptions_mtime()
+    }
+
+
+def _refresh_registry(subscriptions):
+    global _registry
+    registry = _build_registry(copy.deepcopy(subscriptions))
+    with _registry_lock:
+        _registry = registry
+
+
+def _get_registry():
+    global _registry
+    with _registry_lock:
+        registry = _registry
+    if registry is None or registry['mtime'] != _subscriptions_mtime():
+        registry = _build_registry(load_subscriptions())
+        with _registry_lock:
+            _registry = registry
+    return registry
+
+
 def add_subscription(user_id, delivery_type='telegram', email=None):
     """
     Добавить подписку на новые заявки
@@ -71,7 +151,9 @@ def add_subscription(user_id, delivery_type='telegram', email=None):
         'delivery_type': delivery_type,
         'email': email if delivery_type in ['email', 'both'] else None,
         'created_at': datetime.now().isoformat(),
-        'active': True
+        'active': True,
+        # Фильтры сохраняются при повторной подписке
+        'filters': subscriptions.get(user_id_str, {}).get('filters') or {}
     }
     
     return save_subscriptions(subscriptions)
@@ -107,8 +189,8 @@ def get_subscription(user_id):
     Returns:
         dict или None: данные подписки или None если не подписан
     """
-    subscriptions = load_subscriptions()
-    return subscriptions.get(str(user_id))
+    subscription = _get_registry()['subscriptions'].get(str(user_id))
+    return copy.deepcopy(subscription) if subscription is not None else None
 
 
 def is_subscribed(user_id):
@@ -121,8 +203,7 @@ def is_subscribed(user_id):
     Returns:
         bool: True если подписан и подписка активна
     """
-    subscription = get_subscription(user_id)
-    return subscription is not None and subscription.get('active', False)
+    return str(user_id) in _get_registry()['active']
 
 
 def toggle_subscription(user_id):
@@ -154,12 +235,7 @@ def get_all_active_subscriptions():
     Returns:
         dict: словарь {user_id: subscription_data} для всех активных подписок
     """
-    subscriptions = load_subscriptions()
-    return {
-        user_id: data 
-        for user_id, data in subscriptions.items() 
-        if data.get('active', False)
-    }
+    return copy.deepcopy(_get_registry()['active'])
 
 
 def get_telegram_subscribers():
@@ -169,12 +245,7 @@ def get_telegram_subscribers():
     Returns:
         list: список user_id (строки)
     """
-    active_subs = get_all_active_subscriptions()
-    return [
-        user_id 
-        for user_id, data in active_subs.items() 
-        if data.get('delivery_type') in ['telegram', 'both']
-    ]
+    return list(_get_registry()['telegram'])
 
 
 def get_email_subscribers():
@@ -184,12 +255,7 @@ def get_email_subscribers():
     Returns:
         list: список словарей {'user_id': str, 'email': str}
     """
-    active_subs = get_all_active_subscriptions()
-    return [
-        {'user_id': user_id, 'email': data.get('email')}
-        for user_id, data in active_subs.items() 
-        if data.get('delivery_type') in ['email', 'both'] and data.get('email')
-    ]
+    return [dict(item) for item in _get_registry()['email']]
 
 
 def update_subscription_email(user_id, email):
@@ -221,23 +287,156 @@ def get_subscription_stats():
     Returns:
         dict: статистика подписок
     """
+    return dict(_get_registry()['stats'])
+
+
+# === ФИЛЬТРЫ ПОДПИСОК ===
+
+def _normalize_filter_value(field, value):
+    value = str(value).strip()
+    if field in ('dse_prefix', 'machine_number'):
+        return value.lower()
+    return value
+
+
+def normalize_filters(filters):
+    """
+    Проверить и нормализовать фильтры подписки
+
+    Args:
+        filters: dict {field: list значений}, поля из FILTER_FIELDS
+
+    Returns:
+        dict: нормализованные фильтры (только непустые поля)
+    """
+    normalized = {}
+    for field in FILTER_FIELDS:
+        values = (filters or {}).get(field) or []
+        if isinstance(values, str):
+            values = [values]
+        cleaned = []
+        for value in values:
+            value = _normalize_filter_value(field, value)
+            if not value:
+                continue
+            if field == 'rc' and value not in RC_TYPES:
+                continue
+            if field == 'problem_type' and value not in PROBLEM_TYPES:
+                continue
+            if value not in cleaned:
+                cleaned.append(value)
+        if cleaned:
+            normalized[field] = cleaned
+    return normalized
+
+
+def set_subscription_filters(user_id, filters):
+    """
+    Установить фильтры подписки (пустые фильтры = все заявки)
+
+    Args:
+        user_id: ID пользователя Telegram
+        filters: dict {field: list значений}
+
+    Returns:
+        bool: успешность операции
+    """
     subscriptions = load_subscriptions()
-    active_subs = get_all_active_subscriptions()
-    
-    telegram_count = len([
-        s for s in active_subs.values() 
-        if s.get('delivery_type') in ['telegram', 'both']
-    ])
-    
-    email_count = len([
-        s for s in active_subs.values() 
-        if s.get('delivery_type') in ['email', 'both']
-    ])
-    
-    return {
-        'total': len(subscriptions),
-        'active': len(active_subs),
-        'inactive': len(subscriptions) - len(active_subs),
-        'telegram': telegram_count,
-        'email': email_count
+    user_id_str = str(user_id)
+
+    if user_id_str not in subscriptions:
+        return False
+
+    subscriptions[user_id_str]['filters'] = normalize_filters(filters)
+    subscriptions[user_id_str]['updated_at'] = datetime.now().isoformat()
+    return save_subscriptions(subscriptions)
+
+
+def get_subscription_filters(user_id):
+    """
+    Получить фильтры подписки пользователя
+
+    Returns:
+        dict: {field: list значений} (пустой dict = все заявки)
+    """
+    subscription = get_subscription(user_id) or {}
+    return subscription.get('filters') or {}
+
+
+# Индекс фильтров по активным подпискам (хранится в реестре):
+#   exact[field][value] -> set(user_id), wildcard[field] -> set(user_id) без ограничения по полю
+#   dse_prefix хранится как prefix -> set(user_id) и сопоставляется по всем префиксам ДСЕ
+def _build_filter_index(active_subs):
+    index = {
+        'exact': {field: {} for field in FILTER_FIELDS},
+        'wildcard': {field: set() for field in FILTER_FIELDS},
+        'subs': active_subs
     }
+    for user_id, data in active_subs.items():
+        filters = data.get('filters') or {}
+        for field in FILTER_FIELDS:
+            values = filters.get(field) or []
+            if not values:
+                index['wildcard'][field].add(user_id)
+                continue
+            for value in values:
+                index['exact'][field].setdefault(value, set()).add(user_id)
+    return index
+
+
+def _candidates_for_field(index, field, record):
+    exact = index['exact'][field]
+    candidates = set(index['wildcard'][field])
+    raw = record.get(field if field != 'dse_prefix' else 'dse', '')
+    value = _normalize_filter_value(field, raw or '')
+    if field == 'dse_prefix':
+        # Проверяем все префиксы ДСЕ: O(длины ДСЕ) обращений к словарю
+        for end in range(1, len(value) + 1):
+            candidates |= exact.get(value[:end], set())
+    else:
+        candidates |= exact.get(value, set())
+    return candidates
+
+
+def get_matching_user_ids(record):
+    """
+    Получить ID активных подписчиков, чьи фильтры подходят под заявку
+
+    Args:
+        record: данные заявки (rc, problem_type, dse, machine_number)
+
+    Returns:
+        set: множество user_id
+    """
+    index = _get_registry()['filter_index']
+    matched = None
+    for field in FILTER_FIELDS:
+        candidates = _candidates_for_field(index, field, record)
+        matched = candidates if matched is None else matched & candidates
+        if not matched:
+            return set()
+    return matched or set()
+
+
+def get_matching_subscribers(record):
+    """
+    Получить получателей заявки с учётом фильтров подписок
+
+    Args:
+        record: данные заявки
+
+    Returns:
+        dict: {'telegram': [user_id], 'email': [{'user_id': str, 'email': str}]}
+    """
+    index = _get_registry()['filter_index']
+    subs = index['subs']
+    telegram, email = [], []
+    for user_id in sorted(get_matching_user_ids(record)):
+        data = subs.get(user_id, {})
+        delivery_type = data.get('delivery_type')
+        if delivery_type in ['telegram', 'both']:
+            telegram.append(user_id)
+        if delivery_type in ['email', 'both'] and data.get('email'):
+            email.append({'user_id': user_id, 'email': data.get('email')})
+    return {'telegram': telegram, 'email': email}
+
@@ -0,0 +1,74 @@
+"""
+Update Processor - параллельная обработка обновлений с сохранением порядка
+Обновления разных пользователей обрабатываются одновременно (до MAX_CONCURRENT_UPDATES),
+а обновления одного пользователя — строго по очереди. Машины состояний форм
+(user_states, admin_states, registration_states) рассчитаны именно на это:
+следующий шаг формы не начнётся, пока не завершён предыдущий.
+
+Подключается через ApplicationBuilder().concurrent_updates(PerUserUpdateProcessor()).
+"""
+import asyncio
+import os
+import sys
+from typing import Any, Dict, Optional
+
+from telegram.ext import BaseUpdateProcessor
+
+# Добавляем корневую директорию проекта в sys.path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# Сколько обновлений может обрабатываться одновременно
+MAX_CONCURRENT_UPDATES = 64
+
+# Лимит базового класса: он занимает слот до do_process_update, поэтому обновления,
+# ждущие своей очереди, не должны расходовать настоящий лимит — он проверяется внутри
+_PENDING_UPDATES_LIMIT = 4096
+
+
+def get_update_key(update: Any) -> Optional[str]:
+    """
+    Ключ очереди для обновления: пользователь, иначе чат.
+    None — обновление не привязано к пользователю и может идти без очереди.
+    """
+    user = getattr(update, 'effective_user', None)
+    if user is not None:
+        return f"user:{user.id}"
+    chat = getattr(update, 'effective_chat', None)
+    if chat is not None:
+        return f"chat:{chat.id}"
+    return None
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Параллельно для разных пользователей, последовательно для одного"""
+
+    def __init__(self, max_concurrent_updates: int = MAX_CONCURRENT_UPDATES):
+        super().__init__(max(_PENDING_UPDATES_LIMIT, max_concurrent_updates))
+        self._slots = asyncio.Semaphore(max_concurrent_updates)
+        # key -> [lock, число обновлений в очереди]; запись удаляется, когда очередь пуста
+        self._queues: Dict[str, list] = {}
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_process_update(self, update, coroutine) -> None:
+        key = get_update_key(update)
+        if key is None:
+            async with self._slots:
+                await coroutine
+            return
+
+        entry = self._queues.get(key)
+        if entry is None:
+            entry = self._queues[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0], self._slots:
+                await coroutine
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                self._queues.pop(key, None)
@@ -49,6 +49,9 @@ def register_user(user_id, username, first_name, last_name):
             'registered': True
         }
         save_users_data(users_data)
+
+        from bot.permissions_manager import refresh_user_permissions
+        refresh_user_permissions(user_id, users_data[user_id])
     else:
         # Обновляем данные существующего пользователя
         users_data[user_id]['username'] = username
@@ -81,6 +84,9 @@ def set_user_role(user_id, role):
     if str(user_id) in users_data:
         users_data[str(user_id)]['role'] = role
         save_users_data(users_data)
+
+        from bot.permissions_manager import refresh_user_permissions
+        refresh_user_permissions(str(user_id), users_data[str(user_id)])
         return True
     return False
 
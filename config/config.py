@@ -2,40 +2,51 @@
 import json
 import logging
 import os
+import threading
 from datetime import datetime as dt
 from pathlib import Path
 
+from config import settings
+
 # Получаем корневую директорию проекта (на уровень выше config/)
 BASE_DIR = Path(__file__).resolve().parent.parent
 
-# Отключение лишних логов
-logging.getLogger("httpx").setLevel(logging.WARNING)
-logging.getLogger("telegram.ext.Application").setLevel(logging.WARNING)
-logging.getLogger("apscheduler").setLevel(logging.WARNING)
-
-# Настройка логирования
-logging.basicConfig(
-    format='%(asctime)s - %(message)s',
-    level=logging.INFO,
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
-
 # Файлы для хранения данных (абсолютные пути)
 DATA_DIR = BASE_DIR / "data"
 CONFIG_DIR = BASE_DIR / "config"
 LOGS_DIR = BASE_DIR / "logs"
 
-# Создаём директории если не существуют
-DATA_DIR.mkdir(exist_ok=True)
-CONFIG_DIR.mkdir(exist_ok=True)
-LOGS_DIR.mkdir(exist_ok=True)
-
 DATA_FILE = str(DATA_DIR / "bot_data.json")
 USERS_FILE = str(DATA_DIR / "users_data.json")
 CHAT_FILE = str(DATA_DIR / "chat_data.json")
 WATCHED_DSE_FILE = str(DATA_DIR / "watched_dse.json")
 PHOTOS_DIR = str(DATA_DIR / "photos")
-os.makedirs(PHOTOS_DIR, exist_ok=True) # Создаем директорию при импорте модуля
+
+# Импорт модуля не имеет побочных эффектов: директории, шаблоны файлов настроек,
+# логирование и предупреждения создаются явным вызовом init_config() при запуске.
+# Настройки (BOT_TOKEN, ADMIN_IDS, SMTP_SETTINGS, ADMIN_CREDENTIALS) читаются
+# из файлов при первом обращении — см. __getattr__ в конце модуля.
+
+
+def configure_logging():
+    """Настройка логирования процесса"""
+    # Отключение лишних логов
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    logging.getLogger("telegram.ext.Application").setLevel(logging.WARNING)
+    logging.getLogger("apscheduler").setLevel(logging.WARNING)
+
+    logging.basicConfig(
+        format='%(asctime)s - %(message)s',
+        level=logging.INFO,
+        datefmt='%Y-%m-%d %H:%M:%S'
+    )
+
+
+def ensure_directories():
+    """Создаёт рабочие директории, если их нет"""
+    for directory in (DATA_DIR, CONFIG_DIR, LOGS_DIR):
+        directory.mkdir(exist_ok=True)
+    os.makedirs(PHOTOS_DIR, exist_ok=True)
 
 
 def load_data(filename):
@@ -52,15 +63,94 @@ def load_data(filename):
 
 
 def save_data(data, filename):
-    """Сохранение данных в файл"""
+    """
+    Сохранение данных в файл
+    Запись атомарная (временный файл + os.replace): читатель в другом потоке или
+    процессе видит либо старое, либо новое содержимое, но не частично записанный файл.
+    """
+    tmp_path = f"{filename}.{os.getpid()}.{threading.get_ident()}.tmp"
     try:
-        with open(filename, 'w', encoding='utf-8') as f:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
             json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, filename)
     except Exception as e:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
         logging.error(f"Ошибка сохранения в {filename}: {e}")
         raise  # Перебрасываем исключение, чтобы вызывающая функция знала об ошибке
 
 
+# === СЧЁТЧИКИ ИДЕНТИФИКАТОРОВ ===
+# Монотонные последовательности (ID заявок, чатов, номера приглашений).
+# Хранятся в отдельном маленьком файле, чтобы выдача ID не требовала
+# перебора всех ключей основного хранилища. Файл читают и меняют несколько
+# процессов (бот, воркеры веб-интерфейса, клиент уведомлений), поэтому каждое
+# значение выдаётся под блокировкой файла sequences.json.lock: файл
+# перечитывается, счётчик увеличивается и записывается атомарно.
+SEQUENCES_FILE = str(DATA_DIR / "sequences.json")
+_sequences_lock = threading.Lock()
+
+try:
+    import fcntl
+except ImportError:  # Windows: остаётся только блокировка внутри процесса
+    fcntl = None
+
+
+def _save_sequences_atomic(sequences):
+    """Атомарная запись счётчиков (через временный файл и os.replace)"""
+    tmp_path = f"{SEQUENCES_FILE}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(sequences, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, SEQUENCES_FILE)
+
+
+def next_sequence(name: str, seed=None, count: int = 1) -> int:
+    """
+    Выдать следующее значение последовательности name.
+
+    Args:
+        name: Имя последовательности ('pending_dse_request', 'chat', 'invite')
+        seed: Необязательная функция без аргументов, возвращающая текущий
+              максимум в существующих данных. Вызывается только один раз —
+              когда счётчик ещё не сохранён (миграция старых данных).
+        count: Сколько значений зарезервировать одной записью (для пакетов)
+
+    Returns:
+        int: Новое значение (строго больше всех ранее выданных); при count > 1 —
+             первое из зарезервированных value .. value + count - 1
+    """
+    os.makedirs(os.path.dirname(SEQUENCES_FILE), exist_ok=True)
+    with _sequences_lock, open(f"{SEQUENCES_FILE}.lock", 'a') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            sequences = load_data(SEQUENCES_FILE)
+            if not isinstance(sequences, dict):
+                sequences = {}
+
+            current = sequences.get(name)
+            if current is None:
+                current = 0
+                if seed is not None:
+                    try:
+                        current = int(seed() or 0)
+                    except Exception as e:
+                        logging.error(f"Ошибка инициализации счётчика {name}: {e}")
+                        current = 0
+
+            value = int(current) + 1
+            sequences[name] = value + max(1, count) - 1
+            _save_sequences_atomic(sequences)
+            return value
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
 # --- Загрузка настроек бота из ven_bot.json ---
 def load_config_settings_bot(ven_bot: str = None):
     """
@@ -121,22 +211,23 @@ def load_config_settings_bot(ven_bot: str = None):
     return ven_bot_data
 
 
-# Загружаем настройки
-ven_bot_data = load_config_settings_bot()
+def get_bot_settings():
+    """
+    Настройки бота из config/ven_bot.json (без создания файлов и вывода).
+    Файл разбирает config.settings — с перечитыванием при изменении mtime.
+    Шаблон и предупреждения о незаполненных полях — в load_config_settings_bot() / init_config().
+    """
+    return settings.get_ven_bot_settings()
+
+
+def _get_admin_ids():
+    return settings.get_admin_ids()
 
-# Экспортируем настройки для использования в других модулях
-BOT_TOKEN = ven_bot_data.get("BOT_TOKEN", "")
-BOT_USERNAME = ven_bot_data.get("BOT_USERNAME", "")  # Username бота
 
 # Flask SECRET_KEY для сессий (генерируется автоматически если отсутствует)
 import secrets
 SECRET_KEY = secrets.token_hex(32)  # Генерирует безопасный случайный ключ
 
-# Убедимся, что ADMIN_IDS всегда список
-ADMIN_IDS = ven_bot_data.get("ADMIN_IDS", [])
-if not isinstance(ADMIN_IDS, list):
-    ADMIN_IDS = [ADMIN_IDS] if ADMIN_IDS else []
-
 # Список типов проблем
 PROBLEM_TYPES = [
     "Ошибка УП и КН",
@@ -159,17 +250,9 @@ RC_TYPES = [
     "11404"
 ]
 
-# --- Дополнительные проверки ---
-if not BOT_TOKEN or BOT_TOKEN == "YOUR_BOT_TOKEN_HERE":
-    print("❌ Критическая ошибка: BOT_TOKEN не установлен или не заполнен в ven_bot.json!")
-    # Можно вызвать sys.exit(1) здесь, если хотите, чтобы бот не запускался без токена
-
-if not ADMIN_IDS or (len(ADMIN_IDS) == 1 and ADMIN_IDS[0] == "YOUR_TELEGRAM_ID_HERE"):
-    print("⚠️  Предупреждение: ADMIN_IDS не заполнен или содержит шаблонный ID в ven_bot.json.")
-
 # === НАСТРОЙКИ SMTP ДЛЯ ОТПРАВКИ EMAIL ===
 # Эти настройки можно вынести в ven_bot.json или создать отдельный файл для них
-SMTP_SETTINGS = {
+_smtp_settings = {
     "SMTP_SERVER": "smtp.gmail.com",  # Для Gmail
     "SMTP_PORT": 587,
     "SMTP_USER": "",  # Ваш email для отправки
@@ -186,16 +269,27 @@ def load_smtp_config():
         try:
             smtp_data = load_data(smtp_file)
             if smtp_data:
-                SMTP_SETTINGS.update(smtp_data)
+                _smtp_settings.update(smtp_data)
                 return True
         except Exception as e:
             print(f"⚠️  Ошибка загрузки SMTP настроек: {e}")
     
     return False
 
-# Попытка загрузки SMTP настроек из файла
-if not load_smtp_config():
-    # Если файл не существует, создаем шаблон
+_smtp_loaded = False
+
+
+def get_smtp_settings():
+    """Настройки SMTP (smtp_config.json загружается при первом обращении)"""
+    global _smtp_loaded
+    if not _smtp_loaded:
+        _smtp_loaded = True
+        load_smtp_config()
+    return _smtp_settings
+
+
+def create_smtp_config_template():
+    """Создаёт шаблон smtp_config.json, если файла нет"""
     smtp_template = {
         "SMTP_SERVER": "smtp.gmail.com",
         "SMTP_PORT": 587,
@@ -216,9 +310,10 @@ if not load_smtp_config():
 # Проверка заполненности SMTP настроек
 def is_smtp_configured():
     """Проверяет, настроена ли отправка email"""
-    return (SMTP_SETTINGS.get("SMTP_USER") and 
-            SMTP_SETTINGS.get("SMTP_PASSWORD") and
-            SMTP_SETTINGS["SMTP_USER"] != "your_email@gmail.com")
+    smtp_settings = get_smtp_settings()
+    return (smtp_settings.get("SMTP_USER") and 
+            smtp_settings.get("SMTP_PASSWORD") and
+            smtp_settings["SMTP_USER"] != "your_email@gmail.com")
 
 
 # === НАСТРОЙКИ АДМИНОВ ДЛЯ ВЕБ-ИНТЕРФЕЙСА ===
@@ -237,9 +332,10 @@ def generate_password_hash(password: str) -> str:
 #     'admin_user_id': 'admin_web'  # ID для веб-админа
 # }
 
-# Инициализация словаря сохранённых учётных данных веб-админов.
+# Словарь сохранённых учётных данных веб-админов (загружается при первом обращении).
 # Если файл с учётными данными отсутствует, словарь остаётся пустым.
-ADMIN_CREDENTIALS = {}
+_admin_credentials = {}
+_admin_credentials_loaded = False
 
 # Можно добавить больше админов:
 # ADMIN_CREDENTIALS['superadmin'] = generate_password_hash('super_secret_password')
@@ -280,12 +376,14 @@ def save_admin_credentials(username: str, password_hash: str, telegram_user_id:
     else:
         print(f"✅ Веб-пользователь '{username}' сохранён в {credentials_file}")
 
-def load_admin_credentials():
+def load_admin_credentials(verbose: bool = False):
     """Загружает учётные данные из файла"""
     import json
     import os
+    global _admin_credentials_loaded
     
     credentials_file = 'web_credentials.json'
+    _admin_credentials_loaded = True
     
     if os.path.exists(credentials_file):
         try:
@@ -294,20 +392,64 @@ def load_admin_credentials():
             
             # Обновление ADMIN_CREDENTIALS
             for username, creds in data.items():
-                ADMIN_CREDENTIALS[username] = creds['password_hash']
-                print(f"Загружен веб-пользователь: {username}")
+                _admin_credentials[username] = creds['password_hash']
                 # Используем telegram_user_id если есть, иначе user_id
                 user_id = creds.get('telegram_user_id') or creds.get('user_id')
-                print(f" - Привязан к Telegram ID: {user_id}")
-                ADMIN_CREDENTIALS[f'{username}_user_id'] = user_id
-                print(f" - Роль: {creds.get('role', 'initiator')}")
+                _admin_credentials[f'{username}_user_id'] = user_id
                 # Добавляем роль
-                ADMIN_CREDENTIALS[f'{username}_role'] = creds.get('role', 'initiator')
+                _admin_credentials[f'{username}_role'] = creds.get('role', 'initiator')
             
-            print(f"✅ Загружено {len(data)} веб-пользователей из {credentials_file}")
+            if verbose:
+                print(f"✅ Загружено {len(data)} веб-пользователей из {credentials_file}")
         except Exception as e:
             print(f"⚠️  Ошибка загрузки веб-пользователей: {e}")
 
-# Загрузка сохранённых учётных данных при старте
-load_admin_credentials()
 
+def get_admin_credentials():
+    """Учётные данные веб-пользователей (файл читается при первом обращении)"""
+    if not _admin_credentials_loaded:
+        load_admin_credentials()
+    return _admin_credentials
+
+
+def init_config():
+    """
+    Явная инициализация при запуске процесса (бот, веб-интерфейс):
+    логирование, директории, шаблоны файлов настроек и проверка обязательных полей.
+    """
+    configure_logging()
+    ensure_directories()
+
+    load_config_settings_bot()
+    # Шаблон мог быть только что создан или дополнен — перечитываем немедленно
+    settings.reload_settings()
+
+    bot_token = settings.get_bot_token()
+    admin_ids = settings.get_admin_ids()
+    if not bot_token or bot_token == "YOUR_BOT_TOKEN_HERE":
+        print("❌ Критическая ошибка: BOT_TOKEN не установлен или не заполнен в ven_bot.json!")
+    if not admin_ids or (len(admin_ids) == 1 and admin_ids[0] == "YOUR_TELEGRAM_ID_HERE"):
+        print("⚠️  Предупреждение: ADMIN_IDS не заполнен или содержит шаблонный ID в ven_bot.json.")
+
+    if not os.path.exists(str(CONFIG_DIR / "smtp_config.json")):
+        create_smtp_config_template()
+
+    load_admin_credentials(verbose=True)
+
+
+# Настройки, которые читаются из файлов при обращении (ven_bot.json — через config.settings)
+_LAZY_SETTINGS = {
+    'ven_bot_data': get_bot_settings,
+    'BOT_TOKEN': settings.get_bot_token,
+    'BOT_USERNAME': settings.get_bot_username,  # Username бота
+    'ADMIN_IDS': settings.get_admin_ids,
+    'SMTP_SETTINGS': get_smtp_settings,
+    'ADMIN_CREDENTIALS': get_admin_credentials,
+}
+
+
+def __getattr__(name):
+    factory = _LAZY_SETTINGS.get(name)
+    if factory is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return factory()
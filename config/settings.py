@@ -0,0 +1,273 @@
+"""
+Единый сервис настроек
+Разбирает config/domain.conf и config/ven_bot.json один раз, отдаёт типизированные
+значения из памяти и перечитывает файлы только при изменении mtime
+(проверка не чаще чем раз в RELOAD_CHECK_INTERVAL секунд).
+"""
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+CONFIG_DIR = Path(__file__).resolve().parent
+DOMAIN_CONF_FILE = str(CONFIG_DIR / "domain.conf")
+VEN_BOT_FILE = str(CONFIG_DIR / "ven_bot.json")
+
+# Как часто (в секундах) проверять mtime файлов настроек
+RELOAD_CHECK_INTERVAL = 5.0
+
+_TRUE_VALUES = {'true', '1', 'yes', 'on'}
+
+_lock = threading.Lock()
+_cache: Dict[str, Dict[str, Any]] = {}
+_last_check = 0.0
+_web_base_url: Optional[str] = None
+
+
+def _file_mtime(path: str) -> Optional[float]:
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+def _parse_domain_conf(path: str) -> Dict[str, str]:
+    """Разобрать файл формата KEY=VALUE (строки с # — комментарии)"""
+    values = {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#') or '=' not in line:
+                    continue
+                key, value = line.split('=', 1)
+                values[key.strip()] = value.strip()
+    except Exception as e:
+        print(f"⚠️  Ошибка чтения {path}: {e}")
+    return values
+
+
+def _parse_json(path: str) -> Dict[str, Any]:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except Exception as e:
+        print(f"⚠️  Ошибка чтения {path}: {e}")
+        return {}
+
+
+_SOURCES = {
+    'domain': (DOMAIN_CONF_FILE, _parse_domain_conf),
+    'ven_bot': (VEN_BOT_FILE, _parse_json),
+}
+
+
+def _refresh(force: bool = False) -> None:
+    """Перечитать изменившиеся файлы настроек (вызывается под _lock)"""
+    global _last_check, _web_base_url
+    now = time.monotonic()
+    if not force and _cache and now - _last_check < RELOAD_CHECK_INTERVAL:
+        return
+    _last_check = now
+
+    changed = False
+    for name, (path, parser) in _SOURCES.items():
+        mtime = _file_mtime(path)
+        cached = _cache.get(name)
+        if cached is not None and cached['mtime'] == mtime:
+            continue
+        _cache[name] = {
+            'mtime': mtime,
+            'values': parser(path) if mtime is not None else {}
+        }
+        changed = True
+
+    if changed:
+        _web_base_url = None
+
+
+def _values(name: str) -> Dict[str, Any]:
+    with _lock:
+        _refresh()
+        return _cache[name]['values']
+
+
+def reload_settings() -> None:
+    """Принудительно перечитать все файлы настроек"""
+    with _lock:
+        _refresh(force=True)
+
+
+# === domain.conf ===
+
+def get_domain() -> Optional[str]:
+    """Домен веб-интерфейса (None, если не задан или localhost)"""
+    domain = _values('domain').get('DOMAIN', '')
+    return domain if domain and domain != 'localhost' else None
+
+
+def get_web_port() -> int:
+    """Порт веб-интерфейса (domain.conf, затем переменная окружения WEB_PORT, по умолчанию 5000)"""
+    value = _values('domain').get('WEB_PORT') or os.getenv('WEB_PORT', '5000')
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 5000
+
+
+def is_ssl_enabled() -> bool:
+    return str(_values('domain').get('SSL_ENABLED', '')).lower() in _TRUE_VALUES
+
+
+def is_self_signed() -> bool:
+    return str(_values('domain').get('SELF_SIGNED', '')).lower() in _TRUE_VALUES
+
+
+def get_web_base_url() -> str:
+    """Базовый URL веб-интерфейса (кэшируется до изменения domain.conf)"""
+    global _web_base_url
+    with _lock:
+        _refresh()
+        if _web_base_url is not None:
+            return _web_base_url
+
+    domain = get_domain()
+    port = get_web_port()
+    scheme = 'https' if is_ssl_enabled() else 'http'
+    if not domain:
+        url = f"{scheme}://localhost:{port}"
+    elif (scheme == 'http' and port == 80) or (scheme == 'https' and port == 443):
+        url = f"{scheme}://{domain}"
+    else:
+        url = f"{scheme}://{domain}:{port}"
+
+    with _lock:
+        _web_base_url = url
+    return url
+
+
+# === ven_bot.json ===
+
+def get_bot_setting(key: str, default: Any = None) -> Any:
+    """Произвольное значение из ven_bot.json"""
+    return _values('ven_bot').get(key, default)
+
+
+def get_ven_bot_settings() -> Dict[str, Any]:
+    """Копия настроек ven_bot.json с обязательными полями (BOT_TOKEN, ADMIN_IDS, BOT_USERNAME)"""
+    data = {"BOT_TOKEN": "", "ADMIN_IDS": [], "BOT_USERNAME": ""}
+    data.update(_values('ven_bot'))
+    return data
+
+
+def get_bot_token() -> str:
+    """Токен бота (ven_bot.json: BOT_TOKEN)"""
+    return get_bot_setting('BOT_TOKEN', '') or ''
+
+
+def get_bot_username() -> str:
+    """Username бота для веб-интерфейса (ven_bot.json: BOT_USERNAME)"""
+    return get_bot_setting('BOT_USERNAME', '') or ''
+
+
+def get_admin_ids() -> list:
+    """ID администраторов (ven_bot.json: ADMIN_IDS), всегда список"""
+    admin_ids = get_bot_setting('ADMIN_IDS', [])
+    if not isinstance(admin_ids, list):
+        admin_ids = [admin_ids] if admin_ids else []
+    return list(admin_ids)
+
+
+def is_web_enabled() -> bool:
+    """Запускать ли веб-интерфейс вместе с ботом (ven_bot.json: web_enabled)"""
+    value = get_bot_setting('web_enabled', True)
+    if isinstance(value, str):
+        return value.lower() in _TRUE_VALUES
+    return bool(value)
+
+
+def get_bot_web_port() -> int:
+    """Порт веб-интерфейса при запуске из бота (ven_bot.json: web_port, иначе domain.conf)"""
+    value = get_bot_setting('web_port')
+    if value is None:
+        return get_web_port()
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return get_web_port()
+
+
+def _int_setting(key: str, default: int) -> int:
+    try:
+        return int(get_bot_setting(key, default))
+    except (TypeError, ValueError):
+        return default
+
+
+# === Режим получения обновлений и веб-сервер ===
+
+def get_bot_mode() -> str:
+    """Режим получения обновлений: 'polling' (по умолчанию) или 'webhook' (ven_bot.json: bot_mode)"""
+    mode = str(get_bot_setting('bot_mode', 'polling')).lower()
+    return mode if mode in ('polling', 'webhook') else 'polling'
+
+
+def get_webhook_path() -> str:
+    """Путь webhook без ведущего '/' (ven_bot.json: webhook_path)"""
+    return str(get_bot_setting('webhook_path', 'telegram-webhook')).strip('/')
+
+
+def get_webhook_listen() -> str:
+    """Адрес, на котором слушает сервер webhook (за nginx — 127.0.0.1)"""
+    return str(get_bot_setting('webhook_listen', '127.0.0.1'))
+
+
+def get_webhook_port() -> int:
+    """Порт локального сервера webhook (ven_bot.json: webhook_port)"""
+    return _int_setting('webhook_port', 8443)
+
+
+def get_webhook_secret() -> Optional[str]:
+    """Секрет для заголовка X-Telegram-Bot-Api-Secret-Token (ven_bot.json: webhook_secret)"""
+    return get_bot_setting('webhook_secret') or None
+
+
+def get_webhook_url() -> Optional[str]:
+    """
+    Публичный URL webhook (ven_bot.json: webhook_url, иначе https://DOMAIN/webhook_path)
+
+    Порт веб-интерфейса (WEB_PORT) сюда не входит: webhook принимает nginx на 443
+    и проксирует на webhook_port. None — домен не задан, URL нужно указать явно.
+    """
+    url = get_bot_setting('webhook_url')
+    if url:
+        return str(url)
+    domain = get_domain()
+    if not domain:
+        return None
+    return f"https://{domain}/{get_webhook_path()}"
+
+
+def get_web_server() -> str:
+    """Сервер веб-интерфейса: 'gunicorn' (по умолчанию) или 'flask' (dev-сервер)"""
+    server = str(get_bot_setting('web_server', 'gunicorn')).lower()
+    return server if server in ('gunicorn', 'flask') else 'gunicorn'
+
+
+def get_web_workers() -> int:
+    """Количество worker-процессов gunicorn (ven_bot.json: web_workers)"""
+    return max(1, _int_setting('web_workers', 1))
+
+
+def get_web_worker_class() -> str:
+    """Класс worker'ов gunicorn (eventlet нужен для WebSocket терминала)"""
+    return str(get_bot_setting('web_worker_class', 'eventlet'))
+
+
+def get_state_backend() -> str:
+    """Хранение состояний диалогов: 'sqlite' (по умолчанию, переживает перезапуск) или 'memory'"""
+    backend = str(get_bot_setting('state_backend', 'sqlite')).lower()
+    return backend if backend in ('sqlite', 'memory') else 'sqlite'
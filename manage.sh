@@ -266,7 +266,7 @@ start_web_terminal() {
     echo ""
     
     cd $PROJECT_DIR
-    gunicorn --worker-class eventlet -w 1 \
+    gunicorn --worker-class eventlet -w ${WEB_WORKERS:-1} \
         --bind 0.0.0.0:$WEB_PORT \
         --access-logfile - \
         --error-logfile - \